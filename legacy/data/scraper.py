@@ -2,8 +2,8 @@ import logging
 
 import json
 import arrow
-import requests
 
+import tab_client
 from data.race import save_race, list_race_dates, delete_oldest
 
 logger = logging.getLogger(__name__)
@@ -34,9 +34,7 @@ def scrape_history(lst, dt_target, red):
         dt_target.format('YYYY-MM-DD'))
     logger.info('Scraping {}'.format(url))
 
-    meetings = requests.get(url)
-    meetings.raise_for_status()
-    meetings = meetings.json()
+    meetings = tab_client.get_json(url)
     logger.info('Found {} results'.format(len(meetings)))
 
     for meeting in meetings['meetings']:
@@ -49,7 +47,7 @@ def scrape_history(lst, dt_target, red):
 
             url = race_basic['_links']['self']
             logger.info('Scraping race {}'.format(url))
-            race = requests.get(url)
+            race = tab_client.get(url)
             try:
                 race.raise_for_status()
             except Exception as e:
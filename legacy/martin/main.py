@@ -6,9 +6,10 @@ from copy import deepcopy
 from statistics import mean, stdev
 
 import arrow
-import requests
 from terminaltables import SingleTable
 
+import tab_client
+
 logger = logging.getLogger(__name__)
 
 # race data
@@ -86,9 +87,7 @@ def update_races():
      - scrape details so that avg place bet can be calculated"""
     url = 'https://api.beta.tab.com.au/v1/tab-info-service/racing/next-to-go/races?jurisdiction=NSW'
     logger.debug('scraping {}'.format(url))
-    res = requests.get(url)
-    res.raise_for_status()
-    res = res.json()
+    res = tab_client.get_json(url)
     races = res['races']
     logger.debug('{} races scraped'.format(len(races)))
 
@@ -111,9 +110,7 @@ def update_races():
 
 def update_details(race):
     """Get details (aka runners) for race"""
-    res = requests.get(race['_links']['self'])
-    res.raise_for_status()
-    res = res.json()
+    res = tab_client.get_json(race['_links']['self'])
     # print(json.dumps(res, indent=4, default=str, sort_keys=True))
     # raise Exception('update_runners')
     logger.debug('Details updated for {}'.format(title(race)))
@@ -0,0 +1,30 @@
+import logging
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# timeouts (connect, read)
+TIMEOUT = (5, 20)
+
+# pooled keep-alive session shared by every TAB call
+session = requests.Session()
+session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=1))
+session.headers.update({
+    'Accept': 'application/json',
+    'Accept-Encoding': 'gzip, deflate',
+})
+
+
+def get(url):
+    """get over the pooled session"""
+    logger.debug('getting {}'.format(url))
+    return session.get(url, timeout=TIMEOUT)
+
+
+def get_json(url):
+    """get json over the pooled session"""
+    res = get(url)
+    res.raise_for_status()
+    return res.json()
@@ -8,6 +8,7 @@ import arrow
 import requests
 from terminaltables import SingleTable
 
+import tab_client
 from constants import *
 
 logger = logging.getLogger(__name__)
@@ -206,9 +207,7 @@ def get_balance(s):
 def update_races():
     url = 'https://api.beta.tab.com.au/v1/tab-info-service/racing/next-to-go/races?jurisdiction=NSW'
     logger.debug('scraping {}'.format(url))
-    res = requests.get(url)
-    res.raise_for_status()
-    res = res.json()
+    res = tab_client.get_json(url)
     races = res['races']
     logger.debug('{} races scraped'.format(len(races)))
 
@@ -258,9 +257,7 @@ def wait_for_next(race):
 def get_details(race):
     """Get details (aka runners) for race"""
     # runners
-    res = requests.get(race['_links']['self'])
-    res.raise_for_status()
-    res = res.json()
+    res = tab_client.get_json(race['_links']['self'])
     # print(json.dumps(res, indent=4, default=str, sort_keys=True))
     # raise Exception('get_details')
     return res
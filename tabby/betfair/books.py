@@ -0,0 +1,77 @@
+"""
+Deduplicated Book storage.
+
+Consecutive polls of a market mostly return the same prices. The last stored
+state of every market is kept in the cache: a snapshot with the same version,
+total matched and runner states only extends `seen_until` of the stored Book,
+otherwise a new Book is stored with the RunnerBooks of just the runners that
+moved. The version is not bumped by price moves, so a runner state holds its
+best prices and a hash of its full depth ladders and traded volume.
+`Market.runner_books(at)` rebuilds the full state at any time from the deltas.
+"""
+import hashlib
+import logging
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Book, Runner, RunnerBook
+
+logger = logging.getLogger(__name__)
+
+STATE_TIMEOUT = 6 * 60 * 60
+
+
+def state_key(market):
+    return f'book_state_{market.pk}'
+
+
+def runner_state(row):
+    """What has to move for a runner book to be stored"""
+    book = row['book']
+    depth = hashlib.sha1(repr((
+        book.get('total_matched'), book.get('atb'), book.get('atl'), book.get('trd'))).encode()).hexdigest()
+    return book['status'], book['back_price'], book['lay_price'], book['last_price_traded'], depth
+
+
+def market_state(fields):
+    return fields['version'], fields['total_matched']
+
+
+def store_book(market, fields, rows, seen_at=None):
+    """
+    Store a snapshot of the market given as Book field values and runner rows of
+    {'selection_id', 'book': RunnerBook field values}.
+    Returns the new Book, or None when nothing moved since the stored state.
+    """
+    seen_at = seen_at or timezone.now()
+    key = state_key(market)
+    state = cache.get(key)
+    runners = {row['selection_id']: runner_state(row) for row in rows}
+
+    if state and state.get('market') == market_state(fields) and state.get('runners') == runners:
+        Book.objects.filter(pk=state['book_id']).update(seen_until=seen_at)
+        logger.info(f'Book of {market} unchanged since {state["book_id"]}')
+        return None
+
+    # without a stored state every runner is written
+    previous = state.get('runners', {}) if state else {}
+    changed = [row for row in rows if previous.get(row['selection_id']) != runners[row['selection_id']]]
+    book = Book.objects.create(market=market, seen_at=seen_at, seen_until=seen_at, **fields)
+
+    runner_ids = Runner.objects.resolve([row['selection_id'] for row in changed])
+    rbooks = []
+    for row in changed:
+        runner_id = runner_ids.get(row['selection_id'])
+        if not runner_id:
+            logger.error(f'Could not find runner for {row["selection_id"]}')
+            continue
+        rbooks.append(RunnerBook(book=book, runner_id=runner_id, **row['book']))
+    RunnerBook.objects.bulk_create(rbooks)
+
+    # only remember the state once it is committed
+    new_state = {'market': market_state(fields), 'book_id': book.pk, 'runners': runners}
+    transaction.on_commit(lambda: cache.set(key, new_state, STATE_TIMEOUT))
+    logger.info(f'Stored {book} with {len(rbooks)} of {len(rows)} runners changed')
+    return book
@@ -1,29 +1,151 @@
+"""
+Betfair API client.
+
+Every process keeps one APIClient over a pooled `requests.Session`, while the
+session token is shared by all processes through the cache: a worker only
+logs in when no session is cached, and the cached session is kept alive
+before it expires. Refreshing takes a cache lock, so one process refreshes
+while the others carry on with the token they have.
+"""
 import datetime
 import json
+import logging
+import os
+from time import sleep, time
 
 import requests
 from betfairlightweight import APIClient
 from betfairlightweight.endpoints.baseendpoint import BaseEndpoint
 from betfairlightweight.filters import market_filter
 from betfairlightweight.filters import price_projection, price_data, time_range
+from django.core.cache import cache
 from django.utils import timezone
+from requests.adapters import HTTPAdapter
 
 from .secrets import APP_KEY_DEV, APP_URL_LOGIN, USERNAME, PASSWORD, APP_CERTS_DIR
 
+logger = logging.getLogger(__name__)
 
 BaseEndpoint.connect_timeout = 10
 BaseEndpoint.read_timeout = 30
 
-trading = APIClient(USERNAME, PASSWORD, APP_KEY_DEV, APP_CERTS_DIR)
-
 ET_HORSE_RACING = 7
 ET_GREYHOUND_RACING = 4339
 
+POOL_CONNECTIONS = 4
+POOL_MAXSIZE = 16
+SESSION_KEY = 'betfair_session'
+SESSION_LOCK_KEY = 'betfair_session_lock'
+# longest a refresh may hold the lock
+LOCK_TIMEOUT = 30
+# sessions are kept alive once half their lifetime passed
+REFRESH_AFTER = 0.5
+# keep_alive_session refreshes this early, so betting does not wait on a refresh
+REFRESH_AHEAD = 60 * 60
+
+
+class SessionLocked(Exception):
+    pass
+
+
+def create_client():
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE, max_retries=1)
+    session.mount('https://', adapter)
+    return APIClient(USERNAME, PASSWORD, APP_KEY_DEV, APP_CERTS_DIR, session=session)
+
+
+_client = None
+_client_pid = None
+
+
+def get_process_client():
+    """Client of the current process, prefork children never share sockets"""
+    global _client, _client_pid
+    if _client is None or _client_pid != os.getpid():
+        _client = create_client()
+        _client_pid = os.getpid()
+    return _client
+
 
 def get_betfair_client():
-    if not trading.session_token:
-        trading.login()
-    return trading
+    """Client of the current process with the shared session, logging in only when there is none"""
+    client = get_process_client()
+    session = cache.get(SESSION_KEY)
+    if session is None or time() >= session['refresh_at']:
+        session = refresh_session(client, session)
+    client.session_token = session['token']
+    return client
+
+
+def refresh_session(client, session=None, ahead=0):
+    """
+    Keep the shared session alive, or log in without one, one process at a time.
+    With `ahead` seconds a session that is due within that time is refreshed early.
+    """
+    if not cache.add(SESSION_LOCK_KEY, os.getpid(), LOCK_TIMEOUT):
+        # another process is refreshing, a session that did not expire yet can still be used
+        if session and time() < session['expires_at']:
+            return session
+        return wait_for_session()
+    try:
+        # the session could have been refreshed since it was read
+        current = cache.get(SESSION_KEY)
+        if current and time() < current['refresh_at'] - ahead:
+            return current
+        session = current or session
+        if session and time() < session['expires_at']:
+            client.session_token = session['token']
+            try:
+                client.keep_alive()
+                logger.warning('Betfair session kept alive')
+            except Exception as exc:
+                logger.warning(f'Betfair keep alive failed, logging in: {exc}')
+                client.login()
+        else:
+            client.login()
+            logger.warning('Betfair logged in')
+        return store_session(client)
+    finally:
+        cache.delete(SESSION_LOCK_KEY)
+
+
+def renew_session(token):
+    """Log in again when the shared session is the rejected token, returns the token to use"""
+    if not cache.add(SESSION_LOCK_KEY, os.getpid(), LOCK_TIMEOUT):
+        return wait_for_session()['token']
+    try:
+        current = cache.get(SESSION_KEY)
+        if current and current['token'] != token:
+            return current['token']
+        client = get_process_client()
+        client.login()
+        logger.warning('Betfair logged in, the session was rejected')
+        return store_session(client)['token']
+    finally:
+        cache.delete(SESSION_LOCK_KEY)
+
+
+def store_session(client):
+    now = time()
+    session = {
+        'token': client.session_token,
+        'refresh_at': now + client.session_timeout * REFRESH_AFTER,
+        'expires_at': now + client.session_timeout,
+    }
+    cache.set(SESSION_KEY, session, client.session_timeout)
+    return session
+
+
+def wait_for_session():
+    """Session stored by the process holding the lock"""
+    deadline = time() + LOCK_TIMEOUT
+    while time() < deadline:
+        session = cache.get(SESSION_KEY)
+        if session and time() < session['expires_at']:
+            return session
+        sleep(0.1)
+    raise SessionLocked('Timed out waiting for the Betfair session')
 
 
 def custom_login():
@@ -44,14 +166,14 @@ def custom_login():
 
 def login():
     """login to betfair"""
-    res = trading.login()
-    print(res.login_status)
-    print(res.session_token)
+    trading = get_betfair_client()
+    print(trading.session_token)
+    return trading
 
 
 def list_event_types():
     """list event types"""
-    login()
+    trading = login()
     res = trading.betting.list_event_types()
     for item in res:
         print(f'market count: {item.market_count}')
@@ -60,7 +182,7 @@ def list_event_types():
 
 def list_market_types():
     """market types"""
-    login()
+    trading = login()
     res = trading.betting.list_market_types()
     for item in res:
         print(f'market count: {item.market_count}')
@@ -68,7 +190,7 @@ def list_market_types():
 
 
 def list_venues():
-    login()
+    trading = login()
     mfilter = market_filter(
         event_type_ids=[ET_GREYHOUND_RACING, ET_HORSE_RACING],
     )
@@ -102,8 +224,8 @@ def list_market_cat(event_id=None, market_id=None):
     mfilter = market_filter(
         event_type_ids=[ET_HORSE_RACING, ET_GREYHOUND_RACING],
         market_start_time=time_range(
-            from_=time_ago.strftime('%Y-%m-%dT%H:%I:%S.000Z'),
-            to=time_fwd.strftime('%Y-%m-%dT%H:%I:%S.000Z')
+            from_=time_ago.strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+            to=time_fwd.strftime('%Y-%m-%dT%H:%M:%S.000Z')
         )
     )
     res = trading.betting.list_market_catalogue(
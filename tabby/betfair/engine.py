@@ -0,0 +1,172 @@
+"""
+Event-loop betting engine.
+
+Keeps a timer per upcoming race linked to a WIN market, firing at fixed
+offsets before the jump instead of the minute beat of run_bet. Ahead of every
+offset the orders of the race are staged over and over from the latest
+snapshot, priced and diffed against the live bets, so at the offset only the
+exchange calls are left to make. Exchange calls run on a thread pool and all
+database work goes through the single Writer, the ORM is never touched from
+the event loop itself. Every new bet records the seconds from the trigger to
+the exchange acknowledgement.
+"""
+import asyncio
+import datetime
+import logging
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+
+from django.core.cache import cache
+from django.utils import timezone
+
+from tab.models import Race
+from tab.writer import Writer
+from .client import get_betfair_client
+from .orders import diff_orders, live_orders, send_orders, store_orders
+from .snapshot import race_snapshot
+from .tasks import ENGINE_KEY, MARGIN_BRACKETS, desired_orders
+
+logger = logging.getLogger(__name__)
+
+# seconds before the jump the orders are sent
+OFFSETS = [240, 180, 120, 60, 30, 10]
+# races starting within this many seconds get a timer
+HORIZON = 10 * 60
+REFRESH = 30
+# staging starts this many seconds before an offset and repeats every interval
+STAGE_AHEAD = 15
+STAGE_INTERVAL = 2
+HTTP_WORKERS = 8
+
+Staged = namedtuple('Staged', ['market', 'diff', 'bracket', 'staged_at'])
+
+
+def upcoming_races(horizon):
+    """Start times of the races linked to a WIN market starting within the horizon"""
+    now = timezone.now()
+    return dict(Race.objects.filter(
+        start_time__gt=now,
+        start_time__lte=now + datetime.timedelta(seconds=horizon),
+        market__market_type='WIN',
+    ).values_list('pk', 'start_time'))
+
+
+def stage(race_pk, offset):
+    """Orders of the race priced for the offset, diffed against the live bets"""
+    if not cache.get('betting'):
+        logger.info('$$$ No betting')
+        return None
+    snap = race_snapshot(race_pk)
+    if not snap.market:
+        return None
+    bracket = offset // 60
+    margin = MARGIN_BRACKETS.get(bracket)
+    if not margin:
+        logger.error(f'$$$ Huge minutes for {snap.market}: {bracket}')
+        return None
+    desired = desired_orders(snap, margin, bracket)
+    return Staged(snap.market, diff_orders(desired, live_orders(snap.market)), bracket, time())
+
+
+def send(market, diff):
+    return send_orders(get_betfair_client(), market, diff)
+
+
+class BettingEngine:
+
+    def __init__(self, offsets=OFFSETS, horizon=HORIZON, refresh=REFRESH, stage_ahead=STAGE_AHEAD,
+                 stage_interval=STAGE_INTERVAL, send=send, writer=None, clock=time, sleep=asyncio.sleep):
+        self.offsets = sorted(offsets, reverse=True)
+        self.horizon = horizon
+        self.refresh = refresh
+        self.stage_ahead = stage_ahead
+        self.stage_interval = stage_interval
+        self.send = send
+        self.clock = clock
+        self.sleep = sleep
+        # race pk to start timestamp, and the timer task of every race
+        self.starts = {}
+        self.timers = {}
+        self.fired = 0
+        self.errors = 0
+        self.http = ThreadPoolExecutor(max_workers=HTTP_WORKERS, thread_name_prefix='engine-http')
+        self.db = writer or Writer()
+
+    def run(self):
+        asyncio.run(self.main())
+
+    async def main(self):
+        while True:
+            try:
+                await self.refresh_races()
+            except Exception as exc:
+                logger.error(f'Refreshing races failed: {exc}')
+            await self.sleep(self.refresh)
+
+    async def refresh_races(self):
+        """Start a timer for every new upcoming race, and follow start times that moved"""
+        # run_bet leaves the betting to the engine while this is set
+        cache.set(ENGINE_KEY, os.getpid(), self.refresh * 3)
+        races = await self.call(self.db, upcoming_races, self.horizon)
+        for pk, start_time in races.items():
+            self.starts[pk] = start_time.timestamp()
+            if pk not in self.timers:
+                self.timers[pk] = asyncio.ensure_future(self.race_timer(pk))
+        logger.info(f'{len(self.timers)} race timers running')
+
+    async def race_timer(self, pk):
+        try:
+            for offset in self.offsets:
+                await self.fire_at(pk, offset)
+        finally:
+            self.timers.pop(pk, None)
+            self.starts.pop(pk, None)
+
+    def fire_time(self, pk, offset):
+        return self.starts[pk] - offset
+
+    async def fire_at(self, pk, offset):
+        """Stage the orders of the race till the offset before its jump, then send the last staged"""
+        if self.fire_time(pk, offset) < self.clock():
+            return
+        staged = None
+        while True:
+            left = self.fire_time(pk, offset) - self.clock()
+            if left > self.stage_ahead:
+                # wake up on refresh too, the start time can move
+                await self.sleep(min(left - self.stage_ahead, self.refresh))
+                continue
+            try:
+                staged = await self.call(self.db, stage, pk, offset)
+            except Exception as exc:
+                logger.error(f'$$$ Staging race {pk} failed: {exc}')
+            if self.fire_time(pk, offset) - self.clock() <= self.stage_interval:
+                break
+            await self.sleep(self.stage_interval)
+        await self.sleep(max(0, self.fire_time(pk, offset) - self.clock()))
+        if staged:
+            await self.fire(pk, offset, staged)
+
+    async def fire(self, pk, offset, staged):
+        """Send the staged instructions and store what the exchange acknowledged"""
+        triggered_at = self.clock()
+        try:
+            results, errors = await self.call(self.http, self.send, staged.market, staged.diff)
+            created = await self.call(
+                self.db, store_orders, staged.market, staged.diff, results, errors, triggered_at)
+        except Exception as exc:
+            self.errors += 1
+            logger.error(f'$$$ Firing race {pk} {offset}s out failed: {exc}')
+            return
+        self.fired += 1
+        if errors:
+            self.errors += 1
+            logger.error(f'$$$ Market {staged.market.market_id}: {"; ".join(errors)}')
+        latency = max((bet.latency for bet in created), default=0)
+        logger.warning(f'$$$ Fired {staged.market} {offset}s out, staged {triggered_at - staged.staged_at:.2f}s '
+                       f'before, {len(created)} bets acknowledged within {latency:.3f}s')
+
+    async def call(self, executor, func, *args):
+        return await asyncio.get_event_loop().run_in_executor(executor, func, *args)
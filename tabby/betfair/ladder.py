@@ -0,0 +1,67 @@
+"""
+Betfair price ladder.
+
+The exchange only accepts the 350 prices from 1.01 to 1000, with the increment
+growing by band. They are precomputed once into a sorted array, so snapping
+and tick arithmetic are `searchsorted` lookups that price a whole field of
+runners in one call. Prices outside the ladder are clipped to its ends.
+"""
+import numpy as np
+
+# (upper bound, increment) of every band, starting from 1.01
+BANDS = [
+    (2, 0.01),
+    (3, 0.02),
+    (4, 0.05),
+    (6, 0.1),
+    (10, 0.2),
+    (20, 0.5),
+    (30, 1),
+    (50, 2),
+    (100, 5),
+    (1000, 10),
+]
+MIN_PRICE = 1.01
+MAX_PRICE = 1000
+
+
+def build_prices():
+    """All valid prices, stepped in hundredths so no float error creeps in"""
+    cents = [101]
+    for upper, increment in BANDS:
+        step = round(increment * 100)
+        cents.extend(range(cents[-1] + step, upper * 100 + 1, step))
+    return np.array(cents) / 100
+
+
+PRICES = build_prices()
+# tolerance for prices that are a float error off a tick
+EPS = 1e-9
+
+
+def snap_up(prices):
+    """Lowest tick at or above every price"""
+    index = np.searchsorted(PRICES, np.asarray(prices, dtype=float) - EPS, side='left')
+    return PRICES[np.clip(index, 0, len(PRICES) - 1)]
+
+
+def snap_down(prices):
+    """Highest tick at or below every price"""
+    index = np.searchsorted(PRICES, np.asarray(prices, dtype=float) + EPS, side='right') - 1
+    return PRICES[np.clip(index, 0, len(PRICES) - 1)]
+
+
+def tick_index(prices):
+    """Position on the ladder of every price, prices between ticks count as the tick below"""
+    index = np.searchsorted(PRICES, np.asarray(prices, dtype=float) + EPS, side='right') - 1
+    return np.clip(index, 0, len(PRICES) - 1)
+
+
+def move_ticks(prices, ticks):
+    """Prices moved up (or down, when negative) the number of ticks, stopping at the ends"""
+    return PRICES[np.clip(tick_index(prices) + ticks, 0, len(PRICES) - 1)]
+
+
+def ticks_between(from_prices, to_prices):
+    """Ticks from one price to the other, negative when it is lower"""
+    return tick_index(to_prices) - tick_index(from_prices)
@@ -0,0 +1,39 @@
+from time import time
+
+from django.core.management.base import BaseCommand
+
+from ... import standin
+from ...stream import StreamConsumer
+
+
+class Command(BaseCommand):
+    help = 'Measure stream messages per second against a local stand-in Betfair stream'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--markets', type=int, default=50)
+        parser.add_argument('--seconds', type=int, default=10)
+        parser.add_argument('--replay', help='recorded stream to replay instead of synthetic deltas')
+
+    def handle(self, *args, **kwargs):
+        handler = type('BenchHandler', (standin.StreamHandler,), {
+            'interval': 0,
+            'recording': standin.load_recording(kwargs['replay']) if kwargs['replay'] else None,
+        })
+        server = standin.serve(handler=handler)
+        host, port = server.server_address
+        market_ids = [f'1.{n}' for n in range(1, kwargs['markets'] + 1)]
+        # database writes are left out, this measures decoding and cache maintenance
+        consumer = StreamConsumer(
+            'standin', 'standin', host=host, port=port, use_ssl=False, market_ids=market_ids,
+            flush=1, write=lambda snapshots: None)
+        self.stdout.write(f'Streaming {len(market_ids)} markets from {host}:{port} for {kwargs["seconds"]}s')
+
+        time_start = time()
+        consumer.run(seconds=kwargs['seconds'])
+        elapsed = time() - time_start
+        server.shutdown()
+
+        stream = consumer.stream
+        rate = stream.messages / elapsed
+        self.stdout.write(f'{stream.messages} messages in {elapsed:.1f}s = {rate:.0f} messages/s, '
+                          f'{len(stream.markets)} markets cached, {consumer.flushes} flushes')
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from ...engine import BettingEngine, OFFSETS, HORIZON, REFRESH
+
+
+class Command(BaseCommand):
+    help = 'Bet on the upcoming races from one event loop, firing at fixed offsets before the jump'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--offsets', type=int, nargs='+', default=OFFSETS, help='seconds before the jump')
+        parser.add_argument('--horizon', type=int, default=HORIZON)
+        parser.add_argument('--refresh', type=int, default=REFRESH)
+
+    def handle(self, *args, **kwargs):
+        self.stdout.write(f'Betting at {kwargs["offsets"]}s before the jump of races within {kwargs["horizon"]}s')
+        BettingEngine(offsets=kwargs['offsets'], horizon=kwargs['horizon'], refresh=kwargs['refresh']).run()
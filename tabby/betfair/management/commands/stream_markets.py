@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+
+from ...stream import StreamConsumer, HOST, PORT, FLUSH, REFRESH
+
+
+class Command(BaseCommand):
+    help = 'Stream the linked Betfair WIN markets and flush their best prices to the books'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default=HOST)
+        parser.add_argument('--port', type=int, default=PORT)
+        parser.add_argument('--no-ssl', action='store_true', help='plain TCP, for the local stand-in')
+        parser.add_argument('--flush', type=int, default=FLUSH)
+        parser.add_argument('--refresh', type=int, default=REFRESH)
+        parser.add_argument('--record', help='append every received message to this file')
+
+    def handle(self, *args, **kwargs):
+        if kwargs['host'] == HOST:
+            from ...client import get_betfair_client, renew_session
+            app_key = get_betfair_client().app_key
+
+            def session():
+                return get_betfair_client().session_token
+        else:
+            app_key, session = 'standin', 'standin'
+            renew_session = None
+
+        record = open(kwargs['record'], 'a') if kwargs['record'] else None
+        self.stdout.write(f'Streaming from {kwargs["host"]}:{kwargs["port"]} flushing every {kwargs["flush"]}s')
+        consumer = StreamConsumer(
+            app_key, session, host=kwargs['host'], port=kwargs['port'], use_ssl=not kwargs['no_ssl'],
+            flush=kwargs['flush'], refresh=kwargs['refresh'], record=record, renew_session=renew_session)
+        try:
+            consumer.run()
+        finally:
+            if record:
+                record.close()
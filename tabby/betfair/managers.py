@@ -1,4 +1,11 @@
+import datetime
+import threading
+import uuid
+from collections import OrderedDict
+
+from django.core.cache import cache
 from django.db.models import Manager, Max, Avg, Sum, Count
+from django.utils import timezone
 
 
 class BucketManager(Manager):
@@ -44,3 +51,55 @@ class BetManager(Manager):
         ).exclude(
             status__in=['LAPSED', 'CANCELLED']
         ).all()
+
+
+class MarketManager(Manager):
+
+    def linked(self, minutes_ago=10):
+        """WIN markets linked to a TAB race that have not jumped long ago"""
+        time_ago = timezone.now() - datetime.timedelta(minutes=minutes_ago)
+        return super().get_queryset().filter(
+            race__isnull=False,
+            market_type='WIN',
+            start_time__gte=time_ago,
+        )
+
+
+# selection id -> runner pk, shared by every ingest path of the process
+RUNNER_CACHE_SIZE = 20000
+# set anew when runners are deleted, every process drops its cached pks when it changes
+RUNNER_CACHE_VERSION_KEY = 'runner_ids_version'
+_runner_ids = OrderedDict()
+_runner_ids_version = None
+_runner_ids_lock = threading.Lock()
+
+
+class RunnerManager(Manager):
+
+    def resolve(self, selection_ids):
+        """Runner pks of the selection ids, cache misses are looked up with one query"""
+        global _runner_ids_version
+        version = cache.get(RUNNER_CACHE_VERSION_KEY)
+        found = {}
+        with _runner_ids_lock:
+            if version != _runner_ids_version:
+                _runner_ids.clear()
+                _runner_ids_version = version
+            for selection_id in selection_ids:
+                if selection_id in _runner_ids:
+                    _runner_ids.move_to_end(selection_id)
+                    found[selection_id] = _runner_ids[selection_id]
+        misses = [selection_id for selection_id in selection_ids if selection_id not in found]
+        if misses:
+            runners = super().get_queryset().only('id', 'selection_id').in_bulk(misses, field_name='selection_id')
+            with _runner_ids_lock:
+                for selection_id, runner in runners.items():
+                    found[selection_id] = _runner_ids[selection_id] = runner.pk
+                while len(_runner_ids) > RUNNER_CACHE_SIZE:
+                    _runner_ids.popitem(last=False)
+        return found
+
+    def forget(self):
+        """Drop the cached runner pks of every process, once runners were deleted"""
+        # a fresh value, a counter could come back to a version some process still holds once the cache is cleared
+        cache.set(RUNNER_CACHE_VERSION_KEY, uuid.uuid4().hex, None)
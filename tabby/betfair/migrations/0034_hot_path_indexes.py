@@ -0,0 +1,42 @@
+# Generated by Django 3.2.25 on 2026-10-17 04:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('betfair', '0033_auto_20180212_2246'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='bet',
+            name='bet_id',
+            field=models.BigIntegerField(db_index=True),
+        ),
+        migrations.AddIndex(
+            model_name='bet',
+            index=models.Index(fields=['outcome', 'status'], name='bet_outcome_status'),
+        ),
+        migrations.AddIndex(
+            model_name='bucket',
+            index=models.Index(fields=['bins', 'left'], name='bucket_bins_left'),
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['venue'], name='event_venue'),
+        ),
+        migrations.AddIndex(
+            model_name='market',
+            index=models.Index(fields=['market_type', 'start_time', 'event'], name='market_type_start_event'),
+        ),
+        migrations.AddIndex(
+            model_name='runner',
+            index=models.Index(fields=['market', 'cloth_number'], name='runner_market_cloth'),
+        ),
+        migrations.AddIndex(
+            model_name='runnerbook',
+            index=models.Index(fields=['book', 'runner'], name='runnerbook_book_runner'),
+        ),
+    ]
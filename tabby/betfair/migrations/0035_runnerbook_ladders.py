@@ -0,0 +1,28 @@
+# Generated by Django 3.2.25 on 2026-10-17 04:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('betfair', '0034_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='runnerbook',
+            name='atb',
+            field=models.BinaryField(null=True),
+        ),
+        migrations.AddField(
+            model_name='runnerbook',
+            name='atl',
+            field=models.BinaryField(null=True),
+        ),
+        migrations.AddField(
+            model_name='runnerbook',
+            name='trd',
+            field=models.BinaryField(null=True),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 3.2.25 on 2026-10-17 04:43
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_seen(apps, schema_editor):
+    """Books before deduplication were keyed on their last match time"""
+    Book = apps.get_model('betfair', 'Book')
+    Book.objects.update(seen_at=F('last_match_time'), seen_until=F('last_match_time'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('betfair', '0035_runnerbook_ladders'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='seen_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='seen_until',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['market', 'seen_at'], name='book_market_seen_at'),
+        ),
+        migrations.RunPython(backfill_seen, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-17 04:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('betfair', '0036_book_seen'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='market',
+            name='catalogue_hash',
+            field=models.CharField(max_length=40, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-17 04:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('betfair', '0037_market_catalogue_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bet',
+            name='latency',
+            field=models.FloatField(null=True),
+        ),
+    ]
@@ -1,6 +1,8 @@
+import numpy as np
 from django.db import models
+from django.db.models import F, OuterRef, Subquery
 
-from .managers import BucketManager, AccuracyManager, BetManager
+from .managers import BucketManager, AccuracyManager, BetManager, MarketManager, RunnerManager
 
 
 class Event(models.Model):
@@ -13,11 +15,18 @@ class Event(models.Model):
     country_code = models.CharField(max_length=10)
     timezone = models.CharField(max_length=10)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['venue'], name='event_venue'),
+        ]
+
     def __str__(self):
         return f'<Event [{self.event_id}] venue={self.venue} date={self.open_date}>'
 
 
 class Market(models.Model):
+    objects = MarketManager()
+
     event = models.ForeignKey(Event, on_delete=models.CASCADE)
 
     # TAB
@@ -38,12 +47,38 @@ class Market(models.Model):
     race_type = models.CharField(max_length=50, null=True)
 
     has_processed = models.BooleanField(default=False)
+    # hash of the light catalogue fields, see list_market_catalogue
+    catalogue_hash = models.CharField(max_length=40, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['market_type', 'start_time', 'event'], name='market_type_start_event'),
+        ]
 
     def __str__(self):
         return f'<Market [{self.market_id}] {self.event.venue} start={self.start_time}>'
 
+    def book_at(self, at=None):
+        """Book state of the market at the time, the latest when no time is given"""
+        books = self.book_set.all()
+        if at is not None:
+            books = books.filter(seen_at__lte=at)
+        return books.order_by('-id').first()
+
+    def runner_books(self, at=None):
+        """Latest runner book of every runner at the time, rebuilt from the stored deltas"""
+        rbooks = RunnerBook.objects.filter(book__market=self)
+        if at is not None:
+            rbooks = rbooks.filter(book__seen_at__lte=at)
+        latest = rbooks.filter(runner=OuterRef('runner')).order_by('-id')
+        return rbooks.annotate(
+            latest_id=Subquery(latest.values('id')[:1])
+        ).filter(id=F('latest_id')).select_related('runner')
+
 
 class Runner(models.Model):
+    objects = RunnerManager()
+
     market = models.ForeignKey(Market, null=True, on_delete=models.SET_NULL)
 
     # default
@@ -56,6 +91,11 @@ class Runner(models.Model):
     stall_draw = models.IntegerField(null=True)
     runner_id = models.BigIntegerField()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['market', 'cloth_number'], name='runner_market_cloth'),
+        ]
+
     def __str__(self):
         return f'<Runner [{self.selection_id}] num={self.cloth_number} name={self.name}>'
 
@@ -85,14 +125,47 @@ class Book(models.Model):
     cross_matching = models.BooleanField()
     runners_voidable = models.BooleanField()
     version = models.BigIntegerField()
+    # first and last poll that saw this state, see betfair.books
+    seen_at = models.DateTimeField(null=True)
+    seen_until = models.DateTimeField(null=True)
 
-    # class Meta:
-    #     ordering = ['last_match_time']
+    class Meta:
+        indexes = [
+            models.Index(fields=['market', 'seen_at'], name='book_market_seen_at'),
+        ]
 
     def __str__(self):
         return f'<Book [{self.version}] status={self.status}>'
 
 
+def pack_ladder(levels):
+    """
+    Pack ladder levels into float32 (price, size) pairs.
+    Takes the API's {'price', 'size'} dicts or the stream's [price, size] pairs, best level first.
+    """
+    if levels is None:
+        return None
+    pairs = [(level['price'], level['size']) if isinstance(level, dict) else level for level in levels]
+    return np.asarray(pairs, dtype=np.float32).tobytes()
+
+
+def unpack_ladder(blob):
+    """Read-only (levels, 2) view of a packed ladder, without copying"""
+    if not blob:
+        return np.empty((0, 2), dtype=np.float32)
+    return np.frombuffer(blob, dtype=np.float32).reshape(-1, 2)
+
+
+def weighted_price(ladder, amount):
+    """Average price of filling the amount from the best level on, None when the ladder is too thin"""
+    sizes = ladder[:, 1]
+    before = np.cumsum(sizes) - sizes
+    fills = np.clip(amount - before, 0, sizes)
+    if fills.sum() < amount:
+        return None
+    return float((ladder[:, 0] * fills).sum() / amount)
+
+
 class RunnerBook(models.Model):
     book = models.ForeignKey(Book, on_delete=models.CASCADE)
     runner = models.ForeignKey(Runner, on_delete=models.CASCADE)
@@ -105,10 +178,47 @@ class RunnerBook(models.Model):
     back_size = models.FloatField(null=True)
     lay_price = models.FloatField(null=True)
     lay_size = models.FloatField(null=True)
+    # full depth ladders, packed by pack_ladder
+    atb = models.BinaryField(null=True)
+    atl = models.BinaryField(null=True)
+    trd = models.BinaryField(null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['book', 'runner'], name='runnerbook_book_runner'),
+        ]
 
     def __str__(self):
         return f'<RB num={self.runner.cloth_number} sel={self.runner.selection_id} back={self.back_price} lay={self.lay_price}>'
 
+    def back_ladder(self):
+        """Available to back, highest price first"""
+        return unpack_ladder(self.atb)
+
+    def lay_ladder(self):
+        """Available to lay, lowest price first"""
+        return unpack_ladder(self.atl)
+
+    def traded_ladder(self):
+        """Traded volume per price"""
+        return unpack_ladder(self.trd)
+
+    def weighted_back(self, amount):
+        """Average price a back of the amount gets matched at right now"""
+        return weighted_price(self.back_ladder(), amount)
+
+    def weighted_lay(self, amount):
+        """Average price a lay of the amount gets matched at right now"""
+        return weighted_price(self.lay_ladder(), amount)
+
+    def traded_share(self, price):
+        """Share of the traded volume matched at the price or better for a back bet, a rough fill probability"""
+        traded = self.traded_ladder()
+        total = traded[:, 1].sum()
+        if not total:
+            return 0
+        return float(traded[traded[:, 0] >= price, 1].sum() / total)
+
 
 class Accuracy(models.Model):
     objects = AccuracyManager()
@@ -133,13 +243,18 @@ class Bucket(models.Model):
     coef = models.FloatField()
     intercept = models.FloatField()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['bins', 'left'], name='bucket_bins_left'),
+        ]
+
 
 class Bet(models.Model):
     objects = BetManager()
 
     market = models.ForeignKey(Market, on_delete=models.CASCADE)
     runner = models.ForeignKey(Runner, on_delete=models.CASCADE)
-    bet_id = models.BigIntegerField()
+    bet_id = models.BigIntegerField(db_index=True)
 
     est = models.FloatField()
     trade = models.FloatField(null=True)
@@ -166,5 +281,13 @@ class Bet(models.Model):
     outcome = models.CharField(max_length=50, null=True)
     profit = models.FloatField(null=True)
 
+    # seconds from the betting trigger to the exchange acknowledgement
+    latency = models.FloatField(null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['outcome', 'status'], name='bet_outcome_status'),
+        ]
+
     def __str__(self):
         return f'<Bet [{self.bet_id} {self.runner.cloth_number}] {self.size} x {self.price} {self.side}>'
@@ -0,0 +1,217 @@
+"""
+Betfair order manager.
+
+Diffs the orders wanted on a market against the live EXECUTABLE bets, keyed
+on runner and side: an order at the same price is left alone, a price move
+becomes a replace instruction, net-new orders are placed and live bets that
+are no longer wanted are cancelled. The replace, place and cancel calls go
+out concurrently, and the Bet rows are only written once the exchange
+acknowledged, with one bulk insert and one bulk update. Every new bet
+records the seconds from the trigger to the exchange acknowledgement.
+"""
+import logging
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+
+from betfairlightweight.filters import place_instruction, limit_order, cancel_instruction, replace_instruction
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Bet
+
+logger = logging.getLogger(__name__)
+
+# info holds the Bet pricing fields: est, trade, back, lay, margin and bracket
+Order = namedtuple('Order', ['runner_pk', 'selection_id', 'side', 'price', 'size', 'info'])
+
+OrderDiff = namedtuple('OrderDiff', ['places', 'replaces', 'cancels', 'kept'])
+
+# tolerance for prices that are a float error apart
+PRICE_EPS = 1e-6
+
+
+def live_orders(market):
+    """Unmatched bets of the market by (selection id, side)"""
+    bets = Bet.objects.filter(
+        market=market,
+        outcome__isnull=True,
+        status='EXECUTABLE'
+    ).select_related('runner')
+    return {(bet.runner.selection_id, bet.side): bet for bet in bets}
+
+
+def diff_orders(desired, live):
+    """Instructions turning the live bets into the desired orders"""
+    places = []
+    replaces = []
+    kept = []
+    for order in desired:
+        bet = live.get((order.selection_id, order.side))
+        if bet is None:
+            places.append(order)
+        elif abs(bet.price - order.price) > PRICE_EPS:
+            replaces.append((bet, order))
+        else:
+            kept.append(bet)
+    wanted = {(order.selection_id, order.side) for order in desired}
+    cancels = [bet for key, bet in live.items() if key not in wanted]
+    return OrderDiff(places, replaces, cancels, kept)
+
+
+def liability_payout(side, price, size):
+    if side == 'BACK':
+        return size, size * (price - 1)
+    return size * (price - 1), size
+
+
+def new_bet(market, order, report, size=None, acked_at=None):
+    """Bet of an acknowledged place instruction report"""
+    size = size or order.size
+    liability, payout = liability_payout(order.side, order.price, size)
+    bet = Bet(market=market, runner_id=order.runner_pk, bet_id=report['betId'],
+              payout=payout, liability=liability,
+              status=report['orderStatus'],
+              placed_at=parse_datetime(report['placedDate']) if report.get('placedDate') else timezone.now(),
+              size_matched=report.get('sizeMatched'),
+              order_type='LIMIT',
+              side=order.side,
+              persistence_type='LAPSE',
+              price=order.price,
+              size=size,
+              **order.info)
+    bet.acked_at = acked_at
+    return bet
+
+
+def limit_instruction(order):
+    return place_instruction(
+        'LIMIT', order.selection_id, order.side,
+        limit_order=limit_order(persistence_type='LAPSE', size=order.size, price=order.price))
+
+
+def sync_orders(trading, market, desired):
+    """
+    Bring the market's live bets to the desired orders in one concurrent round trip.
+    Returns the diff, raises when the exchange rejected any call once the acknowledged part is stored.
+    """
+    diff = diff_orders(desired, live_orders(market))
+    triggered_at = time()
+    results, errors = send_orders(trading, market, diff)
+    store_orders(market, diff, results, errors, triggered_at)
+    if errors:
+        raise Exception(f'$$$ Market {market.market_id}: {"; ".join(errors)}')
+    return diff
+
+
+def send_orders(trading, market, diff):
+    """
+    Send the instructions of the diff, the replace, place and cancel calls concurrently.
+    Returns the responses with the time they were acknowledged by call name, and the failed calls.
+    """
+    calls = {}
+    if diff.replaces:
+        calls['replace'] = lambda: trading.betting.replace_orders(
+            market.market_id,
+            instructions=[replace_instruction(str(bet.bet_id), order.price) for bet, order in diff.replaces],
+            lightweight=True)
+    if diff.places:
+        calls['place'] = lambda: trading.betting.place_orders(
+            market.market_id,
+            instructions=[limit_instruction(order) for order in diff.places],
+            lightweight=True)
+    if diff.cancels:
+        calls['cancel'] = lambda: trading.betting.cancel_orders(
+            market_id=market.market_id,
+            instructions=[cancel_instruction(bet_id=str(bet.bet_id)) for bet in diff.cancels],
+            lightweight=True)
+    logger.warning(f'$$$ {market}: placing {len(diff.places)}, replacing {len(diff.replaces)}, '
+                   f'cancelling {len(diff.cancels)}, keeping {len(diff.kept)}')
+    results = {}
+    errors = []
+    if not calls:
+        return results, errors
+
+    def acked(call):
+        res = call()
+        return res, time()
+
+    with ThreadPoolExecutor(max_workers=len(calls)) as executor:
+        futures = {name: executor.submit(acked, call) for name, call in calls.items()}
+    for name, future in futures.items():
+        try:
+            results[name] = future.result()
+        except Exception as exc:
+            errors.append(f'{name}: {exc}')
+    return results, errors
+
+
+def store_orders(market, diff, results, errors, triggered_at=None):
+    """
+    Store the acknowledged bets with one bulk insert and one bulk update, new bets get the
+    seconds from the trigger to their acknowledgement. Rejected instructions are added to errors.
+    """
+    created, updated = acknowledged_bets(market, diff, results, errors)
+    if triggered_at is not None:
+        for bet in created:
+            bet.latency = bet.acked_at - triggered_at
+    with transaction.atomic():
+        Bet.objects.bulk_create(created)
+        Bet.objects.bulk_update(updated, ['status', 'size_cancelled'])
+    logger.warning(f'$$$ Stored {len(created)} new and {len(updated)} closed bets for {market}')
+    return created
+
+
+def instruction_reports(name, results, errors):
+    """Instruction reports and acknowledged time of a call, a rejected call is added to errors"""
+    res, acked_at = results.get(name, (None, None))
+    if not res:
+        return [], acked_at
+    if res['status'] != 'SUCCESS':
+        errors.append(f'{name} {res.get("errorCode")}')
+    return res.get('instructionReports') or [], acked_at
+
+
+def acknowledged_bets(market, diff, results, errors):
+    """New and closed bets of the acknowledged instructions, rejections are added to errors"""
+    created = []
+    updated = []
+
+    reports, acked_at = instruction_reports('place', results, errors)
+    for order, report in zip(diff.places, reports):
+        if report['status'] == 'SUCCESS':
+            created.append(new_bet(market, order, report, acked_at=acked_at))
+        else:
+            errors.append(f'place {order.selection_id} {order.side} {report.get("errorCode")}')
+
+    reports, acked_at = instruction_reports('replace', results, errors)
+    for (bet, order), report in zip(diff.replaces, reports):
+        cancel_report = report.get('cancelInstructionReport') or {}
+        place_report = report.get('placeInstructionReport') or {}
+        size_cancelled = cancel_report.get('sizeCancelled')
+        if cancel_report.get('status') == 'SUCCESS':
+            bet.size_cancelled = size_cancelled
+            # the matched part of a partially matched bet stands
+            if bet.size_matched or size_cancelled < bet.size - PRICE_EPS:
+                bet.status = 'EXECUTION_COMPLETE'
+            else:
+                bet.status = 'CANCELLED'
+            updated.append(bet)
+        if place_report.get('status') == 'SUCCESS':
+            # the replacement is placed for the size that was cancelled
+            created.append(new_bet(market, order, place_report, size_cancelled, acked_at))
+        else:
+            errors.append(f'replace {bet.bet_id} {report.get("errorCode")}')
+
+    reports, _ = instruction_reports('cancel', results, errors)
+    for bet, report in zip(diff.cancels, reports):
+        if report['status'] == 'SUCCESS':
+            bet.status = 'CANCELLED'
+            bet.size_cancelled = report.get('sizeCancelled')
+        else:
+            # matched in the meantime
+            logger.error(f'Could not cancel {bet}')
+            bet.status = 'EXECUTION_COMPLETE'
+        updated.append(bet)
+    return created, updated
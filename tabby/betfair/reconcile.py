@@ -0,0 +1,131 @@
+"""
+Betfair order reconciliation.
+
+The outstanding bets are loaded once and their ids looked up in chunks
+within the API limits. The SETTLED, LAPSED and CANCELLED cleared orders are
+fetched concurrently. Every order is matched to its bet in memory, markets
+and runners are resolved from one lookup each, and all the changes are
+written with a single bulk_update.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+
+from .client import get_betfair_client
+from .models import Bet, Market, Runner
+
+logger = logging.getLogger(__name__)
+
+# bet ids per listCurrentOrders/listClearedOrders call
+BET_IDS_CHUNK = 250
+CLEARED_STATUSES = ['SETTLED', 'LAPSED', 'CANCELLED']
+WORKERS = 4
+
+
+def chunks(items, size=BET_IDS_CHUNK):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def cleared_changes(status, ix):
+    """Bet field values of a cleared order"""
+    if status == 'SETTLED':
+        return {'outcome': ix['betOutcome'], 'profit': ix['profit']}
+    return {'status': status, 'size_cancelled': ix['sizeCancelled']}
+
+
+def current_changes(ix):
+    """Bet field values of a current order"""
+    return {
+        'order_type': ix['orderType'],
+        'persistence_type': ix['persistenceType'],
+        'placed_at': parse_datetime(ix['placedDate']),
+        'price': ix['priceSize']['price'],
+        'size': ix['priceSize']['size'],
+        'side': ix['side'],
+        'size_cancelled': ix['sizeCancelled'],
+        'size_lapsed': ix['sizeLapsed'],
+        'size_matched': ix['sizeMatched'],
+        'size_remaining': ix['sizeRemaining'],
+        'size_voided': ix['sizeVoided'],
+        'status': ix['status'],
+    }
+
+
+@transaction.atomic
+def apply_changes(bets, changes):
+    """
+    Apply (order, field values) changes to the bets by bet id with one bulk_update.
+    Returns the updated bets, orders of unknown bets are logged and skipped.
+    """
+    markets = Market.objects.only('id', 'market_id').in_bulk(
+        list({ix['marketId'] for ix, _ in changes}), field_name='market_id')
+    runner_ids = Runner.objects.resolve(list({ix['selectionId'] for ix, _ in changes}))
+
+    updated = {}
+    fields = {'market', 'runner'}
+    for ix, values in changes:
+        bet = bets.get(int(ix['betId']))
+        market = markets.get(ix['marketId'])
+        runner_id = runner_ids.get(ix['selectionId'])
+        if not bet or not market or not runner_id:
+            logger.error(f'Could not reconcile order {ix["betId"]} on {ix["marketId"]} {ix["selectionId"]}')
+            continue
+        bet.market_id = market.pk
+        bet.runner_id = runner_id
+        for name, value in values.items():
+            setattr(bet, name, value)
+        fields.update(values)
+        updated[bet.pk] = bet
+    Bet.objects.bulk_update(list(updated.values()), sorted(fields))
+    return list(updated.values())
+
+
+def outstanding_bets():
+    return {bet.bet_id: bet for bet in Bet.objects.outstanding()}
+
+
+def reconcile_cleared_bets():
+    """Settle, lapse and cancel the outstanding bets from their cleared orders"""
+    bets = outstanding_bets()
+    if not bets:
+        logger.info(f'No outstanding bets to reconcile')
+        return []
+    trading = get_betfair_client()
+    calls = [(status, bet_ids) for status in CLEARED_STATUSES for bet_ids in chunks([str(b) for b in bets])]
+
+    def fetch(call):
+        status, bet_ids = call
+        res = trading.betting.list_cleared_orders(bet_status=status, bet_ids=bet_ids, lightweight=True)
+        return [(ix, cleared_changes(status, ix)) for ix in res['clearedOrders']]
+
+    with ThreadPoolExecutor(max_workers=WORKERS) as executor:
+        changes = [change for res in executor.map(fetch, calls) for change in res]
+    updated = apply_changes(bets, changes)
+    logger.warning(f'Reconciled {len(updated)} of {len(bets)} outstanding bets in {len(calls)} calls')
+    return updated
+
+
+def reconcile_current_bets():
+    """Update the outstanding bets from their current orders"""
+    bets = outstanding_bets()
+    if not bets:
+        logger.info(f'No current bets to look up')
+        return []
+    trading = get_betfair_client()
+    calls = chunks([str(b) for b in bets])
+
+    def fetch(bet_ids):
+        res = trading.betting.list_current_orders(
+            bet_ids=bet_ids,
+            order_projection='ALL',
+            order_by='BY_PLACE_TIME',
+            lightweight=True)
+        return [(ix, current_changes(ix)) for ix in res['currentOrders']]
+
+    with ThreadPoolExecutor(max_workers=WORKERS) as executor:
+        changes = [change for res in executor.map(fetch, calls) for change in res]
+    updated = apply_changes(bets, changes)
+    logger.warning(f'Updated {len(updated)} of {len(bets)} current bets in {len(calls)} calls')
+    return updated
@@ -0,0 +1,90 @@
+"""
+Race betting snapshot.
+
+Everything create_bets prices a race from, loaded in a fixed number of
+queries however many runners the race has: the race, its WIN market, the
+TAB runners with their odds summary, the Betfair runners, their latest
+runner books and the runners with open matched bets. The snapshot is a
+tree of namedtuples, so the pricing never goes back to the database.
+"""
+from collections import namedtuple
+
+from django.utils import timezone
+
+from tab.models import Race
+from tab.models import Runner as TabRunner
+from .models import Bet, Market, Runner
+
+RaceSnapshot = namedtuple('RaceSnapshot', [
+    'race_pk', 'race', 'start_time', 'market', 'runners', 'taken_at',
+])
+
+RunnerSnapshot = namedtuple('RunnerSnapshot', [
+    'number', 'name',
+    # betfair runner, None when the TAB runner is not on the market
+    'runner_pk', 'selection_id',
+    # latest TAB fixed odds
+    'win_dec', 'place_dec', 'odds_at',
+    # latest betfair prices, back is the best lay offer and lay the best back offer
+    'back', 'lay', 'trade',
+    'has_matched_bet',
+])
+
+
+def runner_prices(rbook):
+    """(back, lay, trade) of a runner book, as the TAB runner properties read them"""
+    if not rbook:
+        return None, None, None
+    return rbook['lay_price'], rbook['back_price'], rbook['last_price_traded'] or None
+
+
+def race_snapshot(race_pk):
+    """Snapshot of the race, its market is None when the race is not linked to a WIN market"""
+    race = Race.objects.select_related('meeting').get(pk=race_pk)
+    market = Market.objects.filter(race_id=race_pk, market_type='WIN').only('id', 'market_id', 'name').first()
+    tab_runners = TabRunner.objects.filter(race_id=race_pk).only(
+        'id', 'race_id', 'runner_number', 'name', 'fo_win_latest', 'fo_place_latest', 'fo_changed_at')
+
+    bf_runners = {}
+    rbooks = {}
+    matched = set()
+    if market:
+        for pk, selection_id, cloth_number in Runner.objects.filter(market=market).values_list(
+                'id', 'selection_id', 'cloth_number'):
+            bf_runners[cloth_number] = (pk, selection_id)
+        rbooks = {
+            rbook['runner_id']: rbook
+            for rbook in market.runner_books().values('runner_id', 'back_price', 'lay_price', 'last_price_traded')
+        }
+        matched = set(Bet.objects.filter(
+            market=market,
+            outcome__isnull=True,
+            status='EXECUTION_COMPLETE'
+        ).values_list('runner_id', flat=True))
+
+    runners = []
+    for runner in tab_runners:
+        runner_pk, selection_id = bf_runners.get(runner.runner_number, (None, None))
+        back, lay, trade = runner_prices(rbooks.get(runner_pk))
+        runners.append(RunnerSnapshot(
+            number=runner.runner_number,
+            name=runner.name,
+            runner_pk=runner_pk,
+            selection_id=selection_id,
+            win_dec=runner.fo_win_latest,
+            place_dec=runner.fo_place_latest,
+            odds_at=runner.fo_changed_at,
+            back=back,
+            lay=lay,
+            trade=trade,
+            has_matched_bet=runner_pk in matched,
+        ))
+
+    return RaceSnapshot(
+        race_pk=race.pk,
+        race=str(race),
+        start_time=race.start_time,
+        market=market,
+        runners=tuple(runners),
+        taken_at=timezone.now(),
+    )
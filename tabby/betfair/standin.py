@@ -0,0 +1,183 @@
+"""
+Local stand-in for the Betfair Exchange Stream API.
+
+Speaks the stream protocol over plain TCP: it answers authentication and
+market subscriptions, then either replays recorded `mcm` messages (one JSON
+message per line, as written by `stream_markets --record`) or generates
+synthetic deltas for the subscribed markets, so the stream consumer can be
+load-tested and integration-tested offline.
+"""
+import itertools
+import json
+import random
+import socketserver
+import threading
+from time import sleep, time
+
+RUNNERS = 10
+LEVELS = 5
+TICK = 0.01
+
+
+def selection_id(market_id, number):
+    """Selection id of runner `number` of a synthetic market"""
+    return int(market_id.split('.')[-1]) * 100 + number
+
+
+def market_definition(market_id, runners=RUNNERS, version=1):
+    return {
+        'status': 'OPEN',
+        'inPlay': False,
+        'betDelay': 0,
+        'bspReconciled': False,
+        'complete': True,
+        'numberOfWinners': 1,
+        'numberOfActiveRunners': runners,
+        'crossMatching': True,
+        'runnersVoidable': False,
+        'version': version,
+        'runners': [
+            {'id': selection_id(market_id, n), 'status': 'ACTIVE', 'sortPriority': n}
+            for n in range(1, runners + 1)
+        ],
+    }
+
+
+def ladder(price, side, rand, levels=LEVELS):
+    """[price, size] levels stepping away from the price"""
+    step = -1 if side == 'atb' else 1
+    return [[round(price + step * TICK * level, 2), round(rand.uniform(2, 200), 2)] for level in range(levels)]
+
+
+def market_image(market_id, prices, runners=RUNNERS, rand=random):
+    """Full image of a synthetic market, records the opening price of every runner in prices"""
+    rc = []
+    for n in range(1, runners + 1):
+        price = round(rand.uniform(2, 30), 2)
+        prices[selection_id(market_id, n)] = price
+        rc.append({
+            'id': selection_id(market_id, n),
+            'atb': ladder(price, 'atb', rand),
+            'atl': ladder(price + TICK, 'atl', rand),
+            'trd': [[price, round(rand.uniform(10, 500), 2)]],
+            'ltp': price,
+            'tv': 0,
+        })
+    return {'id': market_id, 'img': True, 'marketDefinition': market_definition(market_id, runners), 'rc': rc}
+
+
+def market_delta(market_id, prices, runners=RUNNERS, rand=random):
+    """
+    One runner of a synthetic market moves a tick and trades.
+    The new best back and best lay are set and the crossed levels removed, so the book never crosses.
+    """
+    selection = selection_id(market_id, rand.randint(1, runners))
+    price = round(max(1.01, prices.get(selection, 5) + rand.choice((-TICK, TICK))), 2)
+    prices[selection] = price
+    above = round(price + TICK, 2)
+    return {
+        'id': market_id,
+        'rc': [{
+            'id': selection,
+            'atb': [[price, round(rand.uniform(2, 200), 2)], [above, 0]],
+            'atl': [[above, round(rand.uniform(2, 200), 2)], [price, 0]],
+            'trd': [[price, round(rand.uniform(10, 500), 2)]],
+            'ltp': price,
+        }],
+    }
+
+
+class StreamHandler(socketserver.StreamRequestHandler):
+    # seconds between deltas, 0 streams as fast as the socket takes them
+    interval = 0.05
+    runners = RUNNERS
+    # recorded mcm messages to replay instead of synthetic deltas
+    recording = None
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+        self.lock = threading.RLock()
+        self.market_ids = []
+        self.sub_id = None
+        self.clk = itertools.count(1)
+        self.prices = {}
+        self.closed = False
+
+    def handle(self):
+        self.send({'op': 'connection', 'connectionId': f'standin-{self.server.connections}'})
+        threading.Thread(target=self.read_requests, daemon=True).start()
+        rand = random.Random(self.server.connections)
+        replay = itertools.cycle(self.recording) if self.recording else None
+        heartbeat_at = time() + 5
+        try:
+            while not self.closed:
+                with self.lock:
+                    market_ids = list(self.market_ids)
+                if market_ids and replay:
+                    self.send_change(next(replay).get('mc', []))
+                elif market_ids:
+                    self.send_change([market_delta(rand.choice(market_ids), self.prices, self.runners, rand)])
+                elif time() > heartbeat_at:
+                    self.send({'op': 'mcm', 'id': self.sub_id, 'ct': 'HEARTBEAT', 'clk': str(next(self.clk))})
+                    heartbeat_at = time() + 5
+                if self.interval or not market_ids:
+                    sleep(self.interval or 0.05)
+        except OSError:
+            pass
+
+    def read_requests(self):
+        try:
+            for line in self.rfile:
+                if line.strip():
+                    self.on_request(json.loads(line))
+        except (OSError, ValueError):
+            pass
+        self.closed = True
+
+    def on_request(self, msg):
+        if msg['op'] == 'authentication':
+            self.send({'op': 'status', 'id': msg['id'], 'statusCode': 'SUCCESS', 'connectionClosed': False})
+        elif msg['op'] == 'marketSubscription':
+            market_ids = msg.get('marketFilter', {}).get('marketIds', [])
+            rand = random.Random(msg['id'])
+            with self.lock:
+                self.sub_id = msg['id']
+                self.send({'op': 'status', 'id': msg['id'], 'statusCode': 'SUCCESS', 'connectionClosed': False})
+                # a recording carries its own images
+                if not self.recording:
+                    self.send({
+                        'op': 'mcm', 'id': msg['id'], 'ct': 'SUB_IMAGE', 'initialClk': str(next(self.clk)),
+                        'clk': str(next(self.clk)), 'pt': int(time() * 1000),
+                        'mc': [market_image(market_id, self.prices, self.runners, rand) for market_id in market_ids],
+                    })
+                self.market_ids = market_ids
+        else:
+            self.send({'op': 'status', 'id': msg.get('id'), 'statusCode': 'FAILURE',
+                       'errorCode': 'INVALID_INPUT', 'errorMessage': f'Unknown op {msg["op"]}'})
+
+    def send_change(self, mc):
+        self.send({'op': 'mcm', 'id': self.sub_id, 'clk': str(next(self.clk)), 'pt': int(time() * 1000), 'mc': mc})
+
+    def send(self, msg):
+        with self.lock:
+            self.wfile.write(json.dumps(msg).encode() + b'\r\n')
+            self.server.messages += 1
+
+
+def load_recording(path):
+    """mcm messages of a recorded stream, heartbeats left out"""
+    with open(path) as f:
+        messages = [json.loads(line) for line in f if line.strip()]
+    return [msg for msg in messages if msg.get('op') == 'mcm' and msg.get('mc')]
+
+
+def serve(host='127.0.0.1', port=0, handler=StreamHandler):
+    """Start the stand-in stream on a background thread"""
+    server = socketserver.ThreadingTCPServer((host, port), handler)
+    server.daemon_threads = True
+    server.connections = 0
+    server.messages = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
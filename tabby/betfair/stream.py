@@ -0,0 +1,412 @@
+"""
+Betfair Exchange Stream API market consumer.
+
+Subscribes to the linked WIN markets over the stream protocol (CRLF delimited
+JSON over TLS) and keeps every market in memory, built from the initial image
+and the `mcm` deltas that follow: ladders are keyed on price and a size of 0
+removes the price, the market definition is replaced whole. Markets touched
+since the last flush are stored as Book/RunnerBook snapshots of their best
+prices and packed full ladders every few seconds through the single
+database Writer, see betfair.books for what is actually written. A dropped
+connection or a failure status is met by reconnecting with a backoff,
+re-authenticating (with a new session when the old one was rejected) and
+resubscribing from the last clk, so only the changes missed are streamed.
+"""
+import datetime
+import itertools
+import json
+import logging
+import socket
+import ssl
+from time import sleep, time
+
+from django.utils import timezone
+
+from tab.writer import get_writer
+from .books import store_book
+from .models import Market, pack_ladder
+
+logger = logging.getLogger(__name__)
+
+HOST = 'stream-api.betfair.com'
+PORT = 443
+CONNECT_TIMEOUT = 10
+# the reader wakes up at least this often to flush and refresh
+READ_TIMEOUT = 1
+BUFFER_SIZE = 64 * 1024
+FLUSH = 5
+REFRESH = 60
+HEARTBEAT_MS = 5000
+# seconds before reconnecting, doubling on every failed attempt
+RECONNECT_DELAY = 1
+MAX_RECONNECT_DELAY = 30
+# failures of a session that expired or was logged out, a new one is needed to reconnect
+SESSION_ERRORS = {'NO_SESSION', 'INVALID_SESSION_INFORMATION'}
+FIELDS = ['EX_ALL_OFFERS', 'EX_TRADED', 'EX_TRADED_VOL', 'EX_LTP', 'EX_MARKET_DEF']
+
+
+def apply_ladder(ladder, deltas):
+    """Apply [price, size] deltas to a price keyed ladder, size 0 removes the price"""
+    for price, size in deltas:
+        if size:
+            ladder[price] = size
+        else:
+            ladder.pop(price, None)
+
+
+class RunnerCache:
+
+    def __init__(self, selection_id):
+        self.selection_id = selection_id
+        self.atb = {}
+        self.atl = {}
+        self.trd = {}
+        self.ltp = None
+        self.tv = None
+
+    def update(self, rc):
+        if 'atb' in rc:
+            apply_ladder(self.atb, rc['atb'])
+        if 'atl' in rc:
+            apply_ladder(self.atl, rc['atl'])
+        if 'trd' in rc:
+            apply_ladder(self.trd, rc['trd'])
+        if 'ltp' in rc:
+            self.ltp = rc['ltp']
+        if 'tv' in rc:
+            self.tv = rc['tv']
+
+    def best_back(self):
+        """Highest price available to back, with its size"""
+        if self.atb:
+            price = max(self.atb)
+            return price, self.atb[price]
+        return None, None
+
+    def best_lay(self):
+        """Lowest price available to lay, with its size"""
+        if self.atl:
+            price = min(self.atl)
+            return price, self.atl[price]
+        return None, None
+
+
+class MarketCache:
+
+    def __init__(self, market_id):
+        self.market_id = market_id
+        self.definition = {}
+        self.runners = {}
+        self.tv = None
+        self.published_at = None
+        self.last_match_time = None
+
+    def update(self, mc, pt):
+        # an image replaces whatever was cached
+        if mc.get('img'):
+            self.runners = {}
+            self.tv = None
+        if 'marketDefinition' in mc:
+            self.definition = mc['marketDefinition']
+        if 'tv' in mc:
+            self.tv = mc['tv']
+        for rc in mc.get('rc', []):
+            runner = self.runners.get(rc['id'])
+            if runner is None:
+                runner = self.runners[rc['id']] = RunnerCache(rc['id'])
+            runner.update(rc)
+            if 'trd' in rc:
+                self.last_match_time = pt
+        self.published_at = pt
+
+    def snapshot(self):
+        """Best prices of the market as plain Book and RunnerBook field values"""
+        definition = self.definition
+        runner_defs = {item['id']: item for item in definition.get('runners', [])}
+        total_available = sum(
+            sum(runner.atb.values()) + sum(runner.atl.values()) for runner in self.runners.values())
+        runners = []
+        for selection_id, runner in self.runners.items():
+            runner_def = runner_defs.get(selection_id, {})
+            back_price, back_size = runner.best_back()
+            lay_price, lay_size = runner.best_lay()
+            runners.append({
+                'selection_id': selection_id,
+                'book': {
+                    'status': runner_def.get('status', 'ACTIVE'),
+                    'adjustment_factor': runner_def.get('adjustmentFactor'),
+                    'last_price_traded': runner.ltp,
+                    'total_matched': runner.tv,
+                    'back_price': back_price,
+                    'back_size': back_size,
+                    'lay_price': lay_price,
+                    'lay_size': lay_size,
+                    'atb': pack_ladder(sorted(runner.atb.items(), reverse=True)),
+                    'atl': pack_ladder(sorted(runner.atl.items())),
+                    'trd': pack_ladder(sorted(runner.trd.items())),
+                },
+            })
+        return {
+            'market_id': self.market_id,
+            'book': {
+                'is_market_data_delayed': False,
+                'status': definition.get('status', 'OPEN'),
+                'bet_delay': definition.get('betDelay', 0),
+                'bsp_reconciled': definition.get('bspReconciled', False),
+                'complete': definition.get('complete', True),
+                'inplay': definition.get('inPlay', False),
+                'number_of_winners': definition.get('numberOfWinners', 1),
+                'number_of_runners': len(runner_defs) or len(self.runners),
+                'number_of_active_runners': definition.get('numberOfActiveRunners', len(self.runners)),
+                'last_match_time': to_datetime(self.last_match_time),
+                'total_matched': self.tv or 0,
+                'total_available': total_available,
+                'cross_matching': definition.get('crossMatching', False),
+                'runners_voidable': definition.get('runnersVoidable', False),
+                'version': definition.get('version', 0),
+            },
+            'runners': runners,
+        }
+
+
+def to_datetime(pt):
+    """Stream publish times are epoch milliseconds"""
+    if pt is not None:
+        return datetime.datetime.fromtimestamp(pt / 1000, tz=timezone.utc)
+
+
+class StreamClosed(Exception):
+    pass
+
+
+class StreamError(Exception):
+    """FAILURE status sent by the exchange, code is its errorCode"""
+
+    def __init__(self, code, message=None):
+        super().__init__(f'Stream failure {code}: {message}')
+        self.code = code
+
+
+class MarketStream:
+    """Protocol state and the market caches, fed one decoded message at a time"""
+
+    def __init__(self):
+        self.markets = {}
+        self.dirty = set()
+        self.connection_id = None
+        self.initial_clk = None
+        self.clk = None
+        self.messages = 0
+        self.heartbeats = 0
+
+    def on_message(self, msg):
+        self.messages += 1
+        op = msg.get('op')
+        if op == 'connection':
+            self.connection_id = msg.get('connectionId')
+            logger.info(f'Stream connected {self.connection_id}')
+        elif op == 'status':
+            if msg.get('statusCode') == 'FAILURE':
+                raise StreamError(msg.get('errorCode'), msg.get('errorMessage'))
+        elif op == 'mcm':
+            self.on_market_change(msg)
+
+    def on_market_change(self, msg):
+        if 'initialClk' in msg:
+            self.initial_clk = msg['initialClk']
+        if 'clk' in msg:
+            self.clk = msg['clk']
+        if msg.get('ct') == 'HEARTBEAT':
+            self.heartbeats += 1
+            return
+        for mc in msg.get('mc', []):
+            market = self.markets.get(mc['id'])
+            if market is None:
+                market = self.markets[mc['id']] = MarketCache(mc['id'])
+            market.update(mc, msg.get('pt'))
+            self.dirty.add(mc['id'])
+
+    def take_snapshots(self):
+        """Snapshots of the markets changed since the last call"""
+        snapshots = [self.markets[market_id].snapshot() for market_id in self.dirty]
+        self.dirty.clear()
+        return snapshots
+
+
+def linked_market_ids():
+    return list(Market.objects.linked().values_list('market_id', flat=True))
+
+
+def write_books(snapshots):
+    """Store the open, pre-play market snapshots, only what moved is written"""
+    markets = Market.objects.in_bulk([snap['market_id'] for snap in snapshots], field_name='market_id')
+    stored = 0
+    for snap in snapshots:
+        market = markets.get(snap['market_id'])
+        if not market:
+            logger.error(f'Streamed market {snap["market_id"]} not found')
+            continue
+        # linked markets stay subscribed after the jump
+        if snap['book']['status'] != 'OPEN' or snap['book']['inplay']:
+            logger.info(f'Streamed book is not open/inplay: {market}')
+            continue
+        if store_book(market, snap['book'], snap['runners']):
+            stored += 1
+    logger.info(f'Flushed {len(snapshots)} streamed books, {stored} moved')
+    return stored
+
+
+class StreamConsumer:
+
+    def __init__(self, app_key, session, host=HOST, port=PORT, use_ssl=True, market_ids=None,
+                 flush=FLUSH, refresh=REFRESH, write=write_books, writer=None, record=None, renew_session=None):
+        self.app_key = app_key
+        self.session = session
+        # called with the rejected token when the exchange refuses the session
+        self.renew_session = renew_session
+        self.token = None
+        self.host = host
+        self.port = port
+        self.use_ssl = use_ssl
+        # fixed markets, otherwise the linked markets are refreshed periodically
+        self.market_ids = market_ids
+        self.flush_interval = flush
+        self.refresh_interval = refresh
+        self.write = write
+        self.writer = writer or get_writer()
+        self.record = record
+        self.stream = MarketStream()
+        self.subscribed = None
+        self.sock = None
+        self.buffer = b''
+        self.ids = itertools.count(1)
+        self.flushes = 0
+        self.write_errors = 0
+        self.reconnects = 0
+        self.stopped = False
+
+    def run(self, seconds=None):
+        """Consume the stream till stopped, or for the given seconds, reconnecting when the connection drops"""
+        deadline = time() + seconds if seconds else None
+        delay = RECONNECT_DELAY
+        while not self.stopped and (deadline is None or time() < deadline):
+            try:
+                self.connect()
+                self.authenticate()
+                self.resubscribe()
+                delay = RECONNECT_DELAY
+                self.consume(deadline)
+            except (OSError, StreamClosed, StreamError) as exc:
+                self.reconnects += 1
+                logger.error(f'Stream connection lost: {exc}, reconnecting in {delay}s')
+                if isinstance(exc, StreamError) and exc.code in SESSION_ERRORS and self.renew_session:
+                    self.renew_session(self.token)
+                sleep(delay)
+                delay = min(delay * 2, MAX_RECONNECT_DELAY)
+            finally:
+                self.close()
+        self.flush()
+
+    def consume(self, deadline):
+        flush_at = time() + self.flush_interval
+        refresh_at = time() + self.refresh_interval
+        while not self.stopped and (deadline is None or time() < deadline):
+            for line in self.read_lines():
+                if self.record:
+                    self.record.write(line.decode() + '\n')
+                self.stream.on_message(json.loads(line))
+            now = time()
+            if now >= flush_at:
+                self.flush()
+                flush_at = now + self.flush_interval
+            if now >= refresh_at:
+                self.refresh()
+                refresh_at = now + self.refresh_interval
+
+    def stop(self):
+        self.stopped = True
+
+    def connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=CONNECT_TIMEOUT)
+        if self.use_ssl:
+            sock = ssl.create_default_context().wrap_socket(sock, server_hostname=self.host)
+        sock.settimeout(READ_TIMEOUT)
+        self.sock = sock
+        self.buffer = b''
+        logger.warning(f'Connected to stream {self.host}:{self.port}')
+
+    def close(self):
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+
+    def send(self, msg):
+        msg['id'] = next(self.ids)
+        self.sock.sendall(json.dumps(msg).encode() + b'\r\n')
+        return msg['id']
+
+    def read_lines(self):
+        """Complete lines received so far, empty when the read timed out"""
+        try:
+            data = self.sock.recv(BUFFER_SIZE)
+        except socket.timeout:
+            return []
+        if not data:
+            raise StreamClosed('Stream connection closed')
+        lines = (self.buffer + data).split(b'\r\n')
+        self.buffer = lines.pop()
+        return [line for line in lines if line]
+
+    def authenticate(self):
+        # a callable session gives the current token on every reconnect
+        self.token = self.session() if callable(self.session) else self.session
+        self.send({'op': 'authentication', 'appKey': self.app_key, 'session': self.token})
+
+    def subscribe(self, market_ids, resume=False):
+        """
+        Subscribe to the markets, replacing the previous subscription.
+        Resuming sends the stored clks, so only the changes since the last message are streamed.
+        """
+        msg = {
+            'op': 'marketSubscription',
+            'marketFilter': {'marketIds': market_ids},
+            'marketDataFilter': {'fields': FIELDS},
+            'heartbeatMs': HEARTBEAT_MS,
+        }
+        if resume and self.stream.clk:
+            msg['initialClk'] = self.stream.initial_clk
+            msg['clk'] = self.stream.clk
+        self.send(msg)
+        self.subscribed = set(market_ids)
+        if 'clk' in msg:
+            logger.warning(f'Resubscribed to {len(market_ids)} markets from clk {msg["clk"]}')
+        else:
+            logger.warning(f'Subscribed to {len(market_ids)} markets')
+
+    def resubscribe(self):
+        """Subscribe on a new connection, resuming when the markets did not change"""
+        market_ids = self.current_market_ids()
+        self.subscribe(market_ids, resume=self.subscribed == set(market_ids))
+
+    def current_market_ids(self):
+        return self.market_ids if self.market_ids is not None else linked_market_ids()
+
+    def refresh(self):
+        """Resubscribe when the linked markets changed"""
+        market_ids = self.current_market_ids()
+        if set(market_ids) != self.subscribed:
+            self.subscribe(market_ids)
+
+    def flush(self):
+        """Hand the changed markets to the writer"""
+        snapshots = self.stream.take_snapshots()
+        if snapshots:
+            future = self.writer.submit(self.write, snapshots)
+            future.add_done_callback(self.on_written)
+            self.flushes += 1
+
+    def on_written(self, future):
+        exc = future.exception()
+        if exc:
+            self.write_errors += 1
+            logger.error(f'Writing streamed books failed: {exc}')
@@ -1,146 +1,225 @@
+import hashlib
 import json
 import datetime
 import logging
 import re
+from concurrent.futures import ThreadPoolExecutor
+
 from django.core.cache import cache
 
 import pandas as pd
-from betfairlightweight.filters import market_filter, time_range, price_projection, price_data, place_instruction, \
-    limit_order, cancel_instruction
+from betfairlightweight.filters import market_filter, time_range, price_projection, price_data
 from celery import shared_task
+from django.db import transaction
 from django.utils import timezone
 from django.utils.dateparse import parse_datetime
 from sklearn.linear_model import LinearRegression
 
 from tab.models import Race
-from .client import get_betfair_client, ET_HORSE_RACING, ET_GREYHOUND_RACING
-from .models import Event, Market, Book, Runner, RunnerBook, Accuracy, Bucket, Bet
+from tab.writer import get_writer, log_exception
+from . import ladder
+from .books import store_book
+from .orders import Order, sync_orders
+from .reconcile import reconcile_cleared_bets, reconcile_current_bets
+from .snapshot import race_snapshot
+from .client import get_betfair_client, get_process_client, refresh_session, SESSION_KEY, REFRESH_AHEAD, \
+    ET_HORSE_RACING, ET_GREYHOUND_RACING
+from .models import Event, Market, Runner, Accuracy, Bucket, Bet, pack_ladder
 
 logger = logging.getLogger(__name__)
 
 
+# listMarketCatalogue caps results at 1000 for the light projection, and at 200 data weight
+# points per call, where the description and runner metadata weigh 1 each per market
+CATALOGUE_PAGE = 1000
+CATALOGUE_FULL_CHUNK = 100
+LIGHT_PROJECTION = ['EVENT', 'MARKET_START_TIME']
+FULL_PROJECTION = ['EVENT', 'MARKET_START_TIME', 'MARKET_DESCRIPTION', 'RUNNER_METADATA']
+
+
 @shared_task(bind=True)
 def list_market_catalogue(self):
+    """
+    Sync the markets of the next hour.
+    All markets are listed with a light projection, only new markets are fetched with their
+    description and runners, known markets are only updated when their catalogue hash changed.
+    """
     logger.warning('+' * 80)
     trading = get_betfair_client()
     time_ago = timezone.now() + datetime.timedelta(minutes=1)
     time_fwd = timezone.now() + datetime.timedelta(minutes=60)
-    mfilter = market_filter(
-        event_type_ids=[ET_HORSE_RACING, ET_GREYHOUND_RACING],
-        market_start_time=time_range(
-            from_=time_ago.strftime('%Y-%m-%dT%H:%I:%S.000Z'),
-            to=time_fwd.strftime('%Y-%m-%dT%H:%I:%S.000Z')
-        )
-    )
-    res = trading.betting.list_market_catalogue(
-        mfilter,
-        market_projection=[
-            'EVENT',
-            'MARKET_START_TIME',
-            'MARKET_DESCRIPTION',
-            'RUNNER_METADATA',
-        ],
-        sort='FIRST_TO_START',
-        max_results=100,
-        lightweight=True)
-    if not len(res):
-        logger.error('Market catalogue listing is empty')
-        trading.session_token = None
-        raise self.retry(countdown=5, max_retries=12)
-
-    for cat in res:
-        if 'venue' not in cat['event']:
-            logger.error(f'No event venue in {cat}')
-            continue
-        try:
-            event = parse_event(cat['event'])
-            market = parse_market(event, cat)
-            runners = parse_runners(market, cat['runners'])
-        except:
-            logger.warning(cat)
-            raise
-    logger.warning(f'BETFAIR: Scraped {len(res)} from market catalogue')
+    listing = list_catalogue_pages(trading, time_ago, time_fwd)
+    if not listing:
+        logger.warning('BETFAIR: No markets in the catalogue')
+        return
 
+    known = Market.objects.only('id', 'market_id', 'catalogue_hash').in_bulk(list(listing), field_name='market_id')
+    new_ids = [market_id for market_id in listing if market_id not in known]
+    changed = [listing[market_id] for market_id, market in known.items()
+               if market.catalogue_hash != catalogue_hash(listing[market_id])]
+
+    cats = []
+    for i in range(0, len(new_ids), CATALOGUE_FULL_CHUNK):
+        cats.extend(trading.betting.list_market_catalogue(
+            market_filter(market_ids=new_ids[i:i + CATALOGUE_FULL_CHUNK]),
+            market_projection=FULL_PROJECTION,
+            max_results=CATALOGUE_FULL_CHUNK,
+            lightweight=True))
+    cats = [cat for cat in cats if 'venue' in cat['event'] or logger.error(f'No event venue in {cat}')]
+
+    with transaction.atomic():
+        events = upsert_events([cat['event'] for cat in cats + changed])
+        create_markets(events, cats)
+        update_markets(events, known, changed)
+    logger.warning(f'BETFAIR: Listed {len(listing)} markets, created {len(cats)}, updated {len(changed)}')
+
+
+def list_catalogue_pages(trading, time_from, time_to):
+    """Light catalogue of every market in the time range by market id, paging past the result cap"""
+    listing = {}
+    while True:
+        page = trading.betting.list_market_catalogue(
+            market_filter(
+                event_type_ids=[ET_HORSE_RACING, ET_GREYHOUND_RACING],
+                market_start_time=time_range(
+                    from_=time_from.strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+                    to=time_to.strftime('%Y-%m-%dT%H:%M:%S.000Z')
+                )
+            ),
+            market_projection=LIGHT_PROJECTION,
+            sort='FIRST_TO_START',
+            max_results=CATALOGUE_PAGE,
+            lightweight=True)
+        new = [cat for cat in page if cat['marketId'] not in listing]
+        listing.update((cat['marketId'], cat) for cat in new)
+        if len(page) < CATALOGUE_PAGE or not new:
+            return listing
+        # the next page starts at the last start time, markets seen already are skipped
+        time_from = parse_datetime(page[-1]['marketStartTime'])
+
+
+def catalogue_hash(cat):
+    """Hash of the catalogue fields a known market is updated from"""
+    event = cat.get('event', {})
+    fields = [cat['marketName'], cat['marketStartTime'], event.get('id'), event.get('name'),
+              event.get('venue'), event.get('openDate')]
+    return hashlib.sha1(json.dumps(fields).encode()).hexdigest()
+
+
+def event_fields(event):
+    return {
+        'open_date': parse_datetime(event['openDate']),
+        'venue': event['venue'].upper(),
+        'name': event['name'],
+        'country_code': event['countryCode'],
+        'timezone': event['timezone'],
+    }
 
-@shared_task
-def parse_event(event):
-    """Parses event from Event object"""
-    event, created = Event.objects.update_or_create(
-        event_id=event['id'],
-        defaults={
-            'open_date': parse_datetime(event['openDate']),
-            'venue': event['venue'].upper(),
-            'name': event['name'],
-            'country_code': event['countryCode'],
-            'timezone': event['timezone'],
-        }
-    )
-    if created:
-        logger.warning(f'Created {event}')
-    else:
-        logger.info(f'Updated {event}')
-    return event
 
+def upsert_events(items):
+    """Create new events and update changed ones, returns all of them by event id"""
+    items = {int(item['id']): item for item in items if 'venue' in item}
+    events = Event.objects.in_bulk(list(items), field_name='event_id')
+    new_events = []
+    changed = []
+    for event_id, item in items.items():
+        fields = event_fields(item)
+        event = events.get(event_id)
+        if event is None:
+            new_events.append(Event(event_id=event_id, **fields))
+        elif any(getattr(event, name) != value for name, value in fields.items()):
+            for name, value in fields.items():
+                setattr(event, name, value)
+            changed.append(event)
+    Event.objects.bulk_create(new_events)
+    Event.objects.bulk_update(changed, ['open_date', 'venue', 'name', 'country_code', 'timezone'])
+    if new_events:
+        # sqlite does not return the primary keys of bulk inserts
+        events = Event.objects.in_bulk(list(items), field_name='event_id')
+    logger.info(f'Created {len(new_events)} and updated {len(changed)} events')
+    return events
+
+
+def create_markets(events, cats):
+    """Create the new markets and their runners"""
+    markets = []
+    for cat in cats:
+        markets.append(Market(
+            event=events[int(cat['event']['id'])],
+            market_id=cat['marketId'],
+            name=cat['marketName'],
+            total_matched=cat['totalMatched'],
+            start_time=parse_datetime(cat['marketStartTime']),
+            betting_type=cat['description']['bettingType'],
+            market_time=parse_datetime(cat['description']['marketTime']),
+            market_type=cat['description']['marketType'],
+            suspend_time=parse_datetime(cat['description']['suspendTime']),
+            turn_in_play_enabled=cat['description']['turnInPlayEnabled'],
+            race_type=cat['description'].get('raceType'),
+            catalogue_hash=catalogue_hash(cat),
+        ))
+    Market.objects.bulk_create(markets, ignore_conflicts=True)
+    markets = Market.objects.in_bulk([cat['marketId'] for cat in cats], field_name='market_id')
+
+    # selection ids are unique, a runner listed again moves to the new market
+    items = {item['selectionId']: (markets[cat['marketId']], item) for cat in cats for item in cat['runners']}
+    existing = Runner.objects.in_bulk(list(items), field_name='selection_id')
+    new_runners = []
+    moved = []
+    for selection_id, (market, item) in items.items():
+        fields = runner_fields(item)
+        runner = existing.get(selection_id)
+        if runner is None:
+            new_runners.append(Runner(selection_id=selection_id, market=market, **fields))
+        else:
+            runner.market = market
+            for name, value in fields.items():
+                setattr(runner, name, value)
+            moved.append(runner)
+    Runner.objects.bulk_create(new_runners)
+    Runner.objects.bulk_update(moved, ['market'] + RUNNER_FIELDS)
+    logger.info(f'Created {len(markets)} markets with {len(new_runners)} new runners')
 
-@shared_task
-def parse_market(event, cat):
-    """Parses market from MarketCatalogue object"""
-    market, created = Market.objects.update_or_create(
-        market_id=cat['marketId'],
-        defaults={
-            'event': event,
-            # catalogue
-            'name': cat['marketName'],
-            'total_matched': cat['totalMatched'],
-            'start_time': parse_datetime(cat['marketStartTime']),
-            # description
-            'betting_type': cat['description']['bettingType'],
-            'market_time': parse_datetime(cat['description']['marketTime']),
-            'market_type': cat['description']['marketType'],
-            'suspend_time': parse_datetime(cat['description']['suspendTime']),
-            'turn_in_play_enabled': cat['description']['turnInPlayEnabled'],
-            'race_type': cat['description'].get('raceType'),
-        }
-    )
-    if created:
-        logger.warning(f'Created {market}')
-    else:
-        logger.info(f'Updated {market}')
-    return market
 
+RUNNER_FIELDS = ['name', 'sort_priority', 'handicap', 'cloth_number', 'stall_draw', 'runner_id']
 
-@shared_task
-def parse_runners(market, items):
-    """Parses runners from MarketCatalogue object"""
-    runners = []
-    for runner_item in items:
-        num = runner_item['metadata'].get('CLOTH_NUMBER')
-        if not num:
-            matches = re.match(r'^(\d+)', runner_item['runnerName'])
-            if matches:
-                num = matches.groups(0)[0]
-            else:
-                logger.error(f'Could not match number for {runner_item}')
-        runner, created = Runner.objects.update_or_create(
-            selection_id=runner_item['selectionId'],
-            defaults={
-                'market': market,
-                # default
-                'name': runner_item['runnerName'].upper(),
-                'sort_priority': runner_item['sortPriority'],
-                'handicap': runner_item['handicap'],
-                # metadata
-                'cloth_number': num,
-                'stall_draw': runner_item['metadata'].get('STALL_DRAW'),
-                'runner_id': runner_item['metadata']['runnerId'],
-            }
-        )
-        if created:
-            logger.info(f'Created {runner}')
+
+def runner_fields(item):
+    num = item['metadata'].get('CLOTH_NUMBER')
+    if not num:
+        matches = re.match(r'^(\d+)', item['runnerName'])
+        if matches:
+            num = matches.groups(0)[0]
         else:
-            logger.debug(f'Updated {runner}')
-        runners.append(runner)
-    return runners
+            logger.error(f'Could not match number for {item}')
+    return {
+        'name': item['runnerName'].upper(),
+        'sort_priority': item['sortPriority'],
+        'handicap': item['handicap'],
+        'cloth_number': num,
+        'stall_draw': item['metadata'].get('STALL_DRAW'),
+        'runner_id': item['metadata']['runnerId'],
+    }
+
+
+def update_markets(events, known, cats):
+    """Update the known markets whose catalogue changed"""
+    markets = []
+    for cat in cats:
+        market = known[cat['marketId']]
+        if 'venue' in cat['event']:
+            market.event = events[int(cat['event']['id'])]
+        market.name = cat['marketName']
+        market.start_time = parse_datetime(cat['marketStartTime'])
+        market.catalogue_hash = catalogue_hash(cat)
+        markets.append(market)
+    Market.objects.bulk_update(markets, ['event', 'name', 'start_time', 'catalogue_hash'])
+
+
+@shared_task
+def keep_alive_session():
+    """Refresh the shared session ahead of time, schedule it more often than REFRESH_AHEAD"""
+    refresh_session(get_process_client(), cache.get(SESSION_KEY), ahead=REFRESH_AHEAD)
 
 
 @shared_task
@@ -200,61 +279,124 @@ def monitor_market(pk):
         logger.error(f'Book for market is not open/inplay: {market}')
         return
 
-    book = upsert_market_book(market, item)
-    rbooks = upsert_runner_book(book, item)
-    if book.number_of_active_runners != len(rbooks):
-        logger.error(f'Missing runners {book.number_of_active_runners} vs {len(rbooks)} in {book}')
-        logger.error(f'Market has {market.runner_set.count()} runners (expecting {book.number_of_runners} from book)')
+    store_market_books.delay([item])
     logger.warning(f'Finished monitored market {market}')
 
 
+# listMarketBook data request limit, and the weight per market of each price projection
+MAX_WEIGHT = 200
+PRICE_WEIGHTS = {
+    'SP_AVAILABLE': 3,
+    'SP_TRADED': 7,
+    'EX_BEST_OFFERS': 5,
+    'EX_ALL_OFFERS': 17,
+    'EX_TRADED': 17,
+}
+# all offers and traded together weigh less than their sum
+ALL_OFFERS_TRADED_WEIGHT = 32
+# a market without any price projection
+BASE_WEIGHT = 2
+# the full back, lay and traded ladders are stored with every runner book
+BOOK_PRICE_DATA = ['EX_ALL_OFFERS', 'EX_TRADED']
+BOOK_WORKERS = 4
+
+
+def market_weight(price_data):
+    """Data weight of one market in listMarketBook for the price projection"""
+    price_data = set(price_data)
+    weight = 0
+    if {'EX_ALL_OFFERS', 'EX_TRADED'} <= price_data:
+        weight += ALL_OFFERS_TRADED_WEIGHT
+        price_data -= {'EX_ALL_OFFERS', 'EX_TRADED'}
+    weight += sum(PRICE_WEIGHTS[item] for item in price_data)
+    return weight or BASE_WEIGHT
+
+
+def market_batches(market_ids, price_data):
+    """Split the market ids into listMarketBook requests within the weight limit"""
+    size = max(1, MAX_WEIGHT // market_weight(price_data))
+    return [market_ids[i:i + size] for i in range(0, len(market_ids), size)]
+
+
 @shared_task
-def upsert_market_book(market, res):
-    # create book for version
-    book, created = Book.objects.update_or_create(
-        market=market,
-        last_match_time=res.get('lastMatchTime'),
-        defaults={
-            'is_market_data_delayed': res['isMarketDataDelayed'],
-            'status': res['status'],
-            'bet_delay': res['betDelay'],
-            'bsp_reconciled': res['bspReconciled'],
-            'complete': res['complete'],
-            'inplay': res['inplay'],
-            'number_of_winners': res['numberOfWinners'],
-            'number_of_runners': res['numberOfRunners'],
-            'number_of_active_runners': res['numberOfActiveRunners'],
-            'total_matched': res.get('totalMatched'),
-            'total_available': res['totalAvailable'],
-            'cross_matching': res['crossMatching'],
-            'runners_voidable': res['runnersVoidable'],
-            'version': res['version'],
-        }
-    )
-    if created:
-        logger.info(f'Created {book}')
-    else:
-        logger.info(f'Updated {book}')
-    return book
+def collect_market_books(price_data=BOOK_PRICE_DATA):
+    """Fetch the books of all linked markets in weight-limited batches, they are stored on the ingest queue"""
+    markets = Market.objects.linked().in_bulk(field_name='market_id')
+    if not markets:
+        logger.info('No linked markets to collect books for')
+        return 0
+    batches = market_batches(list(markets), price_data)
+
+    trading = get_betfair_client()
+    projection = price_projection(price_data=price_data)
+
+    def fetch(market_ids):
+        return trading.betting.list_market_book(
+            market_ids=market_ids,
+            price_projection=projection,
+            lightweight=True)
+
+    with ThreadPoolExecutor(max_workers=BOOK_WORKERS) as executor:
+        items = [item for res in executor.map(fetch, batches) for item in res]
+    logger.warning(f'Collected {len(items)} books for {len(markets)} markets in {len(batches)} calls')
+    store_market_books.delay(items)
+    return len(items)
 
 
 @shared_task
-def upsert_runner_book(book, res):
-    # create book for every runner
-    rbooks = []
-    for item in res['runners']:
-        try:
-            runner = Runner.objects.get(selection_id=item['selectionId'])
-        except Runner.DoesNotExist:
-            logger.error(f'Could not find runner for {item["selectionId"]}')
+def store_market_books(items):
+    """Queue fetched market books on the process writer"""
+    markets = Market.objects.in_bulk([item['marketId'] for item in items], field_name='market_id')
+    get_writer().submit(ingest_market_books, markets, items).add_done_callback(log_exception)
+
+
+@transaction.atomic
+def ingest_market_books(markets, items):
+    """Store the open, pre-play books that moved"""
+    ingested = 0
+    for item in items:
+        market = markets.get(item['marketId'])
+        if not market:
+            logger.error(f'Collected book for unknown market {item["marketId"]}')
             continue
+        if item['status'] != 'OPEN' or item['inplay']:
+            logger.info(f'Book for market is not open/inplay: {market}')
+            continue
+        if store_book(market, book_fields(item), runner_rows(item)):
+            ingested += 1
+    return ingested
+
+
+def book_fields(res):
+    """Book field values of a listMarketBook item"""
+    return {
+        'is_market_data_delayed': res['isMarketDataDelayed'],
+        'status': res['status'],
+        'bet_delay': res['betDelay'],
+        'bsp_reconciled': res['bspReconciled'],
+        'complete': res['complete'],
+        'inplay': res['inplay'],
+        'number_of_winners': res['numberOfWinners'],
+        'number_of_runners': res['numberOfRunners'],
+        'number_of_active_runners': res['numberOfActiveRunners'],
+        'last_match_time': res.get('lastMatchTime'),
+        'total_matched': res.get('totalMatched'),
+        'total_available': res['totalAvailable'],
+        'cross_matching': res['crossMatching'],
+        'runners_voidable': res['runnersVoidable'],
+        'version': res['version'],
+    }
 
+
+def runner_rows(res):
+    """RunnerBook field values of every runner of a listMarketBook item"""
+    rows = []
+    for item in res['runners']:
         best_back = item['ex']['availableToBack'][0] if item['ex']['availableToBack'] else {}
         best_lay = item['ex']['availableToLay'][0] if item['ex']['availableToLay'] else {}
-        rbook, created = RunnerBook.objects.update_or_create(
-            book=book,
-            runner=runner,
-            defaults={
+        rows.append({
+            'selection_id': item['selectionId'],
+            'book': {
                 'status': item['status'],
                 'adjustment_factor': item.get('adjustmentFactor'),
                 'last_price_traded': item.get('lastPriceTraded'),
@@ -263,14 +405,12 @@ def upsert_runner_book(book, res):
                 'back_size': best_back.get('size'),
                 'lay_price': best_lay.get('price'),
                 'lay_size': best_lay.get('size'),
-            }
-        )
-        if created:
-            logger.info(f'Created {rbook}')
-        else:
-            logger.info(f'Updated {rbook}')
-        rbooks.append(rbook)
-    return rbooks
+                'atb': pack_ladder(item['ex'].get('availableToBack')),
+                'atl': pack_ladder(item['ex'].get('availableToLay')),
+                'trd': pack_ladder(item['ex'].get('tradedVolume')),
+            },
+        })
+    return rows
 
 
 ########################################################################################################################
@@ -286,21 +426,11 @@ def post_process():
 
 @shared_task
 def cleanup():
-    """Delete from bottom up where there are no odds"""
-    # clear rbooks
-    res = RunnerBook.objects.filter(
-        status='ACTIVE',
-        back_price__isnull=True,
-        lay_price__isnull=True,
-    ).delete()
-    logger.warning(f'Deleted rbooks: {res}')
-
-    # clear books
-    res = Book.objects.exclude(
-        runnerbook__isnull=False
-    ).delete()
-    logger.warning(f'Deleted books: {res}')
-
+    """
+    Delete from bottom up where there are no odds.
+    Books are stored as deltas, a runner book without prices or a book without runner
+    books is part of the market's history and is kept.
+    """
     # clear markets
     yesterday = timezone.now() - datetime.timedelta(hours=24)
     res = Market.objects.filter(
@@ -320,6 +450,9 @@ def cleanup():
     res = Runner.objects.exclude(
         market__isnull=False
     ).delete()
+    if res[0]:
+        # a selection id listed again gets a new runner
+        Runner.objects.forget()
     logger.warning(f'Deleted runners: {res}')
 
     logger.warning(f'Betfair cleanup done')
@@ -340,11 +473,8 @@ def analyze():
     for market in markets:
         Accuracy.objects.filter(market=market).delete()
         for tab_runner in market.race.runner_set.all():
-            try:
-                rbook = RunnerBook.objects.filter(
-                    book=market.book_set.last(),
-                    runner__cloth_number=tab_runner.runner_number).last()
-            except RunnerBook.DoesNotExist:
+            rbook = tab_runner.rbook
+            if not rbook:
                 logger.error(f'RunnerBook not found for {tab_runner}')
                 continue
 
@@ -425,11 +555,8 @@ def run_bet():
         start_time__lte=time_fwd
     ).all()
 
-    if Bet.objects.count():
-        # update previous bets
-        list_settled_bets()
-        list_lapsed_bets()
-        list_cancelled_bets()
+    # update previous bets
+    reconcile_cleared_bets()
 
     betting = cache.get('betting')
     if not betting:
@@ -442,7 +569,11 @@ def run_bet():
 
     # update current bets
     #  can do all current bets for all markets, and then bet on each market in time
-    list_current_bets()
+    reconcile_current_bets()
+
+    if cache.get(ENGINE_KEY):
+        logger.info('$$$ Betting engine is running')
+        return
 
     for race in races:
         market = race.win_market
@@ -453,6 +584,8 @@ def run_bet():
 
 
 AMOUNT = 5
+# set while the betting engine runs, see betfair.engine
+ENGINE_KEY = 'betting_engine'
 MARGIN_BRACKETS = {
     0: 0.10,
     1: 0.14,
@@ -469,43 +602,45 @@ def create_bets(pk):
     Can place back and lay side bets.
     """
     trading = get_betfair_client()
-    race = Race.objects.get(pk=pk)
-    market = race.win_market
+    snap = race_snapshot(pk)
+    market = snap.market
+    if not market:
+        logger.error(f'$$$ no betfair market for {snap.race}')
+        return
 
     # establish margin bracket of betting
-    secs_left = (race.start_time - timezone.now()).total_seconds()
+    secs_left = (snap.start_time - timezone.now()).total_seconds()
     bracket = secs_left // 60
     margin = MARGIN_BRACKETS.get(bracket)
     if not margin:
         logger.error(f'$$$ Huge minutes for {market}: {bracket}')
         return
-    logger.warning(f'$$$ Betting on {race} in {bracket} bracket margin {margin}')
+    logger.warning(f'$$$ Betting on {snap.race} in {bracket} bracket margin {margin}')
+    desired = desired_orders(snap, margin, bracket)
+
+    # replace moved bets, place new ones and cancel the rest
+    sync_orders(trading, market, desired)
 
-    # cancel all existing bets
-    cancel_bets(market)
 
-    ix = []
+def desired_orders(snap, margin, bracket):
+    """Back and lay orders for the runners of the race snapshot at the margin"""
     ix_info = {}
-    for runner in race.runner_set.all():
-        try:
-            bf_runner = market.runner_set.get(cloth_number=runner.runner_number)
-        except Exception as e:
-            logger.info(f'$$$ No betfair {runner} {e}')
+    for runner in snap.runners:
+        if not runner.runner_pk:
+            logger.info(f'$$$ No betfair runner {runner.number} {runner.name}')
             continue
 
-        matched_bets = bf_runner.matched_bets()
-        if matched_bets:
-            logger.info(f'$$$ Runner already has bet {matched_bets}')
+        if runner.has_matched_bet:
+            logger.info(f'$$$ Runner already has bet {runner.number} {runner.name}')
             continue
 
-        fo = runner.fixedodd_set.first()
-        if not fo:
-            logger.info(f'$$$ Runner already has no tab odds {runner}')
+        if not runner.win_dec:
+            logger.info(f'$$$ Runner has no tab odds {runner.number} {runner.name}')
             continue
 
-        est = fo.win_est
+        est = 1 / runner.win_dec
         if est < 0.09:
-            logger.info(f'$$$ Bad odds for {runner} {est}')
+            logger.info(f'$$$ Bad odds for {runner.number} {runner.name} {est}')
             continue
 
         # back
@@ -515,12 +650,6 @@ def create_bets(pk):
         # 20%   18%         4.55    4.40        4.50    => 4.55
         back_desire = 1 / (est * (1 - margin))
         back_price = max(back_desire, runner.trade or float('-inf'), runner.lay or float('-inf'))
-        ix.append(place_instruction(
-            'LIMIT', bf_runner.selection_id, 'BACK',
-            limit_order=limit_order(persistence_type='LAPSE',
-                                    size=AMOUNT,
-                                    price=get_odds(back_price))))
-        logger.info(f'$$$ Placed bet {runner.runner_number}: BACK {back_price}')
 
         # lay
         # est   desire 10%  odds    lowestBack  trade
@@ -529,15 +658,9 @@ def create_bets(pk):
         # 20%   22%         4.55    4.50        4.40    => 4.40
         lay_desire = 1 / (est * (1 + margin))
         lay_price = min(lay_desire, runner.trade or float('inf'), runner.lay or float('inf'))
-        ix.append(place_instruction(
-            'LIMIT', bf_runner.selection_id, 'LAY',
-            limit_order=limit_order(persistence_type='LAPSE',
-                                    size=AMOUNT,
-                                    price=get_odds(lay_price))))
-        logger.info(f'$$$ Placed bet {runner.runner_number}: BACK {lay_price}')
-
-        ix_info[bf_runner.selection_id] = {
-            'bf_runner': bf_runner,
+
+        ix_info[runner.selection_id] = {
+            'runner': runner,
             'est': est,
             'back_price': back_price,
             'lay_price': lay_price,
@@ -548,47 +671,23 @@ def create_bets(pk):
             'bracket': bracket,
         }
 
-    if not ix:
-        logger.error(f'$$$ No ix for {race}')
-        return
+    if not ix_info:
+        logger.error(f'$$$ No ix for {snap.race}')
+
+    # the whole field is priced on the ladder at once, backs never below and lays never above the desired price
+    infos = list(ix_info.items())
+    back_prices = ladder.snap_up([info['back_price'] for _, info in infos])
+    lay_prices = ladder.snap_down([info['lay_price'] for _, info in infos])
+    desired = []
+    for (selection_id, info), back_price, lay_price in zip(infos, back_prices, lay_prices):
+        runner = info['runner']
+        bet_info = {key: info[key] for key in ['est', 'trade', 'back', 'lay', 'margin', 'bracket']}
+        desired.append(Order(runner.runner_pk, selection_id, 'BACK', float(back_price), AMOUNT, bet_info))
+        desired.append(Order(runner.runner_pk, selection_id, 'LAY', float(lay_price), AMOUNT, bet_info))
+        logger.info(f'$$$ Pricing {runner.number}: BACK {back_price} LAY {lay_price}')
+    return desired
+
 
-    # place orders
-    res = trading.betting.place_orders(
-        market.market_id,
-        instructions=ix,
-        lightweight=True)
-    # print(json.dumps(res, indent=4, default=str, sort_keys=True))
-    if res['status'] != 'SUCCESS':
-        for bet_info in res['instructionReports']:
-            logger.error(f'{bet_info["status"]} {bet_info["errorCode"]}')
-        raise Exception(f'$$$ Market {res["marketId"]}: {res["errorCode"]}')
-    for ix in res['instructionReports']:
-        bet_info = ix_info[ix['instruction']['selectionId']]
-        if ix['instruction']['side'] == 'BACK':
-            liability = ix['instruction']['limitOrder']['size']
-            payout = ix['instruction']['limitOrder']['size'] * (ix['instruction']['limitOrder']['price'] - 1)
-        else:
-            liability = ix['instruction']['limitOrder']['size'] * (ix['instruction']['limitOrder']['price'] - 1)
-            payout = ix['instruction']['limitOrder']['size']
-        bet = Bet(market=market, runner=bet_info['bf_runner'], bet_id=ix['betId'],
-                  est=bet_info['est'], trade=bet_info['trade'],
-                  back=bet_info['back'], lay=bet_info['lay'],
-                  margin=margin, bracket=bracket,
-                  payout=payout, liability=liability,
-
-                  status=ix['orderStatus'],
-                  placed_at=parse_datetime(ix['placedDate']),
-                  size_matched=ix['sizeMatched'],
-
-                  order_type=ix['instruction']['orderType'],
-                  side=ix['instruction']['side'],
-
-                  persistence_type=ix['instruction']['limitOrder']['persistenceType'],
-                  price=ix['instruction']['limitOrder']['price'],
-                  size=ix['instruction']['limitOrder']['size'])
-        bet.save()
-        logger.warning(f'$$$ Created {bet}')
-    logger.warning(f'$$$ Placed {len(ix)} bets for {market}')
 """
         {
             "averagePriceMatched": 0.0,
@@ -610,252 +709,3 @@ def create_bets(pk):
         },
 
 """
-
-
-def cancel_bets(market):
-    existing_bets = market.bet_set.filter(
-        outcome__isnull=True,
-        status='EXECUTABLE'
-    ).all()
-
-    if existing_bets:
-        trading = get_betfair_client()
-        res = trading.betting.cancel_orders(
-            market_id=market.market_id,
-            instructions=[cancel_instruction(bet_id=b.bet_id) for b in existing_bets],
-            lightweight=True)
-        # print(json.dumps(res, indent=4, default=str, sort_keys=True))
-        if res['status'] not in ['SUCCESS', 'PROCESSED_WITH_ERRORS']:
-            raise Exception(f'$$$ Cannot cancel! {res["marketId"]}: {res["errorCode"]}')
-        for item in res['instructionReports']:
-            bet = Bet.objects.get(bet_id=item['instruction']['betId'])
-            if item['status'] != 'SUCCESS':
-                logger.error(f'Could not cancel {bet}')
-                bet.status = 'EXECUTION_COMPLETE'
-            else:
-                bet.status = 'CANCELLED'
-            bet.save()
-            logger.info(f'$$$ Cancelled {bet}')
-
-
-def list_current_bets():
-    """
-    Update orders with list_current_orders.
-    list from market status 'placed'
-    """
-    bets = Bet.objects.outstanding()
-    if not bets:
-        logger.info(f'No current bets to look up')
-        return
-    logger.warning(f'Looking up {len(bets)} current bets...')
-
-    trading = get_betfair_client()
-    res = trading.betting.list_current_orders(
-        bet_ids=[b.bet_id for b in bets],
-        order_projection='ALL',
-        order_by='BY_PLACE_TIME',
-        lightweight=True)
-    # print(json.dumps(res, indent=4, default=str, sort_keys=True))
-
-    for ix in res['currentOrders']:
-        market = Market.objects.get(market_id=ix['marketId'])
-        bf_runner = Runner.objects.get(selection_id=ix['selectionId'])
-        bet, created = Bet.objects.update_or_create(
-            bet_id=ix['betId'],
-            market=market,
-            runner=bf_runner,
-            defaults={
-                'order_type': ix['orderType'],
-                'persistence_type': ix['persistenceType'],
-                'placed_at': parse_datetime(ix['placedDate']),
-                'price': ix['priceSize']['price'],
-                'size': ix['priceSize']['size'],
-                'side': ix['side'],
-                'size_cancelled': ix['sizeCancelled'],
-                'size_lapsed': ix['sizeLapsed'],
-                'size_matched': ix['sizeMatched'],
-                'size_remaining': ix['sizeRemaining'],
-                'size_voided': ix['sizeVoided'],
-                'status': ix['status'],
-            })
-        if created:
-            logger.warning(f'Created {bet}')
-        else:
-            logger.warning(f'Updated {bet}')
-"""
-"currentOrders": [
-        {
-            "averagePriceMatched": 0.0,
-            "betId": "115934943681",
-            "bspLiability": 0.0,
-            "handicap": 0.0,
-            "marketId": "1.139870823",
-            "orderType": "LIMIT",
-            "persistenceType": "LAPSE",
-            "placedDate": "2018-02-09T10:51:29.000Z",
-            "priceSize": {
-                "price": 3.95,
-                "size": 5.0
-            },
-            "regulatorCode": "MALTA LOTTERIES AND GAMBLING AUTHORITY",
-            "selectionId": 12580825,
-            "side": "BACK",
-            "sizeCancelled": 0.0,
-            "sizeLapsed": 0.0,
-            "sizeMatched": 0.0,
-            "sizeRemaining": 5.0,
-            "sizeVoided": 0.0,
-            "status": "EXECUTABLE"
-        },
-"""
-
-
-def list_settled_bets():
-    """
-    list_cleared_bets
-    list from market status 'placed'
-    update market status 'placed' to 'finished'
-    """
-    bets = Bet.objects.outstanding()
-    if not bets:
-        logger.info(f'No settled bets to look up')
-        return
-    logger.warning(f'Looking up {len(bets)} settled bets...')
-
-    trading = get_betfair_client()
-    res = trading.betting.list_cleared_orders(
-        bet_status='SETTLED',
-        bet_ids=[b.bet_id for b in bets],
-        lightweight=True)
-    # print(json.dumps(res, indent=4, default=str, sort_keys=True))
-    for ix in res['clearedOrders']:
-        market = Market.objects.get(market_id=ix['marketId'])
-        bf_runner = Runner.objects.get(selection_id=ix['selectionId'])
-        bet, created = Bet.objects.update_or_create(
-            bet_id=ix['betId'],
-            market=market,
-            runner=bf_runner,
-            defaults={
-                'outcome': ix['betOutcome'],
-                'profit': ix['profit'],
-            })
-        if created:
-            logger.error(f'Created {bet}')
-        else:
-            logger.warning(f'Updated {bet}')
-
-"""
-            "betCount": 1,
-            "betId": "116019707654",
-            "betOutcome": "LOST",
-            "eventId": "28582075",
-            "eventTypeId": "7",
-            "handicap": 0.0,
-            "lastMatchedDate": "2018-02-09T23:54:21.000Z",
-            "marketId": "1.139926911",
-            "orderType": "LIMIT",
-            "persistenceType": "LAPSE",
-            "placedDate": "2018-02-09T23:54:10.000Z",
-            "priceMatched": 5.6,
-            "priceReduced": false,
-            "priceRequested": 5.6,
-            "profit": -5.0,
-            "selectionId": 17103170,
-            "settledDate": "2018-02-09T23:59:12.000Z",
-            "side": "BACK",
-            "sizeSettled": 5.0
-"""
-
-
-def list_lapsed_bets():
-    """
-    list_cleared_bets
-    list from market status 'placed'
-    update market status 'placed' to 'finished'
-    """
-    bets = Bet.objects.outstanding()
-    if not bets:
-        logger.info(f'No lapsed bets to look up')
-        return
-    logger.warning(f'Looking up {len(bets)} lapsed bets...')
-
-    trading = get_betfair_client()
-    res = trading.betting.list_cleared_orders(
-        bet_status='LAPSED',
-        bet_ids=[b.bet_id for b in bets],
-        lightweight=True)
-    # print(json.dumps(res, indent=4, default=str, sort_keys=True))
-    for ix in res['clearedOrders']:
-        market = Market.objects.get(market_id=ix['marketId'])
-        bf_runner = Runner.objects.get(selection_id=ix['selectionId'])
-        bet, created = Bet.objects.update_or_create(
-            bet_id=ix['betId'],
-            market=market,
-            runner=bf_runner,
-            defaults={
-                'status': 'LAPSED',
-                'size_cancelled': ix['sizeCancelled'],
-            })
-        if created:
-            logger.error(f'Created lapsed {bet}')
-        else:
-            logger.warning(f'Updated lapsed {bet}')
-
-
-def list_cancelled_bets():
-    """
-    list_cleared_bets
-    list from market status 'cancelled'
-    update market status 'placed' to 'finished'
-    """
-    bets = Bet.objects.outstanding()
-    if not bets:
-        logger.info(f'No cancelled bets to look up')
-        return
-    logger.warning(f'Looking up {len(bets)} cancelled bets...')
-
-    trading = get_betfair_client()
-    res = trading.betting.list_cleared_orders(
-        bet_status='CANCELLED',
-        bet_ids=[b.bet_id for b in bets],
-        lightweight=True)
-    # print(json.dumps(res, indent=4, default=str, sort_keys=True))
-    for ix in res['clearedOrders']:
-        market = Market.objects.get(market_id=ix['marketId'])
-        bf_runner = Runner.objects.get(selection_id=ix['selectionId'])
-        bet, created = Bet.objects.update_or_create(
-            bet_id=ix['betId'],
-            market=market,
-            runner=bf_runner,
-            defaults={
-                'status': 'CANCELLED',
-                'size_cancelled': ix['sizeCancelled'],
-            })
-        if created:
-            logger.error(f'Created cancelled {bet}')
-        else:
-            logger.warning(f'Updated cancelled {bet}')
-
-
-def get_odds(odd):
-    config = {
-        2: (2, 0.01),
-        3: (2, 0.02),
-        4: (2, 0.05),
-        6: (1, 0.1),
-        10: (1, 0.2),
-        20: (1, 0.5),
-        30: (0, 1),
-        50: (0, 2),
-        100: (0, 5),
-        1000: (0, 10),
-    }
-    for cutoff, increment in config.items():
-        if odd <= cutoff:
-            odd = bf_round(odd, increment[0], increment[1])
-            break
-    return odd
-
-
-def bf_round(x, prec=2, base=.05):
-    return round(base * round(float(x) / base), prec)
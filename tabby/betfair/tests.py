@@ -1,3 +1,680 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from tab.models import FixedOdd
+from tab.tests import FakeClock, QueryPlanMixin
+from . import ladder
+from .books import state_key, store_book
+from .models import Bet, Book, Bucket, Event, Market, Runner, RunnerBook, pack_ladder, weighted_price
+from .orders import Order, OrderDiff, acknowledged_bets, diff_orders, store_orders
+from . import standin, stream
+from .stream import MarketStream, StreamConsumer
+
+try:
+    from . import client, engine, reconcile, tasks
+except ImportError:
+    # the client imports the secrets, which are not in the repo
+    with mock.patch.dict(sys.modules, {'betfair.secrets': mock.Mock()}):
+        from . import client, engine, reconcile, tasks
+
+
+class BetfairQueryPlanTest(QueryPlanMixin, TestCase):
+    """
+    AccuracyManager.avg_win_error and BetManager.roi are left out, they
+    aggregate the whole table or nearly all of it.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        Bucket.objects.create(
+            bins=10, left=0.2, right=0.3, total=10, count=5, win_mean=0.25, coef=1, intercept=0)
+
+    def test_outstanding(self):
+        self.assertNoTableScan(lambda: list(Bet.objects.outstanding()))
+
+    def test_bet_id(self):
+        self.assertNoTableScan(lambda: Bet.objects.get(bet_id=1))
+
+    def test_matched_bets(self):
+        self.assertNoTableScan(lambda: list(Runner(pk=1).matched_bets()))
+
+    def test_latest_bins(self):
+        self.assertNoTableScan(lambda: list(Bucket.objects.latest_bins()))
+
+    def test_get_fo(self):
+        self.assertNoTableScan(lambda: Bucket.objects.get_fo(FixedOdd(win_dec=4)))
+
+    def test_link_market(self):
+        self.assertNoTableScan(lambda: Market.objects.get(
+            market_type='WIN', event__venue='Eagle Farm', start_time=timezone.now()))
+
+    def test_runner_book(self):
+        self.assertNoTableScan(lambda: RunnerBook.objects.get(book=Book(pk=1), runner__cloth_number=1))
+
+
+class MarketStreamTest(SimpleTestCase):
+
+    def setUp(self):
+        self.stream = MarketStream()
+        self.stream.on_message({'op': 'mcm', 'ct': 'SUB_IMAGE', 'initialClk': 'a', 'clk': 'b', 'pt': 1000, 'mc': [{
+            'id': '1.1', 'img': True, 'marketDefinition': {'status': 'OPEN', 'runners': [{'id': 7, 'status': 'ACTIVE'}]},
+            'rc': [{'id': 7, 'atb': [[2.5, 10], [2.4, 20]], 'atl': [[2.6, 5], [2.7, 8]], 'ltp': 2.5, 'tv': 100}],
+        }]})
+
+    def test_image(self):
+        snapshot = self.stream.take_snapshots()[0]
+        self.assertEqual(snapshot['market_id'], '1.1')
+        self.assertEqual(snapshot['book']['total_available'], 43)
+        book = snapshot['runners'][0]['book']
+        self.assertEqual((book['back_price'], book['back_size']), (2.5, 10))
+        self.assertEqual((book['lay_price'], book['lay_size']), (2.6, 5))
+
+    def test_delta_removes_empty_prices(self):
+        self.stream.take_snapshots()
+        self.stream.on_message({'op': 'mcm', 'clk': 'c', 'pt': 2000, 'mc': [{
+            'id': '1.1', 'rc': [{'id': 7, 'atb': [[2.5, 0]], 'atl': [[2.6, 0], [2.55, 3]], 'trd': [[2.5, 4]]}],
+        }]})
+        snapshot = self.stream.take_snapshots()[0]
+        book = snapshot['runners'][0]['book']
+        self.assertEqual(book['back_price'], 2.4)
+        self.assertEqual(book['lay_price'], 2.55)
+        self.assertIsNotNone(snapshot['book']['last_match_time'])
+        self.assertEqual(self.stream.clk, 'c')
+
+    def test_heartbeat(self):
+        self.stream.take_snapshots()
+        self.stream.on_message({'op': 'mcm', 'ct': 'HEARTBEAT', 'clk': 'd'})
+        self.assertEqual(self.stream.take_snapshots(), [])
+        self.assertEqual(self.stream.heartbeats, 1)
+
+    def test_failure(self):
+        with self.assertRaises(Exception):
+            self.stream.on_message({'op': 'status', 'statusCode': 'FAILURE', 'errorCode': 'NO_SESSION'})
+
+
+class LadderTest(SimpleTestCase):
+
+    def setUp(self):
+        self.rbook = RunnerBook(
+            atb=pack_ladder([{'price': 3.0, 'size': 10}, {'price': 2.9, 'size': 20}]),
+            atl=pack_ladder([[3.1, 5], [3.2, 50]]),
+            trd=pack_ladder([[2.9, 30], [3.0, 60], [3.1, 10]]),
+        )
+
+    def test_unpack(self):
+        ladder = self.rbook.back_ladder()
+        self.assertEqual(ladder.shape, (2, 2))
+        self.assertAlmostEqual(ladder[1, 0], 2.9, places=5)
+        self.assertFalse(ladder.flags.owndata)
+
+    def test_weighted_price(self):
+        self.assertAlmostEqual(self.rbook.weighted_back(10), 3.0, places=5)
+        self.assertAlmostEqual(self.rbook.weighted_back(20), 2.95, places=5)
+        self.assertAlmostEqual(self.rbook.weighted_lay(15), (3.1 * 5 + 3.2 * 10) / 15, places=5)
+        self.assertIsNone(self.rbook.weighted_back(31))
+
+    def test_traded_share(self):
+        self.assertAlmostEqual(self.rbook.traded_share(3.0), 0.7, places=5)
+        self.assertEqual(RunnerBook().traded_share(3.0), 0)
+
+    def test_empty(self):
+        self.assertIsNone(pack_ladder(None))
+        self.assertEqual(RunnerBook(atb=pack_ladder([])).back_ladder().shape, (0, 2))
+        self.assertIsNone(weighted_price(RunnerBook().back_ladder(), 1))
+
+
+class PriceLadderTest(SimpleTestCase):
+
+    def test_prices(self):
+        self.assertEqual(len(ladder.PRICES), 350)
+        self.assertEqual(ladder.PRICES[0], 1.01)
+        self.assertEqual(ladder.PRICES[-1], 1000)
+        self.assertTrue((ladder.PRICES[1:] > ladder.PRICES[:-1]).all())
+
+    def test_band_edges(self):
+        self.assertEqual(list(ladder.snap_up([3.01, 3.96, 4.01, 5.95, 6.01])), [3.05, 4, 4.1, 6, 6.2])
+        self.assertEqual(list(ladder.snap_down([3.01, 3.96, 4.01, 5.95, 6.01])), [3, 3.95, 4, 5.9, 6])
+
+    def test_on_tick(self):
+        self.assertEqual(list(ladder.snap_up([2.02, 0.1 + 0.2 + 3.7])), [2.02, 4])
+        self.assertEqual(list(ladder.snap_down([2.02, 4.000000001])), [2.02, 4])
+
+    def test_clip(self):
+        self.assertEqual(list(ladder.snap_down([1, 2000])), [1.01, 1000])
+        self.assertEqual(list(ladder.move_ticks([1.01, 1000], [-1, 1])), [1.01, 1000])
+
+    def test_ticks(self):
+        self.assertEqual(list(ladder.move_ticks([1.99, 3.95], [2, -2])), [2.02, 3.85])
+        self.assertEqual(list(ladder.ticks_between([1.01, 4], [1000, 3])), [349, -20])
+
+
+class DiffOrdersTest(SimpleTestCase):
+
+    def order(self, selection_id, side, price):
+        return Order(selection_id, selection_id, side, price, 5, {})
+
+    def test_diff(self):
+        live = {
+            (1, 'BACK'): Bet(bet_id=11, side='BACK', price=4.0),
+            (1, 'LAY'): Bet(bet_id=12, side='LAY', price=3.5),
+            (2, 'BACK'): Bet(bet_id=21, side='BACK', price=6.0),
+        }
+        desired = [self.order(1, 'BACK', 4.0), self.order(1, 'LAY', 3.45), self.order(3, 'BACK', 2.0)]
+        diff = diff_orders(desired, live)
+        self.assertEqual([bet.bet_id for bet in diff.kept], [11])
+        self.assertEqual([(bet.bet_id, order.price) for bet, order in diff.replaces], [(12, 3.45)])
+        self.assertEqual([order.selection_id for order in diff.places], [3])
+        self.assertEqual([bet.bet_id for bet in diff.cancels], [21])
+
+
+class AcknowledgedBetsTest(SimpleTestCase):
+
+    def replace(self, bet, size_cancelled):
+        order = Order(1, 1, 'BACK', 4.2, 5, {})
+        report = {
+            'status': 'SUCCESS',
+            'cancelInstructionReport': {'status': 'SUCCESS', 'sizeCancelled': size_cancelled},
+            'placeInstructionReport': {'status': 'SUCCESS', 'betId': '99', 'orderStatus': 'EXECUTABLE'},
+        }
+        errors = []
+        created, updated = acknowledged_bets(
+            Market(market_id='1.1'), OrderDiff([], [(bet, order)], [], []),
+            {'replace': ({'status': 'SUCCESS', 'instructionReports': [report]}, 1.0)}, errors)
+        self.assertEqual(errors, [])
+        return created, updated
+
+    def test_replace_unmatched(self):
+        created, updated = self.replace(Bet(bet_id=11, side='BACK', price=4.0, size=5), 5)
+        self.assertEqual([(bet.status, bet.size_cancelled) for bet in updated], [('CANCELLED', 5)])
+        self.assertEqual([(bet.bet_id, bet.size) for bet in created], [('99', 5)])
+
+    def test_replace_partially_matched(self):
+        created, updated = self.replace(Bet(bet_id=11, side='BACK', price=4.0, size=5), 3)
+        self.assertEqual([(bet.status, bet.size_cancelled) for bet in updated], [('EXECUTION_COMPLETE', 3)])
+        self.assertEqual([(bet.bet_id, bet.size, bet.liability) for bet in created], [('99', 3, 3)])
+
+    def test_rejected_call(self):
+        errors = []
+        created, updated = acknowledged_bets(
+            Market(market_id='1.1'), OrderDiff([Order(1, 1, 'BACK', 4.2, 5, {})], [], [], []),
+            {'place': ({'status': 'FAILURE', 'errorCode': 'INSUFFICIENT_FUNDS', 'instructionReports': []}, 1.0)},
+            errors)
+        self.assertEqual((created, updated, errors), ([], [], ['place INSUFFICIENT_FUNDS']))
+
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ResolveRunnersTest(TestCase):
+
+    def test_forget_deleted(self):
+        runner = Runner.objects.create(selection_id=101, name='A', sort_priority=1, handicap=0, runner_id=1)
+        stale_pk = runner.pk
+        self.assertEqual(Runner.objects.resolve([101, 102]), {101: stale_pk})
+        runner.delete()
+        self.assertEqual(Runner.objects.resolve([101]), {101: stale_pk})
+        Runner.objects.forget()
+        recreated = Runner.objects.create(selection_id=101, name='A', sort_priority=1, handicap=0, runner_id=1)
+        with self.assertNumQueries(1):
+            self.assertEqual(Runner.objects.resolve([101]), {101: recreated.pk})
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class StoreBookTest(TransactionTestCase):
+    """Outside a test transaction, so the on_commit callbacks run"""
+
+    def setUp(self):
+        # the runners are recreated for every test
+        Runner.objects.forget()
+        now = timezone.now()
+        event = Event.objects.create(
+            event_id=1, venue='Flemington', open_date=now, name='Flem', country_code='AU', timezone='AEST')
+        self.market = Market.objects.create(
+            event=event, market_id='1.1', name='R1', start_time=now, betting_type='ODDS', market_time=now,
+            market_type='WIN', suspend_time=now, turn_in_play_enabled=True)
+        for selection_id in (11, 12):
+            Runner.objects.create(market=self.market, selection_id=selection_id, name=str(selection_id),
+                                  sort_priority=1, handicap=0, runner_id=selection_id)
+        self.fields = {
+            'is_market_data_delayed': False, 'status': 'OPEN', 'bet_delay': 0, 'bsp_reconciled': False,
+            'complete': True, 'inplay': False, 'number_of_winners': 1, 'number_of_runners': 2,
+            'number_of_active_runners': 2, 'last_match_time': None, 'total_matched': 0, 'total_available': 0,
+            'cross_matching': True, 'runners_voidable': False, 'version': 1,
+        }
+        self.seen_at = now
+
+    def tearDown(self):
+        cache.clear()
+
+    def rows(self, back_11=4.0, atb_11=((4.0, 10), (3.95, 20))):
+        return [
+            {'selection_id': 11, 'book': {'status': 'ACTIVE', 'back_price': back_11, 'lay_price': 4.1,
+                                          'last_price_traded': 4.0, 'atb': pack_ladder(atb_11)}},
+            {'selection_id': 12, 'book': {'status': 'ACTIVE', 'back_price': 2.0, 'lay_price': 2.02,
+                                          'last_price_traded': 2.0}},
+        ]
+
+    def store(self, rows, seconds):
+        return store_book(self.market, self.fields, rows, self.seen_at + datetime.timedelta(seconds=seconds))
+
+    def test_dedupe(self):
+        book = self.store(self.rows(), 0)
+        self.assertEqual((Book.objects.count(), RunnerBook.objects.count()), (1, 2))
+        self.assertEqual(cache.get(state_key(self.market))['book_id'], book.pk)
+
+        self.assertIsNone(self.store(self.rows(), 5))
+        self.assertEqual((Book.objects.count(), RunnerBook.objects.count()), (1, 2))
+        book.refresh_from_db()
+        self.assertEqual(book.seen_until, self.seen_at + datetime.timedelta(seconds=5))
+
+        moved = self.store(self.rows(back_11=4.2), 10)
+        self.assertEqual((Book.objects.count(), RunnerBook.objects.count()), (2, 3))
+        self.assertEqual(list(moved.runnerbook_set.values_list('runner__selection_id', 'back_price')), [(11, 4.2)])
+        self.assertEqual(cache.get(state_key(self.market))['book_id'], moved.pk)
+
+    def test_depth_moved(self):
+        self.store(self.rows(), 0)
+        # same best prices and version, a level deeper in the ladder moved
+        moved = self.store(self.rows(atb_11=((4.0, 10), (3.95, 35))), 5)
+        self.assertIsNotNone(moved)
+        self.assertEqual((Book.objects.count(), RunnerBook.objects.count()), (2, 3))
+        self.assertEqual(moved.runnerbook_set.get().back_ladder()[:, 1].tolist(), [10, 35])
+
+    def test_total_matched_moved(self):
+        self.store(self.rows(), 0)
+        self.fields['total_matched'] = 100
+        self.assertIsNotNone(self.store(self.rows(), 5))
+        self.assertEqual((Book.objects.count(), RunnerBook.objects.count()), (2, 2))
+
+    def test_state_after_commit(self):
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                self.store(self.rows(), 0)
+                raise ValueError
+        self.assertIsNone(cache.get(state_key(self.market)))
+        self.assertEqual(Book.objects.count(), 0)
+
+
+class CannedBetting:
+    """listClearedOrders and listCurrentOrders answering from canned orders by bet status"""
+
+    def __init__(self, cleared, current):
+        self.cleared = cleared
+        self.current = current
+
+    def list_cleared_orders(self, bet_status, bet_ids, lightweight):
+        return {'clearedOrders': [ix for ix in self.cleared.get(bet_status, []) if ix['betId'] in bet_ids]}
+
+    def list_current_orders(self, bet_ids, order_projection, order_by, lightweight):
+        return {'currentOrders': [ix for ix in self.current if ix['betId'] in bet_ids]}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ReconcileTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        event = Event.objects.create(
+            event_id=2, venue='Randwick', open_date=now, name='Rand', country_code='AU', timezone='AEST')
+        cls.market = Market.objects.create(
+            event=event, market_id='1.2', name='R2', start_time=now, betting_type='ODDS', market_time=now,
+            market_type='WIN', suspend_time=now, turn_in_play_enabled=True)
+        cls.runner = Runner.objects.create(
+            market=cls.market, selection_id=301, name='A', sort_priority=1, handicap=0, runner_id=301)
+        for bet_id in (1, 2, 3, 4):
+            Bet.objects.create(
+                market=cls.market, runner=cls.runner, bet_id=bet_id, est=0.25, margin=0.1, bracket=2,
+                payout=15, liability=5, order_type='LIMIT', persistence_type='LAPSE', placed_at=now,
+                price=4.0, size=5, side='BACK', status='EXECUTABLE')
+
+    def setUp(self):
+        # runners are looked up, not taken from the pks cached by other tests
+        Runner.objects.forget()
+
+    def order(self, bet_id, **fields):
+        return dict(betId=str(bet_id), marketId='1.2', selectionId=301, **fields)
+
+    def reconcile(self, name, cleared=None, current=None):
+        trading = mock.Mock(betting=CannedBetting(cleared or {}, current or []))
+        with mock.patch.object(reconcile, 'get_betfair_client', return_value=trading):
+            return getattr(reconcile, name)()
+
+    def test_cleared(self):
+        cleared = {
+            'SETTLED': [self.order(1, betOutcome='WON', profit=15.0), self.order(2, betOutcome='LOST', profit=-5.0)],
+            'LAPSED': [self.order(3, sizeCancelled=5.0)],
+        }
+        # outstanding bets, markets, runners and the bulk update in a savepoint
+        with self.assertNumQueries(6):
+            updated = self.reconcile('reconcile_cleared_bets', cleared=cleared)
+        self.assertEqual(len(updated), 3)
+        self.assertEqual(
+            list(Bet.objects.order_by('bet_id').values_list('bet_id', 'status', 'outcome', 'profit', 'size_cancelled')),
+            [(1, 'EXECUTABLE', 'WON', 15.0, None), (2, 'EXECUTABLE', 'LOST', -5.0, None),
+             (3, 'LAPSED', None, None, 5.0), (4, 'EXECUTABLE', None, None, None)])
+        # settled and lapsed bets are no longer outstanding
+        self.assertEqual(list(Bet.objects.outstanding().values_list('bet_id', flat=True)), [4])
+
+    def test_current(self):
+        placed = timezone.now().isoformat()
+        current = [
+            self.order(bet_id, orderType='LIMIT', persistenceType='LAPSE', placedDate=placed,
+                       priceSize={'price': 4.0, 'size': 5.0}, side='BACK', sizeCancelled=0.0, sizeLapsed=0.0,
+                       sizeMatched=matched, sizeRemaining=5.0 - matched, sizeVoided=0.0, status=status)
+            for bet_id, matched, status in [(1, 5.0, 'EXECUTION_COMPLETE'), (2, 2.0, 'EXECUTABLE')]
+        ]
+        with self.assertNumQueries(6):
+            updated = self.reconcile('reconcile_current_bets', current=current)
+        self.assertEqual(len(updated), 2)
+        self.assertEqual(
+            list(Bet.objects.order_by('bet_id').values_list('bet_id', 'status', 'size_matched', 'size_remaining')),
+            [(1, 'EXECUTION_COMPLETE', 5.0, 0.0), (2, 'EXECUTABLE', 2.0, 3.0), (3, 'EXECUTABLE', None, None),
+             (4, 'EXECUTABLE', None, None)])
+
+
+class RejectingHandler(standin.StreamHandler):
+    """Stand-in refusing the first session it is given"""
+
+    def on_request(self, msg):
+        if msg['op'] == 'authentication':
+            self.server.sessions.append(msg['session'])
+            if msg['session'] == 'expired':
+                self.send({'op': 'status', 'id': msg['id'], 'statusCode': 'FAILURE',
+                           'errorCode': 'INVALID_SESSION_INFORMATION', 'connectionClosed': True})
+                self.connection.shutdown(2)
+                return
+        super().on_request(msg)
+
+
+class StreamReconnectTest(SimpleTestCase):
+
+    def setUp(self):
+        self.server = standin.serve(handler=RejectingHandler)
+        self.server.sessions = []
+        self.addCleanup(self.server.shutdown)
+
+    @mock.patch.object(stream, 'RECONNECT_DELAY', 0.05)
+    def test_rejected_session_is_renewed(self):
+        tokens = ['expired']
+        renewed = []
+
+        def renew_session(token):
+            renewed.append(token)
+            tokens.append('fresh')
+
+        writer = mock.Mock()
+        consumer = StreamConsumer(
+            'standin', lambda: tokens[-1], host='127.0.0.1', port=self.server.server_address[1], use_ssl=False,
+            market_ids=['1.11'], flush=0.1, writer=writer, renew_session=renew_session)
+        consumer.run(1)
+        self.assertEqual(renewed, ['expired'])
+        self.assertEqual(self.server.sessions, ['expired', 'fresh'])
+        self.assertEqual(consumer.reconnects, 1)
+        self.assertEqual(consumer.subscribed, {'1.11'})
+        self.assertTrue(writer.submit.called)
+
+
+class EngineTimerTest(SimpleTestCase):
+    """Race timers on a fake clock, sleeping advances the clock"""
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.start = self.clock()
+        self.db = ThreadPoolExecutor(max_workers=1)
+        self.staged = []
+        self.sent = []
+
+    def tearDown(self):
+        self.db.shutdown()
+
+    async def sleep(self, secs):
+        self.clock.tick(secs)
+
+    def stage(self, pk, offset):
+        self.staged.append((offset, self.clock() - self.start))
+        market = Market(market_id='1.1', event=Event(venue='Randwick'))
+        return engine.Staged(market, OrderDiff([], [], [], []), offset // 60, self.clock())
+
+    def send(self, market, diff):
+        self.sent.append(self.clock() - self.start)
+        return {}, []
+
+    def run_timer(self, offsets, starts_in, stage=None):
+        self.engine = engine.BettingEngine(
+            offsets=offsets, stage_ahead=15, stage_interval=2, send=self.send, writer=self.db,
+            clock=self.clock, sleep=self.sleep)
+        self.engine.starts[1] = self.start + starts_in
+        with mock.patch.object(engine, 'stage', stage or self.stage), \
+                mock.patch.object(engine, 'store_orders', return_value=[Bet(latency=0.05)]):
+            asyncio.run(self.engine.race_timer(1))
+        self.engine.http.shutdown()
+
+    def test_fires_at_offsets(self):
+        self.run_timer([30, 60], 100)
+        self.assertEqual(self.sent, [40, 70])
+        self.assertEqual(self.engine.fired, 2)
+        self.assertEqual(self.engine.timers, {})
+
+    def test_stages_ahead_of_each_offset(self):
+        self.run_timer([30, 60], 100)
+        self.assertEqual(self.staged, [(60, secs) for secs in range(25, 40, 2)] +
+                         [(30, secs) for secs in range(55, 70, 2)])
+
+    def test_skips_passed_offsets(self):
+        self.run_timer([30, 60], 45)
+        self.assertEqual(self.sent, [15])
+        self.assertEqual(self.staged, [(30, secs) for secs in range(0, 15, 2)])
+
+    def test_follows_moved_start(self):
+        def stage(pk, offset):
+            if not self.staged:
+                self.engine.starts[pk] += 20
+            return self.stage(pk, offset)
+
+        self.run_timer([60], 100, stage)
+        self.assertEqual(self.staged[:2], [(60, 25), (60, 45)])
+        self.assertEqual(self.sent, [60])
+
+    def test_nothing_staged(self):
+        self.run_timer([60], 100, lambda pk, offset: None)
+        self.assertEqual((self.sent, self.engine.fired), ([], 0))
+
+
+class StoreOrdersTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        event = Event.objects.create(
+            event_id=3, venue='Randwick', open_date=now, name='Rand', country_code='AU', timezone='AEST')
+        cls.market = Market.objects.create(
+            event=event, market_id='1.3', name='R3', start_time=now, betting_type='ODDS', market_time=now,
+            market_type='WIN', suspend_time=now, turn_in_play_enabled=True)
+        cls.runner = Runner.objects.create(
+            market=cls.market, selection_id=302, name='A', sort_priority=1, handicap=0, runner_id=302)
+
+    def store(self, triggered_at=None):
+        order = Order(self.runner.pk, 302, 'BACK', 4.0, 5, {'est': 0.25, 'margin': 0.1, 'bracket': 2})
+        report = {'status': 'SUCCESS', 'betId': '77', 'orderStatus': 'EXECUTABLE'}
+        results = {'place': ({'status': 'SUCCESS', 'instructionReports': [report]}, 100.25)}
+        store_orders(self.market, OrderDiff([order], [], [], []), results, [], triggered_at)
+        return Bet.objects.get(bet_id=77)
+
+    def test_latency(self):
+        self.assertAlmostEqual(self.store(triggered_at=100.0).latency, 0.25)
+
+    def test_no_trigger(self):
+        self.assertIsNone(self.store().latency)
+
+
+class CatalogueBetting:
+    """listMarketCatalogue over a fixed set of markets, sorted on start time"""
+
+    def __init__(self, cats):
+        self.cats = sorted(cats, key=lambda cat: cat['marketStartTime'])
+        self.calls = []
+
+    def list_market_catalogue(self, filter, market_projection, max_results, lightweight, sort=None):
+        if 'marketIds' in filter:
+            self.calls.append(filter['marketIds'])
+            return [cat for cat in self.cats if cat['marketId'] in filter['marketIds']][:max_results]
+        self.calls.append(market_projection)
+        time_from = parse_datetime(filter['marketStartTime']['from'])
+        light = [{key: cat[key] for key in ('marketId', 'marketName', 'marketStartTime', 'totalMatched', 'event')}
+                 for cat in self.cats if parse_datetime(cat['marketStartTime']) >= time_from]
+        return light[:max_results]
+
+
+def catalogue(market_id, start_time, name='R1 1200m'):
+    event_id = market_id.replace('.', '')
+    return {
+        'marketId': market_id,
+        'marketName': name,
+        'marketStartTime': start_time.strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+        'totalMatched': 0,
+        'event': {'id': event_id, 'name': f'Event {event_id}', 'countryCode': 'AU', 'timezone': 'Australia/Sydney',
+                  'venue': 'Randwick', 'openDate': start_time.strftime('%Y-%m-%dT%H:%M:%S.000Z')},
+        'description': {'bettingType': 'ODDS', 'marketTime': start_time.isoformat(), 'marketType': 'WIN',
+                        'suspendTime': start_time.isoformat(), 'turnInPlayEnabled': True, 'raceType': 'Flat'},
+        'runners': [{'selectionId': int(event_id) * 10 + n, 'runnerName': f'{n}. Runner', 'sortPriority': n,
+                     'handicap': 0, 'metadata': {'CLOTH_NUMBER': str(n), 'runnerId': str(n)}} for n in (1, 2)],
+    }
+
+
+class MarketCatalogueTest(TestCase):
+
+    def setUp(self):
+        Runner.objects.forget()
+        start_time = timezone.now().replace(microsecond=0) + datetime.timedelta(minutes=10)
+        # markets 1.2 and 1.3 start together and straddle the first page
+        minutes = {'1.1': 0, '1.2': 5, '1.3': 5, '1.4': 10, '1.5': 15}
+        self.cats = [catalogue(market_id, start_time + datetime.timedelta(minutes=m))
+                     for market_id, m in minutes.items()]
+        self.start_time = start_time
+
+    def sync(self):
+        betting = CatalogueBetting(self.cats)
+        with mock.patch.object(tasks, 'get_betfair_client', return_value=mock.Mock(betting=betting)), \
+                mock.patch.object(tasks, 'CATALOGUE_PAGE', 3):
+            tasks.list_market_catalogue()
+        return betting.calls
+
+    def test_pages_past_the_cap(self):
+        calls = self.sync()
+        light = tasks.LIGHT_PROJECTION
+        self.assertEqual(calls, [light, light, light, ['1.1', '1.2', '1.3', '1.4', '1.5']])
+        self.assertEqual(Market.objects.count(), 5)
+        self.assertEqual(Runner.objects.filter(market__market_id='1.3').count(), 2)
+
+    def test_only_new_markets_are_fetched_in_full(self):
+        self.sync()
+        self.cats.append(catalogue('1.6', self.start_time + datetime.timedelta(minutes=20)))
+        self.cats[1]['marketName'] = 'R2 1400m'
+        calls = self.sync()
+        self.assertEqual(calls[-1], ['1.6'])
+        self.assertEqual(Market.objects.count(), 6)
+        self.assertEqual(Market.objects.get(market_id='1.2').name, 'R2 1400m')
+
+    def test_unchanged(self):
+        self.sync()
+        # the known markets, and the savepoint pair of the empty upsert
+        with self.assertNumQueries(3):
+            calls = self.sync()
+        self.assertNotIn(['1.1'], calls)
+        self.assertTrue(all(call == tasks.LIGHT_PROJECTION for call in calls))
+
+
+class FakeClient:
+    """APIClient counting the logins and keep alives"""
+    logins = 0
+
+    def __init__(self, fail_keep_alive=False):
+        self.session_token = None
+        self.session_timeout = 8 * 60 * 60
+        self.keep_alives = 0
+        self.fail_keep_alive = fail_keep_alive
+
+    def login(self):
+        FakeClient.logins += 1
+        self.session_token = f'token-{FakeClient.logins}'
+
+    def keep_alive(self):
+        if self.fail_keep_alive:
+            raise Exception('INVALID_SESSION_INFORMATION')
+        self.keep_alives += 1
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class SharedSessionTest(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        FakeClient.logins = 0
+        self.client = FakeClient()
+        patcher = mock.patch.object(client, 'get_process_client', side_effect=lambda: self.client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def store(self, refresh_in, expires_in, token='cached'):
+        now = client.time()
+        session = {'token': token, 'refresh_at': now + refresh_in, 'expires_at': now + expires_in}
+        cache.set(client.SESSION_KEY, session)
+        return session
+
+    def test_processes_share_the_session(self):
+        self.assertEqual(client.get_betfair_client().session_token, 'token-1')
+        # another process with its own client
+        self.client = FakeClient()
+        self.assertEqual(client.get_betfair_client().session_token, 'token-1')
+        self.assertEqual(FakeClient.logins, 1)
+
+    def test_due_session_is_kept_alive(self):
+        self.store(-1, 60)
+        self.assertEqual(client.get_betfair_client().session_token, 'cached')
+        self.assertEqual((self.client.keep_alives, FakeClient.logins), (1, 0))
+        self.assertGreater(cache.get(client.SESSION_KEY)['refresh_at'], client.time() + 60)
+
+    def test_failed_keep_alive_logs_in(self):
+        self.client = FakeClient(fail_keep_alive=True)
+        self.store(-1, 60)
+        self.assertEqual(client.get_betfair_client().session_token, 'token-1')
+
+    def test_locked_uses_unexpired_session(self):
+        self.store(-1, 60)
+        cache.add(client.SESSION_LOCK_KEY, 1)
+        self.assertEqual(client.get_betfair_client().session_token, 'cached')
+        self.assertEqual((self.client.keep_alives, FakeClient.logins), (0, 0))
+
+    def test_locked_without_session(self):
+        cache.add(client.SESSION_LOCK_KEY, 1)
+        with mock.patch.object(client, 'LOCK_TIMEOUT', 0.2), self.assertRaises(client.SessionLocked):
+            client.get_betfair_client()
+        self.assertEqual(FakeClient.logins, 0)
+
+    def test_keep_alive_session(self):
+        with mock.patch.object(tasks, 'get_process_client', side_effect=lambda: self.client):
+            # due within REFRESH_AHEAD
+            self.store(client.REFRESH_AHEAD - 60, client.REFRESH_AHEAD * 2)
+            tasks.keep_alive_session()
+            self.assertEqual(self.client.keep_alives, 1)
+            # far from due
+            tasks.keep_alive_session()
+            self.assertEqual(self.client.keep_alives, 1)
+        self.assertFalse(cache.get(client.SESSION_LOCK_KEY))
+        self.assertEqual(FakeClient.logins, 0)
+
+    def test_keep_alive_session_is_scheduled(self):
+        self.assertIn('betfair.tasks.keep_alive_session',
+                      [entry['task'] for entry in settings.CELERY_BEAT_SCHEDULE.values()])
@@ -54,7 +54,7 @@ def _get_est_acc():
                 if not trade:
                     continue
                 trade = 1 / trade
-                fo = runner.fixedodd_set.first()
+                fo = runner.latest_fixed_odd()
                 if not fo:
                     continue
                 est = fo.win_est
@@ -102,7 +102,7 @@ def _get_winnings():
                 lay = runner.lay
                 if not trade or not back or not lay:
                     continue
-                fo = runner.fixedodd_set.first()
+                fo = runner.latest_fixed_odd()
                 if not fo:
                     continue
                 est = fo.win_est
@@ -5,4 +5,6 @@ docker run --rm -d --name haas  -p 5672:5672 -p 15672:15672 --hostname haashost
 sleep 4
 docker ps
 sleep 4
+# single writer of the fetched odds, books and results
+pipenv run celery -A tabby worker -l info -Q ingest -c 1 -n ingest@%h --detach
 pipenv run celery -A tabby worker -l info -B --scheduler django_celery_beat.schedulers:DatabaseScheduler --concurrency=1
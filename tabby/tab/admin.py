@@ -10,20 +10,18 @@ class RunnerAdmin(admin.ModelAdmin):
         return obj.race.start_time
 
     def fixedodds__win_dec(self, obj):
-        fixed_odds = obj.fixedodd_set.first()
-        return fixed_odds.win_dec if fixed_odds else None
+        return obj.fo_win_latest
 
     def fixedodds__place_dec(self, obj):
-        fixed_odds = obj.fixedodd_set.first()
-        return fixed_odds.place_dec if fixed_odds else None
+        return obj.fo_place_latest
 
     date_hierarchy = 'race__start_time'
     list_display = ('race__start_time', 'runner_number', 'name', 'dfs_form_rating', 'fixedodds__win_dec',
                     'fixedodds__place_dec', 'last_5_starts', 'race',)
     list_select_related = ('race',)
     race__start_time.admin_order_field = 'race__start_time'
-    fixedodds__win_dec.admin_order_field = 'fixedodd__win_dec'
-    fixedodds__place_dec.admin_order_field = 'fixedodd__place_dec'
+    fixedodds__win_dec.admin_order_field = 'fo_win_latest'
+    fixedodds__place_dec.admin_order_field = 'fo_place_latest'
 
 
 @admin.register(RunnerMeta)
@@ -1,5 +1,19 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    """Apply settings.SQLITE_PRAGMAS to every new sqlite connection"""
+    if connection.vendor != 'sqlite':
+        return
+    from django.conf import settings
+    with connection.cursor() as cursor:
+        for pragma, value in getattr(settings, 'SQLITE_PRAGMAS', {}).items():
+            cursor.execute(f'PRAGMA {pragma} = {value}')
 
 
 class TabConfig(AppConfig):
     name = 'tab'
+
+    def ready(self):
+        connection_created.connect(configure_sqlite, dispatch_uid='tab.configure_sqlite')
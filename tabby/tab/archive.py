@@ -0,0 +1,106 @@
+"""
+Columnar odds history archive.
+
+The fixed and tote odds ticks of finished races are packed into one flat
+structured .npy file per kind per meeting date, sorted on (race, runner,
+as_at). Readers memory-map the files and slice races and runners out with a
+binary search, so long-range analytics never touch the database.
+"""
+import datetime
+import os
+from functools import lru_cache
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+
+from .models import FixedOdd, ParimutuelOdd
+
+DTYPE = np.dtype([
+    ('race', 'i8'),
+    ('runner', 'i8'),
+    ('as_at', 'M8[ms]'),
+    ('win_dec', 'f8'),
+    ('place_dec', 'f8'),
+])
+
+KINDS = {
+    'fixed': FixedOdd,
+    'tote': ParimutuelOdd,
+}
+
+
+def archive_path(date, kind):
+    return os.path.join(settings.ODDS_ARCHIVE_DIR, f'{date.isoformat()}.{kind}.npy')
+
+
+def archive_races(date, race_ids, purge=False):
+    """Pack the odds ticks of the races (all on the meeting date) into the archive files of that date"""
+    for kind, model in KINDS.items():
+        rows = model.objects.filter(
+            runner__race_id__in=race_ids
+        ).values_list('runner__race_id', 'runner_id', 'as_at', 'win_dec', 'place_dec').order_by()
+        packed = np.array([
+            (race_id, runner_id, int(as_at.timestamp() * 1000), win_dec, np.nan if place_dec is None else place_dec)
+            for race_id, runner_id, as_at, win_dec, place_dec in rows
+        ], dtype=[('race', 'i8'), ('runner', 'i8'), ('as_at', 'i8'), ('win_dec', 'f8'), ('place_dec', 'f8')])
+        packed = packed.astype(DTYPE) if len(packed) else np.empty(0, dtype=DTYPE)
+
+        # merge with races archived earlier for the date, replacing rearchived races
+        path = archive_path(date, kind)
+        if os.path.exists(path):
+            existing = np.load(path)
+            existing = existing[~np.isin(existing['race'], race_ids)]
+            packed = np.concatenate([existing, packed])
+        packed = packed[np.lexsort((packed['as_at'], packed['runner'], packed['race']))]
+
+        os.makedirs(settings.ODDS_ARCHIVE_DIR, exist_ok=True)
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.save(f, packed)
+        os.replace(tmp_path, path)
+    _load.cache_clear()
+
+    if purge:
+        with transaction.atomic():
+            for model in KINDS.values():
+                model.objects.filter(runner__race_id__in=race_ids).delete()
+
+
+@lru_cache(maxsize=32)
+def _load(path, mtime):
+    return np.load(path, mmap_mode='r')
+
+
+def load_archive(date, kind='fixed'):
+    """
+    Memory-mapped archive of the date, empty when nothing was archived.
+    Mappings are cached on the file modification time, so files rewritten by other processes are reloaded.
+    """
+    path = archive_path(date, kind)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return np.empty(0, dtype=DTYPE)
+    return _load(path, mtime)
+
+
+def race_odds(date, race_id, kind='fixed'):
+    """Odds ticks of the race, ordered by runner and as_at"""
+    data = load_archive(date, kind)
+    lo, hi = np.searchsorted(data['race'], [race_id, race_id + 1])
+    return data[lo:hi]
+
+
+def runner_odds(date, race_id, runner_id, kind='fixed'):
+    """Odds ticks of the runner, ordered by as_at"""
+    data = race_odds(date, race_id, kind)
+    lo, hi = np.searchsorted(data['runner'], [runner_id, runner_id + 1])
+    return data[lo:hi]
+
+
+def race_ticks(race, kind='fixed'):
+    """Archived odds ticks of the race as (runner_id, as_at, win_dec, place_dec), ordered by runner and as_at"""
+    for _, runner_id, as_at, win_dec, place_dec in race_odds(race.meeting.date, race.id, kind).tolist():
+        as_at = as_at.replace(tzinfo=datetime.timezone.utc)
+        yield runner_id, as_at, win_dec, None if np.isnan(place_dec) else place_dec
@@ -0,0 +1,102 @@
+"""
+Pooled keep-alive client for the TAB info service.
+
+One `requests.Session` per process reuses TCP/TLS connections across polls.
+Race documents can be fetched conditionally: the ETag and Last-Modified
+validators of every URL are remembered, so an unchanged document comes back
+as a 304 and the cached parsed document is returned without any JSON parsing.
+"""
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+POOL_CONNECTIONS = 4
+POOL_MAXSIZE = 32
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 20
+MAX_DOCUMENTS = 2000
+
+
+class TabClient:
+
+    def __init__(self, pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE,
+                 timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), max_documents=MAX_DOCUMENTS):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=1)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
+            'Accept': 'application/json',
+            'Accept-Encoding': 'gzip, deflate',
+        })
+        self.timeout = timeout
+        self.max_documents = max_documents
+        self.documents = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, url, **kwargs):
+        """Plain GET over the pooled session"""
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session.get(url, **kwargs)
+
+    def get_json(self, url, **kwargs):
+        res = self.get(url, **kwargs)
+        res.raise_for_status()
+        return res.json()
+
+    def get_document(self, url):
+        """
+        Conditional GET of a document.
+        Returns (document, modified), modified is False when the server answered 304.
+        """
+        with self.lock:
+            cached = self.documents.get(url)
+        headers = {}
+        if cached:
+            etag, last_modified, _ = cached
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+
+        res = self.get(url, headers=headers)
+        if res.status_code == requests.codes.not_modified and cached:
+            with self.lock:
+                self.documents.move_to_end(url)
+            return cached[2], False
+        res.raise_for_status()
+        document = res.json()
+
+        etag = res.headers.get('ETag')
+        last_modified = res.headers.get('Last-Modified')
+        if etag or last_modified:
+            with self.lock:
+                self.documents[url] = (etag, last_modified, document)
+                self.documents.move_to_end(url)
+                while len(self.documents) > self.max_documents:
+                    self.documents.popitem(last=False)
+        return document, True
+
+    def forget(self, url):
+        """Drop the cached document of a url"""
+        with self.lock:
+            self.documents.pop(url, None)
+
+
+_client = None
+_client_pid = None
+
+
+def get_tab_client():
+    """Client of the current process, prefork children never share sockets"""
+    global _client, _client_pid
+    if _client is None or _client_pid != os.getpid():
+        _client = TabClient()
+        _client_pid = os.getpid()
+    return _client
@@ -0,0 +1,43 @@
+from time import time
+
+import requests
+from django.core.management.base import BaseCommand
+
+from ... import standin
+from ...client import TabClient
+
+
+class Command(BaseCommand):
+    help = 'Compare bare requests.get with the pooled TAB client against a local stand-in server'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--races', type=int, default=10)
+
+    def handle(self, *args, **kwargs):
+        server = standin.serve()
+        urls = [f'{standin.base_url(server)}/races/{n}' for n in range(1, kwargs['races'] + 1)]
+        urls = [urls[i % len(urls)] for i in range(kwargs['requests'])]
+        self.stdout.write(f'{len(urls)} race document requests over {kwargs["races"]} races')
+
+        def bare(url):
+            res = requests.get(url)
+            res.raise_for_status()
+            res.json()
+
+        client = TabClient()
+        conditional_client = TabClient()
+        self.bench('requests.get', server, urls, bare)
+        self.bench('pooled', server, urls, client.get_json)
+        self.bench('pooled conditional', server, urls, conditional_client.get_document)
+        server.shutdown()
+
+    def bench(self, name, server, urls, get):
+        connections = server.connections
+        time_start = time()
+        for url in urls:
+            get(url)
+        elapsed = time() - time_start
+        self.stdout.write(
+            f'{name:>20}: {elapsed / len(urls) * 1000:.2f}ms/request  '
+            f'{server.connections - connections} connections')
@@ -0,0 +1,76 @@
+import asyncio
+import datetime
+from time import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from ... import standin
+from ...models import Meeting
+from ...poller import RacePoller, CONCURRENCY
+
+
+class StandInRace:
+    """In-memory race pointing at the stand-in server"""
+
+    def __init__(self, url, number):
+        self.pk = number
+        self.number = number
+        self.link_self = f'{url}/races/{number}'
+        self.start_time = timezone.now()
+
+
+class Command(BaseCommand):
+    help = 'Measure race polls per minute against a local stand-in TAB server, ingesting into the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--races', type=int, default=100)
+        parser.add_argument('--seconds', type=int, default=10)
+        parser.add_argument('--concurrency', type=int, default=CONCURRENCY)
+        parser.add_argument('--no-ingest', action='store_true',
+                            help='leave database ingestion out and only measure fetch and parse multiplexing')
+
+    def handle(self, *args, **kwargs):
+        server = standin.serve()
+        url = standin.base_url(server)
+        if kwargs['no_ingest']:
+            poller = RacePoller(concurrency=kwargs['concurrency'], ingest=lambda race, res: None)
+            races = [StandInRace(url, n) for n in range(1, kwargs['races'] + 1)]
+        else:
+            # stand-in races are upserted and ingested through the poller's writer, like the live poller
+            poller = RacePoller(concurrency=kwargs['concurrency'])
+            now = timezone.now().replace(second=0, microsecond=0)
+            items = [
+                standin.race_document(url, n, now + datetime.timedelta(minutes=n), runners=0)
+                for n in range(1, kwargs['races'] + 1)
+            ]
+            races = poller.db.submit(poller.upsert, items).result()
+        self.stdout.write(f'Polling {len(races)} races on {url} for {kwargs["seconds"]}s')
+
+        time_start = time()
+        asyncio.run(self.bench(poller, races, time_start + kwargs['seconds']))
+        elapsed = time() - time_start
+        server.shutdown()
+
+        rate = poller.polls / elapsed * 60
+        mode = 'fetch and parse only' if kwargs['no_ingest'] else 'with ingest'
+        self.stdout.write(
+            f'{poller.polls} polls in {elapsed:.1f}s = {rate:.0f} polls/min {mode} ({poller.errors} errors)')
+
+        if not kwargs['no_ingest']:
+            poller.db.submit(
+                lambda: Meeting.objects.filter(id__in={race.meeting_id for race in races}).delete()
+            ).result()
+        poller.db.shutdown()
+
+    async def bench(self, poller, races, deadline):
+        poller.semaphore = asyncio.Semaphore(poller.concurrency)
+
+        async def hammer(race):
+            while time() < deadline:
+                try:
+                    await poller.poll(race)
+                except Exception:
+                    poller.errors += 1
+
+        await asyncio.gather(*[hammer(race) for race in races])
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from ...poller import RacePoller, CONCURRENCY, REFRESH
+
+
+class Command(BaseCommand):
+    help = 'Poll all active TAB races from a single event loop'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=CONCURRENCY)
+        parser.add_argument('--refresh', type=int, default=REFRESH)
+
+    def handle(self, *args, **kwargs):
+        self.stdout.write(f'Polling races with concurrency={kwargs["concurrency"]} refresh={kwargs["refresh"]}s')
+        RacePoller(concurrency=kwargs['concurrency'], refresh=kwargs['refresh']).run()
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-17 04:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tab', '0032_var_ran_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='race',
+            name='has_archived',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 3.2.25 on 2026-10-17 04:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tab', '0033_race_has_archived'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='race',
+            name='has_bars',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='OddsBar',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('F', 'Fixed'), ('P', 'Parimutuel')], max_length=1)),
+                ('minute', models.DateTimeField()),
+                ('open', models.FloatField()),
+                ('high', models.FloatField()),
+                ('low', models.FloatField()),
+                ('close', models.FloatField()),
+                ('place_close', models.FloatField(null=True)),
+                ('ticks', models.IntegerField()),
+                ('runner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='tab.Runner')),
+            ],
+            options={
+                'ordering': ['-minute'],
+                'unique_together': {('runner', 'kind', 'minute')},
+            },
+        ),
+    ]
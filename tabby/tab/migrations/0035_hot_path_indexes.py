@@ -0,0 +1,29 @@
+# Generated by Django 3.2.25 on 2026-10-17 04:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tab', '0034_oddsbar'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='fixedodd',
+            index=models.Index(fields=['runner', '-as_at'], name='fixedodd_runner_as_at'),
+        ),
+        migrations.AddIndex(
+            model_name='parimutuelodd',
+            index=models.Index(fields=['runner', '-as_at'], name='parimutuelodd_runner_as_at'),
+        ),
+        migrations.AddIndex(
+            model_name='race',
+            index=models.Index(fields=['has_results', 'has_processed'], name='race_results_processed'),
+        ),
+        migrations.AddIndex(
+            model_name='race',
+            index=models.Index(fields=['start_time'], name='race_start_time'),
+        ),
+    ]
@@ -0,0 +1,112 @@
+# Generated by Django 3.2.25 on 2026-10-17 04:35
+
+from django.db import migrations, models
+from django.db.models import Count, Max, Min, OuterRef, Subquery, Sum
+
+
+def backfill_odds_summary(apps, schema_editor):
+    """Summarise the existing fixed odds ticks, or the minute bars where the ticks were pruned"""
+    Runner = apps.get_model('tab', 'Runner')
+    FixedOdd = apps.get_model('tab', 'FixedOdd')
+    OddsBar = apps.get_model('tab', 'OddsBar')
+
+    ticks = FixedOdd.objects.filter(runner=OuterRef('pk'))
+
+    def tick_agg(agg):
+        return Subquery(ticks.order_by().values('runner').annotate(value=agg).values('value'))
+
+    first = ticks.order_by('as_at')
+    last = ticks.order_by('-as_at')
+    Runner.objects.filter(id__in=FixedOdd.objects.values('runner')).update(
+        fo_win_open=Subquery(first.values('win_dec')[:1]),
+        fo_place_open=Subquery(first.values('place_dec')[:1]),
+        fo_win_latest=Subquery(last.values('win_dec')[:1]),
+        fo_place_latest=Subquery(last.values('place_dec')[:1]),
+        fo_changed_at=Subquery(last.values('as_at')[:1]),
+        fo_win_min=tick_agg(Min('win_dec')),
+        fo_win_max=tick_agg(Max('win_dec')),
+        fo_place_min=tick_agg(Min('place_dec')),
+        fo_place_max=tick_agg(Max('place_dec')),
+        fo_ticks=tick_agg(Count('id')),
+    )
+
+    bars = OddsBar.objects.filter(runner=OuterRef('pk'), kind='F')
+
+    def bar_agg(agg):
+        return Subquery(bars.order_by().values('runner').annotate(value=agg).values('value'))
+
+    first = bars.order_by('minute')
+    last = bars.order_by('-minute')
+    Runner.objects.filter(fo_win_latest__isnull=True, id__in=OddsBar.objects.filter(kind='F').values('runner')).update(
+        fo_win_open=Subquery(first.values('open')[:1]),
+        fo_place_open=Subquery(first.values('place_close')[:1]),
+        fo_win_latest=Subquery(last.values('close')[:1]),
+        fo_place_latest=Subquery(last.values('place_close')[:1]),
+        fo_changed_at=Subquery(last.values('minute')[:1]),
+        fo_win_min=bar_agg(Min('low')),
+        fo_win_max=bar_agg(Max('high')),
+        fo_place_min=bar_agg(Min('place_close')),
+        fo_place_max=bar_agg(Max('place_close')),
+        fo_ticks=bar_agg(Sum('ticks')),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tab', '0035_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='runner',
+            name='fo_changed_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='runner',
+            name='fo_place_latest',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='runner',
+            name='fo_place_max',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='runner',
+            name='fo_place_min',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='runner',
+            name='fo_place_open',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='runner',
+            name='fo_ticks',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='runner',
+            name='fo_win_latest',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='runner',
+            name='fo_win_max',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='runner',
+            name='fo_win_min',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='runner',
+            name='fo_win_open',
+            field=models.FloatField(null=True),
+        ),
+        migrations.RunPython(backfill_odds_summary, migrations.RunPython.noop),
+    ]
@@ -61,9 +61,15 @@ class Race(models.Model):
 
     has_results = models.BooleanField(default=False)
     has_processed = models.BooleanField(default=False)
+    has_archived = models.BooleanField(default=False)
+    has_bars = models.BooleanField(default=False)
 
     class Meta:
         ordering = ['start_time']
+        indexes = [
+            models.Index(fields=['has_results', 'has_processed'], name='race_results_processed'),
+            models.Index(fields=['start_time'], name='race_start_time'),
+        ]
 
     def __str__(self):
         return f'<Race [{self.id}] {self.meeting.name} R{self.number} time={self.start_time}>'
@@ -97,36 +103,76 @@ class Runner(models.Model):
     fixed_betting_status = models.CharField(max_length=20, null=True)
     parimutuel_betting_status = models.CharField(max_length=20, null=True)
 
+    # fixed odds summary, kept up to date by ingest_race
+    fo_win_open = models.FloatField(null=True)
+    fo_win_latest = models.FloatField(null=True)
+    fo_win_min = models.FloatField(null=True)
+    fo_win_max = models.FloatField(null=True)
+    fo_place_open = models.FloatField(null=True)
+    fo_place_latest = models.FloatField(null=True)
+    fo_place_min = models.FloatField(null=True)
+    fo_place_max = models.FloatField(null=True)
+    fo_ticks = models.IntegerField(default=0)
+    fo_changed_at = models.DateTimeField(null=True)
+
+    SUMMARY_FIELDS = [
+        'fo_win_open', 'fo_win_latest', 'fo_win_min', 'fo_win_max',
+        'fo_place_open', 'fo_place_latest', 'fo_place_min', 'fo_place_max',
+        'fo_ticks', 'fo_changed_at',
+    ]
+
     class Meta:
         ordering = ['barrier_number', 'runner_number']
 
     def __str__(self):
         return f'Runner(num={self.runner_number} name={self.name})'
 
-    def fo(self):
-        return self.fixedodd_set.all()[:5]
+    def record_fixed_odd(self, win_dec, place_dec, as_at):
+        """Fold a new fixed odds tick into the odds summary, saved by the caller"""
+        if self.fo_win_open is None:
+            self.fo_win_open = win_dec
+            self.fo_place_open = place_dec
+        self.fo_win_latest = win_dec
+        self.fo_place_latest = place_dec
+        self.fo_win_min = min(win_dec, self.fo_win_min or win_dec)
+        self.fo_win_max = max(win_dec, self.fo_win_max or win_dec)
+        if place_dec:
+            self.fo_place_min = min(place_dec, self.fo_place_min or place_dec)
+            self.fo_place_max = max(place_dec, self.fo_place_max or place_dec)
+        self.fo_ticks += 1
+        self.fo_changed_at = as_at
 
     def odds_change(self):
-        first = self.fixedodd_set.first()
-        last = list(self.fixedodd_set.all()[:5])[-1]
-        first_perc = 1 / first.win_dec
-        last_perc = 1 / last.win_dec
-        return (first_perc - last_perc) / last_perc
+        """Relative change of the win chance from the opening to the latest fixed odds, positive when shortening"""
+        if not self.fo_win_open or not self.fo_win_latest:
+            return None
+        first_perc = 1 / self.fo_win_open
+        last_perc = 1 / self.fo_win_latest
+        return (last_perc - first_perc) / first_perc
+
+    def latest_fixed_odd(self):
+        """
+        Latest fixed odd, built from the odds summary.
+        Races whose ticks were pruned before the summary was kept fall back to the close of their last bar.
+        """
+        if self.fo_win_latest is not None:
+            return FixedOdd(runner=self, as_at=self.fo_changed_at, win_dec=self.fo_win_latest,
+                            place_dec=self.fo_place_latest)
+        bar = self.oddsbar_set.filter(kind=OddsBar.FIXED).first()
+        if bar:
+            return FixedOdd(runner=self, as_at=bar.minute, win_dec=bar.close, place_dec=bar.place_close)
 
     @property
     def rbook(self):
+        """Latest betfair runner book, books only store the runners that moved"""
         if not hasattr(self, '_rbook'):
             self._rbook = None
             market = self.race.market_set.first()
             if market:
-                book = market.book_set.last()
-                try:
-                    self._rbook = RunnerBook.objects.get(
-                        book=book,
-                        runner__cloth_number=self.runner_number
-                    )
-                except:
-                    self._rbook = None
+                self._rbook = RunnerBook.objects.filter(
+                    book__market=market,
+                    runner__cloth_number=self.runner_number
+                ).order_by('-id').first()
         return self._rbook
 
     @property
@@ -160,6 +206,9 @@ class FixedOdd(models.Model):
 
     class Meta:
         ordering = ['-as_at']
+        indexes = [
+            models.Index(fields=['runner', '-as_at'], name='fixedodd_runner_as_at'),
+        ]
 
     @property
     def win_perc(self):
@@ -196,6 +245,36 @@ class ParimutuelOdd(models.Model):
 
     class Meta:
         ordering = ['-as_at']
+        indexes = [
+            models.Index(fields=['runner', '-as_at'], name='parimutuelodd_runner_as_at'),
+        ]
+
+
+class OddsBar(models.Model):
+    """Per-minute open/high/low/close of a runner's win odds"""
+    FIXED = 'F'
+    PARIMUTUEL = 'P'
+    KINDS = (
+        (FIXED, 'Fixed'),
+        (PARIMUTUEL, 'Parimutuel'),
+    )
+
+    runner = models.ForeignKey(Runner, on_delete=models.CASCADE)
+    kind = models.CharField(max_length=1, choices=KINDS)
+    minute = models.DateTimeField()
+    open = models.FloatField()
+    high = models.FloatField()
+    low = models.FloatField()
+    close = models.FloatField()
+    place_close = models.FloatField(null=True)
+    ticks = models.IntegerField()
+
+    class Meta:
+        ordering = ['-minute']
+        unique_together = ('runner', 'kind', 'minute')
+
+    def __str__(self):
+        return f'OddsBar(runner={self.runner_id} {self.kind} {self.minute} close={self.close})'
 
 
 class Result(models.Model):
@@ -0,0 +1,156 @@
+"""
+Long-lived race poller.
+
+Holds every active race in memory and multiplexes the TAB `link_self`
+fetches over one asyncio loop. A RaceScheduler decides which race is due
+next. HTTP runs on a bounded thread pool and all database work goes through
+the single Writer thread, which groups the ingests of concurrent polls into
+one transaction, so the ORM is never touched from the event loop itself.
+
+The races a poller monitors are claimed in its own memory, not in the shared
+cache, so a restarted poller picks up every race again: on start it resumes
+the unresulted races that started recently, then claims from next-to-go.
+"""
+import asyncio
+import datetime
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.utils import timezone
+
+from .client import get_tab_client
+from .models import Race
+from .scheduler import RaceScheduler, RESULTS_INTERVAL
+from .tasks import NEXT_TO_GO_URL, bulk_upsert_races, ingest_race, save_results
+from .writer import Writer
+
+logger = logging.getLogger(__name__)
+
+CONCURRENCY = 20
+REFRESH = 60
+# longest sleep of the dispatcher, new races are picked up at least this often
+TICK = 1
+# unresulted races that started within this many seconds are resumed on start
+RESUME_WINDOW = 3 * 60 * 60
+
+
+def fetch_json(url):
+    return get_tab_client().get_json(url)
+
+
+def fetch_document(url):
+    return get_tab_client().get_document(url)
+
+
+class RacePoller:
+
+    def __init__(self, concurrency=CONCURRENCY, refresh=REFRESH, next_to_go_url=NEXT_TO_GO_URL,
+                 fetch=fetch_json, fetch_document=fetch_document, ingest=ingest_race, scheduler=None,
+                 writer=None):
+        self.concurrency = concurrency
+        self.refresh = refresh
+        self.next_to_go_url = next_to_go_url
+        self.fetch = fetch
+        self.fetch_document = fetch_document
+        self.ingest = ingest
+        self.scheduler = scheduler or RaceScheduler()
+        self.races = {}
+        self.polls = 0
+        self.errors = 0
+        self.http = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='poller-http')
+        self.db = writer or Writer()
+        self.semaphore = None
+
+    def run(self):
+        asyncio.run(self.main())
+
+    async def main(self):
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        await self.resume()
+        await asyncio.gather(self.refresher(), self.dispatcher())
+
+    async def resume(self):
+        """Schedule the unresulted races a previous poller left behind"""
+        races = await self.call(self.db, unresulted_races, RESUME_WINDOW)
+        self.schedule(races)
+        logger.warning(f'Resumed {len(races)} unresulted races')
+
+    async def refresher(self):
+        while True:
+            try:
+                await self.scrape()
+            except Exception as exc:
+                logger.error(f'Next to go scrape failed: {exc}')
+            await asyncio.sleep(self.refresh)
+
+    async def dispatcher(self):
+        """Start a poll for every race whose deadline passed"""
+        while True:
+            for pk in self.scheduler.pop_due():
+                asyncio.ensure_future(self.monitor(self.races[pk]))
+            next_due = self.scheduler.next_due()
+            delay = TICK if next_due is None else next_due - self.scheduler.clock()
+            await asyncio.sleep(min(TICK, max(0, delay)))
+
+    async def scrape(self):
+        """Upsert the next-to-go races and schedule the ones not monitored yet"""
+        res = await self.call(self.http, self.fetch, self.next_to_go_url)
+        logger.info(f'Scraped {len(res["races"])} races')
+        races = await self.call(self.db, self.upsert, res['races'])
+        self.schedule(races)
+
+    def upsert(self, items):
+        pks = [race.pk for race in bulk_upsert_races(items)]
+        return list(Race.objects.filter(pk__in=pks, has_results=False).select_related('meeting'))
+
+    def schedule(self, races):
+        """Claim the races for this poller, races it already monitors are left alone"""
+        for race in races:
+            if race.pk in self.races:
+                continue
+            self.races[race.pk] = race
+            self.scheduler.add(race.pk, race.start_time)
+            logger.info(f'Monitoring {race}')
+
+    async def monitor(self, race):
+        """Poll the race once, then finish it or schedule its next poll"""
+        try:
+            res, odds = await self.poll(race)
+        except Exception as exc:
+            self.errors += 1
+            logger.error(f'{race.meeting.name} {race.number}: poll failed: {exc}')
+            self.scheduler.push(race.pk, self.scheduler.clock() + RESULTS_INTERVAL)
+            return
+
+        if res['results']:
+            await self.call(self.db, save_results, race.pk, res['results'])
+            get_tab_client().forget(race.link_self)
+            self.scheduler.remove(race.pk)
+            self.races.pop(race.pk, None)
+            logger.info(f'{race.meeting.name} {race.number}: finished')
+            return
+
+        interval = self.scheduler.update(race.pk, race.start_time, odds['written'], odds['skipped'])
+        logger.info(f'{race.meeting.name} {race.number}: next poll in {interval:.0f}s')
+
+    async def poll(self, race):
+        """Fetch the race document and ingest it when it changed"""
+        async with self.semaphore:
+            res, modified = await self.call(self.http, self.fetch_document, race.link_self)
+        odds = {'written': 0, 'skipped': 0}
+        if modified:
+            odds = await self.call(self.db, self.ingest, race, res) or odds
+        self.polls += 1
+        return res, odds
+
+    async def call(self, executor, func, *args):
+        return await asyncio.get_event_loop().run_in_executor(executor, func, *args)
+
+
+def unresulted_races(window):
+    """Races without results that start from `window` seconds ago on"""
+    since = timezone.now() - datetime.timedelta(seconds=window)
+    return list(Race.objects.filter(
+        has_results=False,
+        start_time__gte=since,
+    ).select_related('meeting'))
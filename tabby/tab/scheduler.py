@@ -0,0 +1,118 @@
+"""
+Deadline-driven race scheduler.
+
+Races sit in a min-heap keyed on their next poll time. The poll interval is
+a function of the time to jump and of how much the odds moved on the previous
+polls, so the TAB request budget goes to races about to jump and to volatile
+markets while quiet races back off.
+"""
+import heapq
+import itertools
+import time
+
+# start polling this many minutes before the jump
+MINUTES_OUT = 9
+# base interval while counting down, and in the last minutes
+COUNTDOWN_INTERVAL = 60
+FINAL_INTERVAL = 30
+FINAL_MINUTES = 2
+# last poll this many seconds before the jump for the closing prices
+FINAL_POLL = 10
+MIN_INTERVAL = 10
+# results polling, backing off once the race has been quiet for a while
+RESULTS_INTERVAL = 55
+QUIET_INTERVAL = 300
+QUIET_AFTER = 15 * 60
+# weight of the latest poll in the smoothed change rate
+RATE_ALPHA = 0.5
+
+
+def poll_interval(secs_to_jump, change_rate=0):
+    """
+    Seconds till the next poll of a race.
+    change_rate is the share (0-1) of prices that moved between the last polls: a quiet
+    market waits up to 1.5x the base interval, a volatile one down to 0.5x.
+    """
+    # wait till the countdown starts
+    if secs_to_jump > 60 * MINUTES_OUT:
+        return secs_to_jump - 60 * MINUTES_OUT
+
+    # counting down
+    if secs_to_jump > 0:
+        base = COUNTDOWN_INTERVAL if secs_to_jump > 60 * FINAL_MINUTES else FINAL_INTERVAL
+        interval = max(MIN_INTERVAL, base * (1.5 - min(1, max(0, change_rate))))
+        # do not sleep through the closing prices
+        until_final = secs_to_jump - FINAL_POLL
+        if until_final > MIN_INTERVAL:
+            interval = min(interval, until_final)
+        return interval
+
+    # waiting for results
+    return RESULTS_INTERVAL if -secs_to_jump < QUIET_AFTER else QUIET_INTERVAL
+
+
+def change_rate(written, skipped):
+    """Share of prices that moved on a poll"""
+    total = written + skipped
+    return written / total if total else 0
+
+
+class RaceScheduler:
+    """Min-heap of (next_poll_at, race) entries with an injectable clock"""
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.heap = []
+        self.races = {}
+        self.counter = itertools.count()
+
+    def __len__(self):
+        return len(self.races)
+
+    def __contains__(self, pk):
+        return pk in self.races
+
+    def add(self, pk, start_time, due=None):
+        """Schedule a race, polled straight away unless due is given"""
+        self.races[pk] = {'start': start_time.timestamp(), 'rate': 0, 'due': None}
+        self.push(pk, self.clock() if due is None else due)
+
+    def remove(self, pk):
+        self.races.pop(pk, None)
+
+    def update(self, pk, start_time=None, written=0, skipped=0):
+        """Record the outcome of a poll, then schedule the next one. Returns the interval"""
+        race = self.races[pk]
+        if start_time is not None:
+            race['start'] = start_time.timestamp()
+        if written or skipped:
+            race['rate'] = RATE_ALPHA * change_rate(written, skipped) + (1 - RATE_ALPHA) * race['rate']
+        now = self.clock()
+        interval = poll_interval(race['start'] - now, race['rate'])
+        self.push(pk, now + interval)
+        return interval
+
+    def push(self, pk, due):
+        self.races[pk]['due'] = due
+        heapq.heappush(self.heap, (due, next(self.counter), pk))
+
+    def pop_due(self):
+        """Races due for a poll, they stay registered but off the heap until updated"""
+        now = self.clock()
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            at, _, pk = heapq.heappop(self.heap)
+            if self.is_current(pk, at):
+                self.races[pk]['due'] = None
+                due.append(pk)
+        return due
+
+    def next_due(self):
+        """Time of the earliest pending poll, None when nothing is scheduled"""
+        while self.heap and not self.is_current(self.heap[0][2], self.heap[0][0]):
+            heapq.heappop(self.heap)
+        return self.heap[0][0] if self.heap else None
+
+    def is_current(self, pk, at):
+        """Entries of removed or rescheduled races are dropped lazily"""
+        return pk in self.races and self.races[pk]['due'] == at
@@ -0,0 +1,149 @@
+"""
+Local stand-in for the TAB info service.
+
+Serves synthetic next-to-go and race documents shaped like the real API so
+the pollers and clients can be benchmarked without touching tab.com.au.
+Prices of a race only move once per tick and every document carries an ETag,
+so conditional requests get 304s in between.
+"""
+import datetime
+import json
+import random
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import time
+
+from django.utils import timezone
+
+RUNNERS = 12
+
+
+def race_document(base_url, number, start_time, runners=RUNNERS, results=None, tick=0):
+    """Build a race document for race `number`, prices are fixed within a tick"""
+    rand = random.Random(f'{number}-{tick}')
+    return {
+        'raceNumber': number,
+        'raceName': f'STAND-IN RACE {number}',
+        'raceDistance': 1200,
+        'raceStartTime': start_time.isoformat(),
+        'trackDirection': 'Clockwise',
+        'hasFixedOdds': True,
+        'hasParimutuel': True,
+        'raceClassConditions': 'CL2',
+        'raceStatus': 'Paying' if results else 'Open',
+        'numberOfPlaces': 3,
+        'meeting': {
+            'meetingName': 'STAND-IN PK',
+            'meetingDate': start_time.date().isoformat(),
+            'location': 'QLD',
+            'raceType': 'R',
+            'railPosition': None,
+            'trackCondition': 'GOOD',
+            'venueMnemonic': 'SIN',
+            'weatherCondition': 'FINE',
+        },
+        '_links': {
+            'self': f'{base_url}/races/{number}',
+            'form': None,
+            'bigBets': f'{base_url}/races/{number}/big-bets',
+        },
+        'runners': [runner_document(base_url, number, n, rand) for n in range(1, runners + 1)],
+        'results': results or [],
+    }
+
+
+def runner_document(base_url, race_number, number, rand=random):
+    """Build a runner with a random price"""
+    win = round(rand.uniform(1.5, 30), 2)
+    return {
+        'runnerNumber': number,
+        'runnerName': f'RUNNER {race_number}-{number}',
+        'trainerFullName': 'A Trainer',
+        'riderDriverFullName': 'A Rider',
+        'barrierNumber': number,
+        'handicapWeight': 56.5,
+        'harnessHandicap': None,
+        'last5Starts': '1x234',
+        'dfsFormRating': 80,
+        'techFormRating': 70,
+        '_links': {'form': f'{base_url}/races/{race_number}/form/{number}'},
+        'fixedOdds': {
+            'bettingStatus': 'Open',
+            'returnWin': win,
+            'returnPlace': round(1 + (win - 1) / 3, 2),
+            'returnWinTime': timezone.now().replace(microsecond=0).isoformat(),
+        },
+        'parimutuel': {
+            'bettingStatus': 'Open',
+            'returnWin': win,
+            'returnPlace': round(1 + (win - 1) / 3, 2),
+        },
+    }
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    races = 10
+    minutes_apart = 3
+    tick_seconds = 10
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def do_GET(self):
+        base_url = f'http://{self.server.server_address[0]}:{self.server.server_address[1]}'
+        now = timezone.now().replace(second=0, microsecond=0)
+        if self.path.startswith('/next-to-go'):
+            body = {'races': [
+                race_document(base_url, n, now + datetime.timedelta(minutes=self.minutes_apart * n), runners=0)
+                for n in range(1, self.races + 1)
+            ]}
+        else:
+            matches = re.match(r'^/races/(\d+)', self.path)
+            if not matches:
+                self.send_error(404)
+                return
+            number = int(matches.group(1))
+            tick = int(time() // self.tick_seconds)
+            etag = f'"{number}-{tick}"'
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            body = race_document(
+                base_url, number, now + datetime.timedelta(minutes=self.minutes_apart * number), tick=tick)
+            self.send_json(body, etag)
+            return
+        self.send_json(body)
+
+    def send_json(self, body, etag=None):
+        content = json.dumps(body).encode()
+        self.send_response(200)
+        if etag:
+            self.send_header('ETag', etag)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(host='127.0.0.1', port=0, handler=StandInHandler):
+    """Start the stand-in server on a background thread"""
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.connections = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def base_url(server):
+    return f'http://{server.server_address[0]}:{server.server_address[1]}'
@@ -1,36 +1,156 @@
 import datetime
 import logging
 import re
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
 import requests
 from celery import shared_task
+from django.conf import settings
 from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Exists, OuterRef
 from django.utils import timezone
-from django.utils.dateparse import parse_datetime
+from django.utils.dateparse import parse_datetime, parse_date
 
-from .models import Meeting, Race, Result, RunnerMeta
+from . import archive
+from .client import get_tab_client
+from .models import Meeting, Race, Result, Runner, RunnerMeta, FixedOdd, ParimutuelOdd, OddsBar
+from .scheduler import poll_interval, change_rate, MIN_INTERVAL
+from .writer import get_writer, log_exception
 
 logger = logging.getLogger(__name__)
 
 
+NEXT_TO_GO_URL = 'https://api.beta.tab.com.au/v1/tab-info-service/racing/next-to-go/races?jurisdiction=NSW'
+# races per add_meta pass, keeps memory flat on a big backlog
+META_CHUNK = 100
+# concurrent result checks of stale races
+CLEANUP_WORKERS = 8
+
+
 @shared_task
 def scrape_races():
     """Scrapes the Next-To-Go races from TAB"""
-    url = 'https://api.beta.tab.com.au/v1/tab-info-service/racing/next-to-go/races?jurisdiction=NSW'
-    res = requests.get(url)
-    res.raise_for_status()
-    res = res.json()
+    res = get_tab_client().get_json(NEXT_TO_GO_URL)
     logger.info('Scraped {} races'.format(len(res['races'])))
-    for item in res['races']:
-        race, created = upsert_race(item)
-        if created:
-            logger.info(f'Created {race}')
-        if not cache.get(race.pk):
-            cache.set(race.pk, 1)
-            monitor_race.delay(race.pk)
+    for race in upsert_next_to_go(res['races']):
+        monitor_race.delay(race.pk)
+
+
+def upsert_next_to_go(items):
+    """Upsert the next-to-go races and return the ones newly claimed for monitoring"""
+    claimed = []
+    for race in bulk_upsert_races(items):
+        if claim_race(race):
+            claimed.append(race)
             logger.info(f'Monitoring {race}')
         else:
             logger.debug(f'Already monitoring {race}')
+    return claimed
+
+
+def claim_race(race):
+    """Claim a race for monitoring, False when it is already monitored"""
+    return cache.add(race.pk, 1)
+
+
+@transaction.atomic
+def bulk_upsert_races(items):
+    """
+    Upsert all meetings and races of the next-to-go payload.
+    Uses a constant number of queries no matter how many races are in the payload.
+    """
+    # meetings keyed on (name, date)
+    meeting_items = {}
+    for item in items:
+        defaults = meeting_defaults(item['meeting'])
+        meeting_items[(defaults['name'], defaults['date'])] = defaults
+    meetings = _bulk_upsert(
+        Meeting.objects.filter(
+            name__in={name for name, _ in meeting_items},
+            date__in={date for _, date in meeting_items}),
+        meeting_items,
+        lambda m: (m.name, m.date))
+
+    # races keyed on (meeting, number)
+    race_items = {}
+    for item in items:
+        meeting = meeting_defaults(item['meeting'])
+        meeting = meetings[(meeting['name'], meeting['date'])]
+        defaults = race_defaults(item)
+        defaults['meeting_id'] = meeting.pk
+        race_items[(meeting.pk, defaults['number'])] = defaults
+    races = _bulk_upsert(
+        Race.objects.filter(
+            meeting_id__in={meeting_id for meeting_id, _ in race_items},
+            number__in={number for _, number in race_items}
+        ).select_related('meeting'),
+        race_items,
+        lambda r: (r.meeting_id, r.number))
+    return [races[key] for key in race_items]
+
+
+def _bulk_upsert(queryset, items, key):
+    """Create and update the rows of items (keyed by key) with a single select"""
+    model = queryset.model
+    existing = {key(obj): obj for obj in queryset}
+    created = []
+    updated = []
+    for item_key, defaults in items.items():
+        obj = existing.get(item_key)
+        if obj is None:
+            created.append(model(**defaults))
+            continue
+        changed = False
+        for field, value in defaults.items():
+            if getattr(obj, field) != value:
+                setattr(obj, field, value)
+                changed = True
+        if changed:
+            updated.append(obj)
+
+    # updates go first, so the select after an insert returns the updated rows
+    if updated:
+        fields = {field for defaults in items.values() for field in defaults}
+        model.objects.bulk_update(updated, fields)
+        logger.info(f'Updated {len(updated)} {model.__name__} objects')
+    if created:
+        model.objects.bulk_create(created)
+        logger.info(f'Created {len(created)} {model.__name__} objects')
+        # sqlite does not return primary keys from bulk inserts
+        existing = {key(obj): obj for obj in queryset.all()}
+    return existing
+
+
+def meeting_defaults(item):
+    """Meeting fields from the meeting item of a race"""
+    meeting_name = item['meetingName'].upper()
+    meeting_name = re.sub(r'\s(PK)$', ' PARK', meeting_name)
+    return {
+        'name': meeting_name,
+        'date': parse_date(item['meetingDate']),
+        'location': item['location'],
+        'race_type': item['raceType'],
+        'rail_position': item['railPosition'],
+        'track_condition': item['trackCondition'],
+        'venue_mnemonic': item['venueMnemonic'],
+        'weather_condition': item['weatherCondition'],
+    }
+
+
+def race_defaults(item):
+    """Race fields from a next-to-go item"""
+    return {
+        'number': item['raceNumber'],
+        'distance': item['raceDistance'],
+        'name': item['raceName'],
+        'start_time': parse_datetime(item['raceStartTime']),
+        'link_self': item['_links']['self'],
+        'link_form': item['_links'].get('form'),
+        'link_big_bets': item['_links']['bigBets'],
+    }
 
 
 @shared_task
@@ -39,16 +159,10 @@ def upsert_race(item):
     if created:
         logger.info('Created {}'.format(meeting))
     try:
+        defaults = race_defaults(item)
         return meeting.race_set.update_or_create(
-            number=item['raceNumber'],
-            defaults={
-                'distance': item['raceDistance'],
-                'name': item['raceName'],
-                'start_time': item['raceStartTime'],
-                'link_self': item['_links']['self'],
-                'link_form': item['_links'].get('form'),
-                'link_big_bets': item['_links']['bigBets'],
-            }
+            number=defaults.pop('number'),
+            defaults=defaults
         )
     except:
         logger.warning(item)
@@ -59,19 +173,11 @@ def upsert_race(item):
 def upsert_meeting(item):
     """Upsert a meeting into the db"""
     try:
-        meeting_name = item['meetingName'].upper()
-        meeting_name = re.sub('\s(PK)$', ' PARK', meeting_name)
+        defaults = meeting_defaults(item)
         return Meeting.objects.update_or_create(
-            name=meeting_name.upper(),
-            date=item['meetingDate'],
-            defaults={
-                'location': item['location'],
-                'race_type': item['raceType'],
-                'rail_position': item['railPosition'],
-                'track_condition': item['trackCondition'],
-                'venue_mnemonic': item['venueMnemonic'],
-                'weather_condition': item['weatherCondition'],
-            }
+            name=defaults.pop('name'),
+            date=defaults.pop('date'),
+            defaults=defaults
         )
     except:
         logger.warning(item)
@@ -80,14 +186,66 @@ def upsert_meeting(item):
 
 @shared_task
 def monitor_race(pk):
-    """Monitor the race"""
+    """Monitor the race, the race document is stored on the ingest queue"""
     logger.info(f'Monitoring race id {pk}')
-    race = Race.objects.get(id=pk)
+    race = Race.objects.select_related('meeting').get(id=pk)
     logger.info(f'self url = {race.link_self}')
-    res = requests.get(race.link_self)
-    res.raise_for_status()
-    res = res.json()
+    res, modified = get_tab_client().get_document(race.link_self)
+
+    if modified:
+        # store_race schedules the next poll once the odds are written
+        store_race.delay(pk, res)
+    else:
+        logger.info(f'{race.meeting.name} {race.number}: race document not modified')
 
+    # save results and finish
+    if res['results']:
+        upsert_results.delay(race.pk, res['results'])
+        get_tab_client().forget(race.link_self)
+        logger.info(f'{race.meeting.name} {race.number}: finished')
+        return
+
+    if not modified:
+        monitor_race.apply_async((pk,), countdown=race_countdown(race))
+
+
+@shared_task
+def store_race(pk, res):
+    """
+    Queue a fetched race document on the process writer without waiting for it,
+    so the documents of consecutive tasks are committed in one batch.
+    The next poll is scheduled once the odds are written.
+    """
+    future = get_writer().submit(ingest_race_document, pk, res)
+    future.add_done_callback(partial(race_stored, pk, bool(res['results'])))
+
+
+def ingest_race_document(pk, res):
+    race = Race.objects.select_related('meeting').get(id=pk)
+    return race, ingest_race(race, res)
+
+
+def race_stored(pk, finished, future):
+    """Schedule the next poll of an unfinished race, a race whose write failed is polled again shortly"""
+    exc = future.exception()
+    if exc:
+        logger.error(f'Storing race {pk} failed: {exc}')
+        if not finished:
+            monitor_race.apply_async((pk,), countdown=MIN_INTERVAL)
+        return
+    race, odds = future.result()
+    if not finished:
+        countdown = race_countdown(race, change_rate(odds['written'], odds['skipped']))
+        monitor_race.apply_async((pk,), countdown=countdown)
+
+
+@transaction.atomic
+def ingest_race(race, res):
+    """
+    Update the race, its runners and their odds from the race document.
+    Odds are only written when they moved since the last poll, returns the written and skipped counts.
+    The runners' odds summaries are updated in the same transaction as the odds.
+    """
     # update race fields
     race.start_time = parse_datetime(res['raceStartTime'])
     race.direction = res['trackDirection']
@@ -99,6 +257,14 @@ def monitor_race(pk):
     race.save()
     logger.info(f'Updated race {race}')
 
+    # last seen price per runner, only moved prices are written
+    journal_key = f'odds_journal_{race.pk}'
+    journal = cache.get(journal_key, {})
+    fixed_odds = []
+    parimutuel_odds = []
+    summaries = []
+    skipped = 0
+
     for runner_item in res['runners']:
         runner, create = race.runner_set.update_or_create(
             runner_number=runner_item['runnerNumber'],
@@ -126,112 +292,240 @@ def monitor_race(pk):
 
         # fixed odds
         as_at = timezone.now()
+        last_seen = journal.setdefault(runner.pk, {})
         if race.has_fixed_odds and runner_item['fixedOdds']['returnWin']:
             fo = runner_item['fixedOdds']
             if 'returnWinTime' in fo:
                 as_at = parse_datetime(fo['returnWinTime'])
             elif 'scratchedTime' in fo:
                 as_at = parse_datetime(fo['scratchedTime'])
-            fixed_odd = runner.fixedodd_set.create(
-                as_at=as_at,
-                win_dec=fo['returnWin'],
-                place_dec=fo['returnPlace'],
-            )
-            logger.debug(f'{race.meeting.name} {race.number} {runner.name}: new fixed odd {fixed_odd.win_dec}')
-
-        # parimutuel odds
+            price = (fo['returnWin'], fo['returnPlace'], as_at)
+            if last_seen.get('fixed') == price:
+                skipped += 1
+            else:
+                last_seen['fixed'] = price
+                fixed_odds.append(FixedOdd(
+                    runner=runner,
+                    as_at=as_at,
+                    win_dec=fo['returnWin'],
+                    place_dec=fo['returnPlace'],
+                ))
+                runner.record_fixed_odd(fo['returnWin'], fo['returnPlace'], as_at)
+                summaries.append(runner)
+                logger.debug(f'{race.meeting.name} {race.number} {runner.name}: new fixed odd {fo["returnWin"]}')
+
+        # parimutuel odds (tote has no timestamp of its own, only the price can move)
         if race.has_parimutuel and runner_item['parimutuel']['returnWin']:
             po = runner_item['parimutuel']
-            parimutuel_odd = runner.parimutuelodd_set.create(
-                as_at=as_at,
-                win_dec=po['returnWin'],
-                place_dec=po['returnPlace'],
-            )
-            logger.debug(
-                f'{race.meeting.name} {race.number} {runner.name}: new parimutuel odd {parimutuel_odd.win_dec}')
-
-    # save results and finish
-    if res['results']:
-        upsert_results.delay(race.pk, res)
-        logger.info(f'{race.meeting.name} {race.number}: finished')
-
-    # race has not started yet
-    elif race.start_time > timezone.now():
-        delta = race.start_time - timezone.now()
-        minutes = 9
-        if delta.seconds > 60 * minutes:
-            logger.warning(f'{race.meeting.name} {race.number}: is more than few minutes away, waiting till then')
-            countdown = delta.seconds - (60 * minutes)
-        else:
-            countdown = delta.seconds % 60
-            countdown += 60 if countdown < 30 and delta.seconds > 120 else 0
-        logger.warning(f'{race.meeting.name} {race.number}: waiting {countdown} till next odds scrape')
-        monitor_race.apply_async((pk,), countdown=countdown)
-
-    # race started but no results
+            price = (po['returnWin'], po['returnPlace'])
+            if last_seen.get('parimutuel') == price:
+                skipped += 1
+            else:
+                last_seen['parimutuel'] = price
+                parimutuel_odds.append(ParimutuelOdd(
+                    runner=runner,
+                    as_at=as_at,
+                    win_dec=po['returnWin'],
+                    place_dec=po['returnPlace'],
+                ))
+                logger.debug(f'{race.meeting.name} {race.number} {runner.name}: new parimutuel odd {po["returnWin"]}')
+
+    FixedOdd.objects.bulk_create(fixed_odds)
+    ParimutuelOdd.objects.bulk_create(parimutuel_odds)
+    Runner.objects.bulk_update(summaries, Runner.SUMMARY_FIELDS)
+    cache.set(journal_key, journal)
+    written = len(fixed_odds) + len(parimutuel_odds)
+    logger.info(f'{race.meeting.name} {race.number}: wrote {written} odds, skipped {skipped} unchanged')
+    return {'written': written, 'skipped': skipped}
+
+
+def race_countdown(race, rate=0):
+    """Seconds to wait before the next scrape of an unfinished race"""
+    secs_to_jump = (race.start_time - timezone.now()).total_seconds()
+    countdown = poll_interval(secs_to_jump, rate)
+    if secs_to_jump > 0:
+        logger.warning(f'{race.meeting.name} {race.number}: waiting {countdown:.0f} till next odds scrape')
     else:
         logger.warning(f'{race.meeting.name} {race.number}: race has started - waiting for results')
-        monitor_race.apply_async((pk,), countdown=55)
+    return countdown
 
 
 @shared_task
-def upsert_results(pk, res):
-    race = Race.objects.get(id=pk)
+def upsert_results(pk, results):
+    """Queue the results of the race on the process writer"""
+    get_writer().submit(save_results, pk, results).add_done_callback(log_exception)
+
+
+def save_results(pk, results):
+    """Save the results, a list of runner numbers per position, of the race"""
+    race = Race.objects.select_related('meeting').get(id=pk)
+    runners = dict(race.runner_set.values_list('runner_number', 'id'))
+    existing = {result.runner_id: result for result in Result.objects.filter(race=race)}
 
-    for i, result_items in enumerate(res['results']):
+    created = []
+    updated = []
+    for i, result_items in enumerate(results):
         pos = i + 1
         for rn in result_items:
-            runner = race.runner_set.get(runner_number=rn)
-            result, created = Result.objects.update_or_create(
-                race=race,
-                runner=runner,
-                pos=pos,
-            )
-            if created:
-                logger.debug(f'Created result {result} pos {pos} with {runner} and {race}')
-
-    race.has_results = True
-    race.save()
-    logger.warning(f'{race.meeting.name} {race.number}: saved results')
+            if rn not in runners:
+                logger.error(f'{race.meeting.name} {race.number}: no runner {rn} for result pos {pos}')
+                continue
+            result = existing.get(runners[rn])
+            if result is None:
+                created.append(Result(race=race, runner_id=runners[rn], pos=pos))
+            elif result.pos != pos:
+                result.pos = pos
+                updated.append(result)
+
+    with transaction.atomic():
+        Result.objects.bulk_create(created)
+        Result.objects.bulk_update(updated, ['pos'])
+        Race.objects.filter(id=pk).update(has_results=True)
+    logger.warning(f'{race.meeting.name} {race.number}: saved results ({len(created)} new, {len(updated)} updated)')
 
 
 @shared_task
 def post_process():
     add_meta()
+    rollup_odds()
+    archive_odds()
+    prune_odds()
 
 
 @shared_task
 def add_meta():
     """create runner metas for unprocessed races"""
     # fetch all unprocessed races
-    races = Race.objects.filter(
+    race_ids = list(Race.objects.filter(
         has_results=True).filter(
-        has_processed=False).all()
-
-    for race in races:
-        for runner in race.runner_set.all():
-            result = runner.result if hasattr(runner, 'result') else None
-            odds = runner.fixedodd_set.first()
-            if not odds:
-                logger.warning(f'No fixed odds for {runner}')
-                continue
-            runner_meta, created = RunnerMeta.objects.update_or_create(
-                race=race,
-                runner=runner,
-                defaults={
-                    'win_odds': odds.win_perc,
-                    'place_odds': odds.place_perc,
-                    'rating': runner.dfs_form_rating / 100,
-                    'won': result.won if result else False,
-                    'placed': result.placed if result else False,
-                })
-            if created:
-                logger.info(f'Created {runner_meta}')
-
-        race.has_processed = True
-        race.save()
-        logger.warning(f'Created meta for {race} runners')
-    logger.warning(f'>>>> Task add_meta finished for {len(races)} races')
+        has_processed=False).values_list('id', flat=True))
+
+    for i in range(0, len(race_ids), META_CHUNK):
+        add_race_metas(race_ids[i:i + META_CHUNK])
+    logger.warning(f'>>>> Task add_meta finished for {len(race_ids)} races')
+    return len(race_ids)
+
+
+def add_race_metas(race_ids):
+    """Create the runner metas of the races with one runner query"""
+    runners = Runner.objects.filter(
+        race_id__in=race_ids
+    ).select_related('race', 'result')
+
+    metas = []
+    for runner in runners.iterator():
+        fo = runner.latest_fixed_odd()
+        if fo is None:
+            logger.warning(f'No fixed odds for {runner}')
+            continue
+        result = runner.result if hasattr(runner, 'result') else None
+        metas.append(RunnerMeta(
+            race_id=runner.race_id,
+            runner=runner,
+            win_odds=fo.win_perc,
+            place_odds=fo.place_perc,
+            rating=runner.dfs_form_rating / 100,
+            won=result.pos == 1 if result else False,
+            placed=result.pos <= runner.race.number_of_places if result else False,
+        ))
+
+    with transaction.atomic():
+        # recreate metas of reprocessed races, ignore rows a concurrent run got to first
+        RunnerMeta.objects.filter(race_id__in=race_ids).delete()
+        RunnerMeta.objects.bulk_create(metas, ignore_conflicts=True)
+        Race.objects.filter(id__in=race_ids).update(has_processed=True)
+    logger.warning(f'Created {len(metas)} metas for {len(race_ids)} races')
+
+
+@shared_task
+def rollup_odds():
+    """
+    Roll the odds ticks of finished races into per-runner, per-minute OHLC bars.
+    Archived races whose ticks were pruned are read back from the archive, so clearing has_bars rebuilds them.
+    """
+    race_ids = list(Race.objects.filter(
+        has_results=True,
+        has_bars=False,
+    ).values_list('id', flat=True))
+
+    for i in range(0, len(race_ids), META_CHUNK):
+        chunk = race_ids[i:i + META_CHUNK]
+        pruned = list(Race.objects.filter(id__in=chunk, has_archived=True).exclude(
+            id__in=FixedOdd.objects.values('runner__race_id')
+        ).exclude(
+            id__in=ParimutuelOdd.objects.values('runner__race_id')
+        ).select_related('meeting'))
+        bars = []
+        for kind, model, archive_kind in (
+                (OddsBar.FIXED, FixedOdd, 'fixed'), (OddsBar.PARIMUTUEL, ParimutuelOdd, 'tote')):
+            ticks = model.objects.filter(
+                runner__race_id__in=chunk
+            ).order_by('runner_id', 'as_at').values_list('runner_id', 'as_at', 'win_dec', 'place_dec')
+            bars.extend(minute_bars(kind, ticks.iterator()))
+            for race in pruned:
+                bars.extend(minute_bars(kind, archive.race_ticks(race, archive_kind)))
+        with transaction.atomic():
+            OddsBar.objects.filter(runner__race_id__in=chunk).delete()
+            OddsBar.objects.bulk_create(bars)
+            Race.objects.filter(id__in=chunk).update(has_bars=True)
+        logger.warning(f'Created {len(bars)} odds bars for {len(chunk)} races')
+    return len(race_ids)
+
+
+def minute_bars(kind, ticks):
+    """OHLC bars from (runner_id, as_at, win_dec, place_dec) ticks ordered by runner and time"""
+    bar = None
+    for runner_id, as_at, win_dec, place_dec in ticks:
+        minute = as_at.replace(second=0, microsecond=0)
+        if bar is None or bar.runner_id != runner_id or bar.minute != minute:
+            if bar is not None:
+                yield bar
+            bar = OddsBar(runner_id=runner_id, kind=kind, minute=minute,
+                          open=win_dec, high=win_dec, low=win_dec, close=win_dec, ticks=0)
+        bar.high = max(bar.high, win_dec)
+        bar.low = min(bar.low, win_dec)
+        bar.close = win_dec
+        bar.place_close = place_dec
+        bar.ticks += 1
+    if bar is not None:
+        yield bar
+
+
+@shared_task
+def prune_odds():
+    """
+    Delete the raw odds ticks of races rolled up into bars and archived, longer than the retention window ago.
+    Races not archived yet keep their ticks, the archive is packed from them.
+    """
+    cutoff = timezone.now() - datetime.timedelta(days=settings.ODDS_TICK_RETENTION_DAYS)
+    races = Race.objects.filter(
+        has_bars=True,
+        has_processed=True,
+        has_archived=True,
+        start_time__lt=cutoff,
+    ).values('id')
+    with transaction.atomic():
+        fixed = FixedOdd.objects.filter(runner__race_id__in=races).delete()
+        parimutuel = ParimutuelOdd.objects.filter(runner__race_id__in=races).delete()
+    logger.warning(f'Pruned odds ticks older than {cutoff}: {fixed} {parimutuel}')
+
+
+@shared_task
+def archive_odds():
+    """Pack the odds history of processed races of past meeting days into the columnar archive"""
+    races = Race.objects.filter(
+        has_processed=True,
+        has_archived=False,
+        meeting__date__lt=timezone.localdate(),
+    ).values_list('id', 'meeting__date')
+    by_date = defaultdict(list)
+    for race_id, date in races:
+        by_date[date].append(race_id)
+
+    for date, race_ids in sorted(by_date.items()):
+        archive.archive_races(date, race_ids, purge=settings.ODDS_ARCHIVE_PURGE)
+        Race.objects.filter(id__in=race_ids).update(has_archived=True)
+        logger.warning(f'Archived odds of {len(race_ids)} races on {date}')
     return len(races)
 
 
@@ -249,28 +543,42 @@ def race_cleanup():
     races = Race.objects.filter(
         has_results=False,
         start_time__lte=yesterday
-    ).all()
-    for race in races:
-
-        # has results?
-        rr = [hasattr(r, 'result') for r in race.runner_set.all()]
-        if any(rr):
-            logger.warning(f'{race.meeting.name} {race.number}: already had results!')
-            race.has_results = True
-            race.save()
+    ).annotate(
+        has_result=Exists(Result.objects.filter(race=OuterRef('pk')))
+    )
+
+    # has results?
+    flipped = Race.objects.filter(
+        pk__in=races.filter(has_result=True).values('pk')
+    ).update(has_results=True)
+    logger.warning(f'{flipped} races already had results!')
+
+    # if no results,
+    # can we still get results
+    races = list(races.filter(has_result=False).select_related('meeting'))
+    with ThreadPoolExecutor(max_workers=CLEANUP_WORKERS) as executor:
+        responses = executor.map(_fetch_race, races)
+    worthless = []
+    for race, res in zip(races, responses):
+        if res is None:
             continue
-
-        # if no results,
-        # can we still get results
-        res = requests.get(race.link_self)
         if res.status_code == requests.codes.ok:
-            upsert_results.delay(race.pk, res.json())
+            upsert_results.delay(race.pk, res.json()['results'])
             continue
+        worthless.append(race.pk)
 
-        # then rather delete worthless race info
-        r = race.delete()
-        logger.warning(f'Deleted race: {r}')
-    logger.warning(f'>>>> Race cleanup done on {len(races)} objects')
+    # then rather delete worthless race info
+    r = Race.objects.filter(pk__in=worthless).delete()
+    logger.warning(f'Deleted races: {r}')
+    logger.warning(f'>>>> Race cleanup done on {flipped + len(races)} objects')
+
+
+def _fetch_race(race):
+    """Get the race document, None when TAB could not be reached"""
+    try:
+        return get_tab_client().get(race.link_self)
+    except requests.RequestException as exc:
+        logger.error(f'{race.meeting.name} {race.number}: could not check for results: {exc}')
 
 
 @shared_task
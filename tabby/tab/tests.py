@@ -1,3 +1,534 @@
-from django.test import TestCase
+import datetime
+import os
+import re
+import tempfile
+from concurrent.futures import Future
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Meeting, Race, Runner, FixedOdd, ParimutuelOdd, OddsBar
+from .poller import RacePoller, RESUME_WINDOW, unresulted_races
+from .scheduler import RaceScheduler, poll_interval, MIN_INTERVAL, QUIET_INTERVAL, RESULTS_INTERVAL
+from . import archive, tasks
+from .tasks import bulk_upsert_races, minute_bars, prune_odds, rollup_odds, add_meta
+from .writer import Writer
+
+# a SCAN step without an index, e.g. "SCAN TABLE tab_race" or "SCAN tab_race AS U0"
+TABLE_SCAN = re.compile(r'^SCAN (TABLE )?\S+( AS \S+)?$')
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = timezone.now().timestamp()
+
+    def __call__(self):
+        return self.now
+
+    def tick(self, secs):
+        self.now += secs
+
+
+class PollIntervalTest(SimpleTestCase):
+
+    def test_waits_till_nine_minutes_out(self):
+        self.assertEqual(poll_interval(60 * 60), 60 * 51)
+
+    def test_whole_days_out(self):
+        self.assertEqual(poll_interval(2 * 24 * 3600 + 600), 2 * 24 * 3600 + 60)
+
+    def test_volatile_market_polls_faster_than_quiet(self):
+        self.assertLess(poll_interval(300, change_rate=1), poll_interval(300, change_rate=0))
+
+    def test_never_sleeps_through_jump(self):
+        for secs in range(MIN_INTERVAL + 11, 540):
+            self.assertLess(poll_interval(secs), secs)
+
+    def test_results_polling_backs_off(self):
+        self.assertEqual(poll_interval(-60), RESULTS_INTERVAL)
+        self.assertEqual(poll_interval(-3600), QUIET_INTERVAL)
+
+
+class RaceSchedulerTest(SimpleTestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.scheduler = RaceScheduler(clock=self.clock)
+
+    def start(self, secs):
+        return datetime.datetime.fromtimestamp(self.clock() + secs, tz=datetime.timezone.utc)
+
+    def test_new_races_are_due_immediately(self):
+        self.scheduler.add(1, self.start(300))
+        self.scheduler.add(2, self.start(3600))
+        self.assertEqual(sorted(self.scheduler.pop_due()), [1, 2])
+        self.assertEqual(self.scheduler.pop_due(), [])
+
+    def test_race_about_to_jump_is_polled_first(self):
+        self.scheduler.add(1, self.start(3600))
+        self.scheduler.add(2, self.start(300))
+        self.scheduler.pop_due()
+        self.scheduler.update(1)
+        self.scheduler.update(2)
+        self.clock.tick(90)
+        self.assertEqual(self.scheduler.pop_due(), [2])
+
+    def test_change_rate_shortens_interval(self):
+        self.scheduler.add(1, self.start(300))
+        self.scheduler.add(2, self.start(300))
+        self.scheduler.pop_due()
+        quiet = self.scheduler.update(1, written=0, skipped=10)
+        volatile = self.scheduler.update(2, written=10, skipped=0)
+        self.assertLess(volatile, quiet)
+
+    def test_removed_race_is_not_due(self):
+        self.scheduler.add(1, self.start(300))
+        self.scheduler.remove(1)
+        self.assertEqual(self.scheduler.pop_due(), [])
+        self.assertIsNone(self.scheduler.next_due())
+
+    def test_next_due(self):
+        self.scheduler.add(1, self.start(300))
+        self.scheduler.pop_due()
+        interval = self.scheduler.update(1)
+        self.assertEqual(self.scheduler.next_due(), self.clock() + interval)
+
+
+class QueryPlanMixin:
+    """Fails a test when a query falls back to scanning a whole table"""
+
+    def assertNoTableScan(self, func):
+        with CaptureQueriesContext(connection) as ctx:
+            try:
+                func()
+            except ObjectDoesNotExist:
+                pass
+        self.assertTrue(ctx.captured_queries, 'No queries captured')
+        for query in ctx.captured_queries:
+            with connection.cursor() as cursor:
+                cursor.execute(f'EXPLAIN QUERY PLAN {query["sql"]}')
+                plan = [row[-1] for row in cursor.fetchall()]
+            scans = [step for step in plan if TABLE_SCAN.match(step)]
+            self.assertFalse(scans, f'{query["sql"]}\n' + '\n'.join(plan))
+
+
+class TabQueryPlanTest(QueryPlanMixin, TestCase):
+    """
+    FixedOddManager.top_10 and VarManager are left out, they are only used
+    by the shell and the trainer on small tables.
+    """
+
+    def test_incoming(self):
+        self.assertNoTableScan(lambda: list(Race.objects.incoming()))
+
+    def test_outgoing(self):
+        self.assertNoTableScan(lambda: list(Race.objects.outgoing()))
+
+    def test_handled(self):
+        self.assertNoTableScan(lambda: list(Race.objects.handled(Meeting(pk=1), True, False)))
+
+    def test_unprocessed(self):
+        self.assertNoTableScan(lambda: list(Race.objects.filter(has_results=True, has_processed=False)))
+
+    def test_awaiting_results(self):
+        self.assertNoTableScan(lambda: list(Race.objects.filter(
+            has_results=False, start_time__lte=timezone.now())))
+
+    def test_runner_fixed_odds(self):
+        self.assertNoTableScan(lambda: list(Runner(pk=1).fixedodd_set.all()[:5]))
+        self.assertNoTableScan(lambda: Runner(pk=1).fixedodd_set.first())
+
+    def test_runner_parimutuel_odds(self):
+        self.assertNoTableScan(lambda: Runner(pk=1).parimutuelodd_set.first())
+
+
+def next_to_go_item(meeting, number, start_time):
+    """A race of the next-to-go payload"""
+    return {
+        'meeting': {
+            'meetingName': meeting, 'meetingDate': start_time.date().isoformat(), 'location': 'VIC',
+            'raceType': 'R', 'railPosition': 'True', 'trackCondition': 'GOOD4', 'venueMnemonic': meeting[:3],
+            'weatherCondition': 'FINE',
+        },
+        'raceNumber': number,
+        'raceDistance': 1200,
+        'raceName': f'{meeting} R{number}',
+        'raceStartTime': start_time.isoformat(),
+        '_links': {'self': f'https://tab/{meeting}/{number}', 'bigBets': f'https://tab/{meeting}/{number}/bets'},
+    }
+
+
+class BulkUpsertRacesTest(TestCase):
+    """
+    The queries of a scrape do not grow with the number of races, the counts
+    include the savepoint pair of the transaction within the test case.
+    """
+
+    def items(self, meetings, races, delay=0):
+        start_time = timezone.now().replace(microsecond=0) + datetime.timedelta(minutes=delay)
+        return [
+            next_to_go_item(f'MEETING {m}', n, start_time + datetime.timedelta(minutes=5 * n))
+            for m in range(meetings) for n in range(1, races + 1)
+        ]
+
+    def test_first_insert(self):
+        # select, insert and select again for the new meetings, then for the new races
+        with self.assertNumQueries(8):
+            bulk_upsert_races(self.items(1, 1))
+        self.assertEqual((Meeting.objects.count(), Race.objects.count()), (1, 1))
+
+    def test_insert_many(self):
+        with self.assertNumQueries(8):
+            races = bulk_upsert_races(self.items(3, 10))
+        self.assertEqual(len(races), 30)
+        self.assertEqual((Meeting.objects.count(), Race.objects.count()), (3, 30))
+
+    def test_unchanged(self):
+        items = self.items(3, 10)
+        bulk_upsert_races(items)
+        # a select per table
+        with self.assertNumQueries(4):
+            bulk_upsert_races(items)
+
+    def test_changed(self):
+        bulk_upsert_races(self.items(3, 10))
+        # a select per table and one bulk update of the races
+        with self.assertNumQueries(5):
+            races = bulk_upsert_races(self.items(3, 10, delay=2))
+        self.assertEqual(Race.objects.count(), 30)
+        self.assertEqual(Race.objects.get(pk=races[0].pk).start_time, races[0].start_time)
+
+    def test_changed_and_created(self):
+        bulk_upsert_races(self.items(1, 10))
+        items = self.items(1, 12, delay=2)
+        # a select per table, the bulk update of the races, then insert and select again for the new races
+        with self.assertNumQueries(7):
+            races = bulk_upsert_races(items)
+        self.assertEqual(Race.objects.count(), 12)
+        start_times = [race.start_time for race in races]
+        self.assertEqual(start_times, [parse_datetime(item['raceStartTime']) for item in items])
+        self.assertEqual(start_times, [Race.objects.get(pk=race.pk).start_time for race in races])
+
+
+def create_meeting(name):
+    return Meeting.objects.create(name=name, date=timezone.localdate(), location='VIC', race_type='R').name
+
+
+def fail_meeting(name):
+    create_meeting(name)
+    raise ValueError(name)
+
+
+class WriterTest(TransactionTestCase):
+    """Outside a test transaction, the writer thread commits on its own connection"""
+
+    def setUp(self):
+        self.writer = Writer(linger=0.5)
+
+    def tearDown(self):
+        self.writer.shutdown()
+
+    def test_batches(self):
+        futures = [self.writer.submit(create_meeting, f'M{i}') for i in range(5)]
+        self.assertEqual([future.result(timeout=5) for future in futures], [f'M{i}' for i in range(5)])
+        self.assertEqual((self.writer.batches, self.writer.committed), (1, 5))
+        self.assertEqual(Meeting.objects.count(), 5)
+
+    def test_error_reaches_future(self):
+        futures = [self.writer.submit(create_meeting, 'A'), self.writer.submit(fail_meeting, 'B'),
+                   self.writer.submit(create_meeting, 'C')]
+        self.assertIsInstance(futures[1].exception(timeout=5), ValueError)
+        self.assertEqual([futures[0].result(), futures[2].result()], ['A', 'C'])
+        # the failing intent is rolled back alone
+        self.assertEqual(sorted(Meeting.objects.values_list('name', flat=True)), ['A', 'C'])
+
+    def test_shutdown(self):
+        futures = [self.writer.submit(create_meeting, f'M{i}') for i in range(3)]
+        self.writer.shutdown(wait=True)
+        self.assertTrue(all(future.done() for future in futures))
+        self.assertEqual(Meeting.objects.count(), 3)
+        with self.assertRaises(RuntimeError):
+            self.writer.submit(create_meeting, 'late')
+
+
+class RaceStoredTest(SimpleTestCase):
+
+    def test_failed_write_is_polled_again(self):
+        future = Future()
+        future.set_exception(ValueError('locked'))
+        with mock.patch.object(tasks.monitor_race, 'apply_async') as apply_async:
+            tasks.race_stored(1, False, future)
+        apply_async.assert_called_once_with((1,), countdown=MIN_INTERVAL)
+
+    def test_finished_race_is_not_polled(self):
+        future = Future()
+        future.set_result((None, {'written': 1, 'skipped': 0}))
+        with mock.patch.object(tasks.monitor_race, 'apply_async') as apply_async:
+            tasks.race_stored(1, True, future)
+        apply_async.assert_not_called()
+
+
+class RacePollerTest(TestCase):
+    """Claims of the poller, scrape and resume hand the loaded races to schedule"""
+
+    def setUp(self):
+        self.start_time = timezone.now().replace(microsecond=0) + datetime.timedelta(minutes=30)
+        self.items = [next_to_go_item('MEETING', n, self.start_time + datetime.timedelta(minutes=5 * n))
+                      for n in range(1, 4)]
+
+    def poller(self):
+        return RacePoller(scheduler=RaceScheduler(clock=FakeClock()), writer=mock.Mock())
+
+    def scrape(self, poller):
+        poller.schedule(poller.upsert(self.items))
+
+    def test_scrape_claims_once(self):
+        poller = self.poller()
+        self.scrape(poller)
+        self.scrape(poller)
+        self.assertEqual(len(poller.scheduler), 3)
+        self.assertEqual(sorted(poller.races), sorted(Race.objects.values_list('pk', flat=True)))
+
+    def test_restarted_poller_claims_again(self):
+        self.scrape(self.poller())
+        poller = self.poller()
+        self.scrape(poller)
+        self.assertEqual(len(poller.scheduler), 3)
+
+    def test_resume_unresulted(self):
+        self.scrape(self.poller())
+        # one race jumped an hour ago without results, one has its results, one left days ago
+        races = list(Race.objects.order_by('number'))
+        Race.objects.filter(pk=races[0].pk).update(start_time=timezone.now() - datetime.timedelta(hours=1))
+        Race.objects.filter(pk=races[1].pk).update(has_results=True)
+        Race.objects.filter(pk=races[2].pk).update(start_time=timezone.now() - datetime.timedelta(days=2))
+        poller = self.poller()
+        poller.schedule(unresulted_races(RESUME_WINDOW))
+        self.assertEqual(list(poller.races), [races[0].pk])
+        self.assertIn(races[0].pk, poller.scheduler)
+
+    def test_resulted_race_is_not_claimed(self):
+        self.scrape(self.poller())
+        Race.objects.update(has_results=True)
+        poller = self.poller()
+        self.scrape(poller)
+        self.assertEqual(len(poller.scheduler), 0)
+
+
+def create_race(start_time, runners=2, **fields):
+    meeting, _ = Meeting.objects.get_or_create(
+        name='FLEMINGTON', date=start_time.date(), defaults={'location': 'VIC', 'race_type': 'R'})
+    race = Race.objects.create(
+        meeting=meeting, number=Race.objects.filter(meeting=meeting).count() + 1, link_self='x', link_big_bets='x',
+        distance=1200, name='R', start_time=start_time, **fields)
+    for n in range(1, runners + 1):
+        Runner.objects.create(race=race, name=f'R{n}', runner_number=n, barrier_number=n, dfs_form_rating=50)
+    return race
+
+
+class MinuteBarsTest(SimpleTestCase):
+
+    def test_bars(self):
+        minute = timezone.now().replace(second=0, microsecond=0)
+        at = [minute + datetime.timedelta(seconds=secs) for secs in (5, 20, 50, 70)]
+        ticks = [
+            (1, at[0], 4.0, 1.5), (1, at[1], 4.4, 1.6), (1, at[2], 3.8, 1.4), (1, at[3], 3.9, 1.45),
+            (2, at[0], 8.0, 2.5),
+        ]
+        bars = [(bar.runner_id, bar.minute, bar.open, bar.high, bar.low, bar.close, bar.place_close, bar.ticks)
+                for bar in minute_bars(OddsBar.FIXED, ticks)]
+        self.assertEqual(bars, [
+            (1, minute, 4.0, 4.4, 3.8, 3.8, 1.4, 3),
+            (1, minute + datetime.timedelta(minutes=1), 3.9, 3.9, 3.9, 3.9, 1.45, 1),
+            (2, minute, 8.0, 8.0, 8.0, 8.0, 2.5, 1),
+        ])
+
+    def test_no_ticks(self):
+        self.assertEqual(list(minute_bars(OddsBar.FIXED, [])), [])
+
+
+class PruneOddsTest(TestCase):
+
+    def test_only_archived_races(self):
+        old = timezone.now() - datetime.timedelta(days=30)
+        flags = {'has_results': True, 'has_processed': True, 'has_bars': True}
+        archived = create_race(old, has_archived=True, **flags)
+        unarchived = create_race(old + datetime.timedelta(hours=1), **flags)
+        recent = create_race(timezone.now(), has_archived=True, **flags)
+        for race in (archived, unarchived, recent):
+            for runner in race.runner_set.all():
+                FixedOdd.objects.create(runner=runner, as_at=race.start_time, win_dec=4, place_dec=1.5)
+                ParimutuelOdd.objects.create(runner=runner, as_at=race.start_time, win_dec=4, place_dec=1.5)
+        prune_odds()
+        self.assertFalse(FixedOdd.objects.filter(runner__race=archived).exists())
+        self.assertFalse(ParimutuelOdd.objects.filter(runner__race=archived).exists())
+        self.assertEqual(FixedOdd.objects.filter(runner__race=unarchived).count(), 2)
+        self.assertEqual(FixedOdd.objects.filter(runner__race=recent).count(), 2)
+
+
+class BarFallbackTest(TestCase):
+    """Races pruned before the odds summary was kept are read from their bars"""
+
+    def setUp(self):
+        self.race = create_race(timezone.now() - datetime.timedelta(days=30), has_results=True, has_bars=True)
+        self.runner = self.race.runner_set.get(runner_number=1)
+        minute = self.race.start_time.replace(second=0, microsecond=0)
+        for minutes, close in ((-2, 5.0), (-1, 4.5)):
+            OddsBar.objects.create(
+                runner=self.runner, kind=OddsBar.FIXED, minute=minute + datetime.timedelta(minutes=minutes),
+                open=close, high=close, low=close, close=close, place_close=1.8, ticks=1)
+
+    def test_latest_fixed_odd(self):
+        fo = self.runner.latest_fixed_odd()
+        self.assertEqual((fo.win_dec, fo.place_dec), (4.5, 1.8))
+        self.assertIsNone(self.race.runner_set.get(runner_number=2).latest_fixed_odd())
+
+    def test_add_meta(self):
+        add_meta()
+        meta = self.runner.runnermeta
+        self.assertAlmostEqual(meta.win_odds, 1 / 4.5)
+        self.assertAlmostEqual(meta.place_odds, 1 / 1.8)
+        self.assertTrue(Race.objects.get(pk=self.race.pk).has_processed)
+
+
+class ArchiveTest(TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        override = override_settings(ODDS_ARCHIVE_DIR=tmp.name)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.start_time = (timezone.now() - datetime.timedelta(days=30)).replace(second=0, microsecond=0)
+        self.race = create_race(self.start_time, has_results=True, has_processed=True)
+        self.date = self.race.meeting.date
+        self.runners = list(self.race.runner_set.order_by('id'))
+        for secs, win_dec, place_dec in ((0, 5.0, 1.8), (30, 4.5, 1.7), (70, 4.0, 1.6)):
+            for runner in self.runners:
+                as_at = self.start_time + datetime.timedelta(seconds=secs)
+                FixedOdd.objects.create(runner=runner, as_at=as_at, win_dec=win_dec, place_dec=place_dec)
+                ParimutuelOdd.objects.create(runner=runner, as_at=as_at, win_dec=win_dec + 1, place_dec=place_dec)
+
+    def test_round_trip(self):
+        archive.archive_races(self.date, [self.race.id], purge=True)
+        self.assertFalse(FixedOdd.objects.filter(runner__race=self.race).exists())
+        self.assertFalse(ParimutuelOdd.objects.filter(runner__race=self.race).exists())
+
+        self.assertEqual(len(archive.race_odds(self.date, self.race.id)), 6)
+        self.assertEqual(len(archive.race_odds(self.date, self.race.id + 1)), 0)
+        odds = archive.runner_odds(self.date, self.race.id, self.runners[1].id, kind='tote')
+        self.assertEqual(odds['win_dec'].tolist(), [6.0, 5.5, 5.0])
+        self.assertEqual(list(archive.race_ticks(self.race))[:3], [
+            (self.runners[0].id, self.start_time, 5.0, 1.8),
+            (self.runners[0].id, self.start_time + datetime.timedelta(seconds=30), 4.5, 1.7),
+            (self.runners[0].id, self.start_time + datetime.timedelta(seconds=70), 4.0, 1.6),
+        ])
+
+    def test_merges_races_of_the_date(self):
+        archive.archive_races(self.date, [self.race.id])
+        other = create_race(self.start_time + datetime.timedelta(hours=1))
+        FixedOdd.objects.create(runner=other.runner_set.first(), as_at=other.start_time, win_dec=3.0, place_dec=1.4)
+        archive.archive_races(self.date, [other.id])
+        self.assertEqual(len(archive.race_odds(self.date, self.race.id)), 6)
+        self.assertEqual(len(archive.race_odds(self.date, other.id)), 1)
+
+    def test_reloads_rewritten_file(self):
+        """A file rewritten by another process is reloaded without clearing this process's cache"""
+        self.assertEqual(len(archive.load_archive(self.date)), 0)
+        archive.archive_races(self.date, [self.race.id])
+        self.assertEqual(len(archive.load_archive(self.date)), 6)
+
+        path = archive.archive_path(self.date, 'fixed')
+        data = np.load(path)
+        with open(path, 'wb') as f:
+            np.save(f, data[:2])
+        mtime = os.stat(path).st_mtime_ns + 10 ** 9
+        os.utime(path, ns=(mtime, mtime))
+        self.assertEqual(len(archive.load_archive(self.date)), 2)
+
+    def test_rollup_pruned_race(self):
+        archive.archive_races(self.date, [self.race.id], purge=True)
+        self.race.has_archived = True
+        self.race.save()
+        rollup_odds()
+        bars = OddsBar.objects.filter(runner=self.runners[0]).order_by('kind', 'minute')
+        self.assertEqual([(bar.kind, bar.open, bar.close, bar.place_close, bar.ticks) for bar in bars], [
+            (OddsBar.FIXED, 5.0, 4.5, 1.7, 2),
+            (OddsBar.FIXED, 4.0, 4.0, 1.6, 1),
+            (OddsBar.PARIMUTUEL, 6.0, 5.5, 1.7, 2),
+            (OddsBar.PARIMUTUEL, 5.0, 5.0, 1.6, 1),
+        ])
+
+
+class OddsSummaryTest(SimpleTestCase):
+
+    def test_record_fixed_odd(self):
+        runner = Runner()
+        at = timezone.now()
+        for i, (win_dec, place_dec) in enumerate([(5.0, 1.8), (4.0, 1.6), (4.5, None)]):
+            runner.record_fixed_odd(win_dec, place_dec, at + datetime.timedelta(seconds=i))
+        self.assertEqual(
+            [getattr(runner, field) for field in Runner.SUMMARY_FIELDS],
+            [5.0, 4.5, 4.0, 5.0, 1.8, None, 1.6, 1.8, 3, at + datetime.timedelta(seconds=2)])
+        fo = runner.latest_fixed_odd()
+        self.assertEqual((fo.win_dec, fo.place_dec, fo.as_at), (4.5, None, runner.fo_changed_at))
+
+    def test_odds_change(self):
+        self.assertAlmostEqual(Runner(fo_win_open=5.0, fo_win_latest=4.0).odds_change(), 0.25)
+        self.assertAlmostEqual(Runner(fo_win_open=4.0, fo_win_latest=5.0).odds_change(), -0.2)
+        self.assertIsNone(Runner(fo_win_latest=4.0).odds_change())
+        self.assertIsNone(Runner().odds_change())
+
+
+class OddsSummaryBackfillTest(TransactionTestCase):
+    """0036 summarises the ticks, or the fixed bars of runners whose ticks were pruned"""
+
+    before = [('tab', '0035_hot_path_indexes')]
+    after = [('tab', '0036_runner_odds_summary')]
+
+    def setUp(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.before)
+        apps = executor.loader.project_state(self.before).apps
+        start_time = timezone.now().replace(microsecond=0)
+        meeting = apps.get_model('tab', 'Meeting').objects.create(
+            name='M', date=start_time.date(), location='VIC', race_type='R')
+        race = apps.get_model('tab', 'Race').objects.create(
+            meeting=meeting, number=1, link_self='x', link_big_bets='x', distance=1200, name='R',
+            start_time=start_time)
+        runners = apps.get_model('tab', 'Runner').objects
+        self.ticked = runners.create(race=race, name='A', runner_number=1, barrier_number=1).pk
+        self.barred = runners.create(race=race, name='B', runner_number=2, barrier_number=2).pk
+        self.bare = runners.create(race=race, name='C', runner_number=3, barrier_number=3).pk
+        for secs, win_dec, place_dec in [(0, 5.0, 1.8), (30, 4.0, 1.6), (60, 4.5, 1.7)]:
+            apps.get_model('tab', 'FixedOdd').objects.create(
+                runner_id=self.ticked, as_at=start_time + datetime.timedelta(seconds=secs),
+                win_dec=win_dec, place_dec=place_dec)
+        for minutes, (o, h, l, c) in enumerate([(6.0, 6.5, 5.5, 6.0), (6.0, 6.0, 5.0, 5.2)]):
+            apps.get_model('tab', 'OddsBar').objects.create(
+                runner_id=self.barred, kind='F', minute=start_time + datetime.timedelta(minutes=minutes),
+                open=o, high=h, low=l, close=c, place_close=2.0, ticks=3)
+        self.start_time = start_time
+
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(self.after)
+
+    def summary(self, pk):
+        return list(Runner.objects.filter(pk=pk).values_list(*Runner.SUMMARY_FIELDS).get())
+
+    def test_backfill(self):
+        self.assertEqual(self.summary(self.ticked), [
+            5.0, 4.5, 4.0, 5.0, 1.8, 1.7, 1.6, 1.8, 3, self.start_time + datetime.timedelta(seconds=60)])
+        self.assertEqual(self.summary(self.barred), [
+            6.0, 5.2, 5.0, 6.5, 2.0, 2.0, 2.0, 2.0, 6, self.start_time + datetime.timedelta(minutes=1)])
+        self.assertEqual(self.summary(self.bare), [None] * 8 + [0, None])
@@ -0,0 +1,141 @@
+"""
+Single database writer.
+
+SQLite allows one writer at a time, so long-lived processes hand every
+write to one thread instead of racing for the lock. Write intents are plain
+callables queued from any thread; the writer drains whatever is waiting (up
+to `max_batch`, lingering briefly for stragglers) and runs the batch inside
+one transaction, so a burst of polls costs one commit instead of one each.
+Every intent runs in its own savepoint, a failing intent is rolled back and
+reported on its future without taking the rest of the batch down.
+
+Writer is a `concurrent.futures.Executor`, so it drops in wherever an
+executor is expected, e.g. `loop.run_in_executor(writer, ingest_race, ...)`.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Executor, Future
+
+from django.db import connection, transaction
+
+logger = logging.getLogger(__name__)
+
+MAX_BATCH = 50
+# seconds to wait for more intents once the first one arrived
+LINGER = 0.05
+
+_STOP = object()
+
+
+class Writer(Executor):
+
+    def __init__(self, max_batch=MAX_BATCH, linger=LINGER):
+        self.max_batch = max_batch
+        self.linger = linger
+        self.intents = queue.Queue()
+        self.stopped = False
+        self.batches = 0
+        self.committed = 0
+        self.thread = threading.Thread(target=self.run, name='db-writer', daemon=True)
+        self.thread.start()
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue a write intent, the future resolves once its batch committed"""
+        if self.stopped:
+            raise RuntimeError('Writer is shut down')
+        future = Future()
+        self.intents.put((future, fn, args, kwargs))
+        return future
+
+    def shutdown(self, wait=True):
+        """Commit what is queued, then stop the writer thread"""
+        if not self.stopped:
+            self.stopped = True
+            self.intents.put(_STOP)
+        if wait:
+            self.thread.join()
+
+    def run(self):
+        try:
+            while True:
+                batch, stop = self.take()
+                if batch:
+                    self.commit(batch)
+                if stop:
+                    break
+        finally:
+            connection.close()
+
+    def take(self):
+        """Block for an intent, then collect whatever follows within the linger time"""
+        intent = self.intents.get()
+        if intent is _STOP:
+            return [], True
+        batch = [intent]
+        deadline = time.monotonic() + self.linger
+        while len(batch) < self.max_batch:
+            try:
+                intent = self.intents.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if intent is _STOP:
+                return batch, True
+            batch.append(intent)
+        return batch, False
+
+    def commit(self, batch):
+        """Run the batch in one transaction and resolve the futures after the commit"""
+        outcomes = []
+        try:
+            with transaction.atomic():
+                for future, fn, args, kwargs in batch:
+                    if not future.set_running_or_notify_cancel():
+                        continue
+                    try:
+                        with transaction.atomic():
+                            outcomes.append((future, fn(*args, **kwargs), None))
+                    except Exception as exc:
+                        outcomes.append((future, None, exc))
+        except Exception as exc:
+            logger.error(f'Writer batch of {len(batch)} failed to commit: {exc}')
+            for future, *_ in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+
+        self.batches += 1
+        self.committed += len(outcomes)
+        for future, result, exc in outcomes:
+            if exc is None:
+                future.set_result(result)
+            else:
+                future.set_exception(exc)
+
+
+def log_exception(future):
+    """Done-callback for intents nobody waits on"""
+    exc = future.exception()
+    if exc:
+        logger.error(f'Write intent failed: {exc}')
+
+
+_writer = None
+_writer_pid = None
+
+
+def get_writer():
+    """Writer of the current process"""
+    global _writer, _writer_pid
+    if _writer is None or _writer_pid != os.getpid():
+        _writer = Writer()
+        _writer_pid = os.getpid()
+    return _writer
+
+
+def shutdown_writer():
+    """Commit what the writer of the current process has queued, before the process exits"""
+    if _writer is not None and _writer_pid == os.getpid():
+        _writer.shutdown(wait=True)
@@ -1,5 +1,6 @@
 import os
 from celery import Celery
+from celery.signals import worker_process_shutdown
 
 # set the default Django settings module for the 'celery' program.
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tabby.settings')
@@ -16,6 +17,13 @@ app.config_from_object('django.conf:settings', namespace='CELERY')
 app.autodiscover_tasks()
 
 
+@worker_process_shutdown.connect
+def flush_writer(**kwargs):
+    """The ingest tasks do not wait for their writes, commit what is queued before the process exits"""
+    from tab.writer import shutdown_writer
+    shutdown_writer()
+
+
 @app.task(bind=True)
 def debug_task(self):
     print('Request: {0!r}'.format(self.request))
@@ -82,9 +82,23 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'OPTIONS': {
+            # seconds a writer waits on the lock before "database is locked"
+            'timeout': 20,
+        },
     }
 }
 
+# applied on every new sqlite connection (tab.apps), WAL lets the dashboard read while ingest writes
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    # negative is KiB, 64MB page cache
+    'cache_size': -64000,
+    'temp_store': 'MEMORY',
+    'busy_timeout': 20000,
+}
+
 CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
@@ -146,3 +160,25 @@ CELERYD_HIJACK_ROOT_LOGGER = False
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
+# the tasks storing fetched odds, books and results share one queue, consumed by a single
+# process writing through its Writer so sqlite never sees competing writers, see start_containers.sh
+CELERY_TASK_ROUTES = {
+    'tab.tasks.store_race': {'queue': 'ingest'},
+    'tab.tasks.upsert_results': {'queue': 'ingest'},
+    'betfair.tasks.store_market_books': {'queue': 'ingest'},
+}
+# beat syncs these into the django_celery_beat schedule next to the periodic tasks set up in the admin
+CELERY_BEAT_SCHEDULE = {
+    # refresh the shared Betfair session well before REFRESH_AHEAD runs out
+    'keep_alive_session': {
+        'task': 'betfair.tasks.keep_alive_session',
+        'schedule': 20 * 60,
+    },
+}
+
+# Columnar odds history archive of finished races, one .npy per kind per meeting date
+ODDS_ARCHIVE_DIR = os.path.join(BASE_DIR, 'odds')
+# delete archived FixedOdd and ParimutuelOdd rows from the database
+ODDS_ARCHIVE_PURGE = False
+# days raw odds ticks of finished races are kept once rolled up into minute bars
+ODDS_TICK_RETENTION_DAYS = 14